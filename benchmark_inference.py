@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+import torch
+import inference
+from inference import run_inference, load_model
+from benchmark_preprocess import synth_document
+from image_cache import image_loader
+from tasks import get_task
+
+# ----------------------------
+# 離線推理 throughput / latency benchmark
+# ----------------------------
+# 在暫存工作目錄中產生合成文件圖片、label 與 prompt，呼叫 run_inference 跑完整流程，
+# 以 JSON 輸出 images/sec、每份文件延遲的 p50/p95/p99、prefill / decode tokens/sec 與記憶體峰值。
+# 預設使用 stub_model（與 DeepSeek-VL2 相同介面的小型隨機模型），也可用 --model_path 指定真實模型。
+# --check_equivalence 則不量測速度，改為檢查 batch 推理（left padding）的輸出與逐張推理相同。
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 比較兩次結果時使用的指標：(JSON 路徑, 越大越好?)
+COMPARE_METRICS = [
+    (("images_per_sec",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("prefill", "tokens_per_sec"), True),
+    (("decode", "tokens_per_sec"), True),
+    (("peak_memory_mb",), False),
+]
+
+# ----------------------------
+# 合成資料（synth_document 與 benchmark_preprocess.py 共用）
+# ----------------------------
+def build_workspace(root, data_type, num_images, width, height, seed):
+    rng = random.Random(seed)
+    image_dir = os.path.join(root, "data", data_type)
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(os.path.join(root, "label"), exist_ok=True)
+    os.makedirs(os.path.join(root, "prompt"), exist_ok=True)
+    os.makedirs(os.path.join(root, "outputs", data_type), exist_ok=True)
+
+    filenames = []
+    for i in range(num_images):
+        name = f"doc_{i:05d}.jpg"
+        synth_document(rng, width, height).save(os.path.join(image_dir, name), quality=90)
+        filenames.append(name)
+    pd.DataFrame({"filename": filenames, "label": [{} for _ in filenames]}).to_pickle(
+        os.path.join(root, "label", f"{data_type}.pkl")
+    )
+    shutil.copy(os.path.join(REPO_DIR, "prompt", f"{data_type}.txt"), os.path.join(root, "prompt", f"{data_type}.txt"))
+
+# ----------------------------
+# 量測
+# ----------------------------
+class InferenceProbe:
+    """
+    - 包裝 inference.generate_batch 記錄每個 batch 的耗時（batch 內每份文件的延遲即為該 batch 的耗時）
+    - 在 language_model 註冊 forward hook：序列長度 > 1 為 prefill，= 1 為 decode，分別累計 token 數與時間
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.latencies = []
+        self.stats = {"prefill": [0, 0.0], "decode": [0, 0.0]}
+        self._start = None
+        self._handles = []
+        self._generate_batch = None
+
+    def _pre_hook(self, module, args, kwargs):
+        if self.model.device.type == "cuda":
+            torch.cuda.synchronize(self.model.device)
+        self._start = time.perf_counter()
+
+    def _hook(self, module, args, kwargs, output):
+        if self.model.device.type == "cuda":
+            torch.cuda.synchronize(self.model.device)
+        elapsed = time.perf_counter() - self._start
+        x = kwargs.get("inputs_embeds")
+        if x is None:
+            x = kwargs.get("input_ids", args[0] if args else None)
+        batch, length = x.shape[0], x.shape[1]
+        stage = "prefill" if length > 1 else "decode"
+        self.stats[stage][0] += batch * length
+        self.stats[stage][1] += elapsed
+
+    def __enter__(self):
+        lm = self.model.language_model
+        self._handles = [
+            lm.register_forward_pre_hook(self._pre_hook, with_kwargs=True),
+            lm.register_forward_hook(self._hook, with_kwargs=True),
+        ]
+        generate_batch = self._generate_batch = inference.generate_batch
+
+        def timed_generate_batch(model, processor, images, *args, **kwargs):
+            start = time.perf_counter()
+            results = generate_batch(model, processor, images, *args, **kwargs)
+            self.latencies.extend([time.perf_counter() - start] * len(images))
+            return results
+
+        inference.generate_batch = timed_generate_batch
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self._handles:
+            handle.remove()
+        inference.generate_batch = self._generate_batch
+
+    def stage(self, name):
+        tokens, seconds = self.stats[name]
+        return {"tokens": tokens, "seconds": seconds, "tokens_per_sec": tokens / seconds if seconds else 0.0}
+
+
+def load_benchmark_model(args, prompt_template, free_running=False):
+    if args.model_path:
+        return load_model(args.model_path, device=args.device)
+    from stub_model import load_stub_model
+    processor, model = load_stub_model(prompt_template, hidden_size=args.hidden_size,
+                                       num_layers=args.num_layers, image_grid=args.image_grid,
+                                       seed=args.seed, trailing_tokens=args.trailing_tokens,
+                                       free_running=free_running, dynamic_tokens=free_running)
+    if args.device:
+        model = model.to(args.device)
+    return processor, model
+
+def peak_memory_mb(device):
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 1024 ** 2
+    # Linux 的 ru_maxrss 單位為 KB（整個 process 的峰值）
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(args):
+    workspace = tempfile.mkdtemp(prefix="bench_inference_")
+    cwd = os.getcwd()
+    try:
+        build_workspace(workspace, args.data_type, args.images, args.width, args.height, args.seed)
+        os.chdir(workspace)
+
+        with open(os.path.join("prompt", f"{args.data_type}.txt"), "r", encoding="utf-8") as f:
+            prompt_template = f.read()
+        processor, model = load_benchmark_model(args, prompt_template)
+        if model.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(model.device)
+
+        run_kwargs = dict(
+            model_name="benchmark",
+            data_type=args.data_type,
+            prompt_name=args.data_type,
+            batch_size=args.batch_size,
+            max_batch_size=args.max_batch_size,
+            prefetch=args.prefetch,
+            prefetch_workers=args.prefetch_workers,
+            prefetch_mode=args.prefetch_mode,
+            image_cache_dir=os.path.join(".cache", "images") if args.image_cache else None,
+            feature_cache_dir=os.path.join(".cache", "features") if args.feature_cache else None,
+            checkpoint_every=0,
+            prompt_layout=args.prompt_layout,
+            max_new_tokens=args.max_new_tokens,
+            early_stop=not args.no_early_stop,
+            label_budget=args.label_budget,
+            decoding=args.decoding,
+            fast_decode=args.fast_decode,
+            processor=processor,
+            model=model,
+        )
+        quiet = contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w"))
+        with quiet:
+            if args.warm_cache:
+                # 先跑一次填滿圖片 / feature 快取，只量測第二次
+                run_inference(output_name="warmup", **run_kwargs)
+            with InferenceProbe(model) as probe:
+                start = time.perf_counter()
+                run_inference(output_name="benchmark", **run_kwargs)
+                wall = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    latencies_ms = np.array(probe.latencies) * 1000
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "verbose")},
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "device": str(model.device),
+            "model": args.model_path or "stub",
+        },
+        "images": args.images,
+        "wall_seconds": wall,
+        "images_per_sec": args.images / wall if wall else 0.0,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()) if len(latencies_ms) else 0.0,
+            "p50": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0.0,
+            "p95": float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else 0.0,
+            "p99": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else 0.0,
+        },
+        "prefill": probe.stage("prefill"),
+        "decode": probe.stage("decode"),
+        "peak_memory_mb": peak_memory_mb(model.device),
+    }
+
+# ----------------------------
+# batch 推理與逐張推理的輸出一致性
+# ----------------------------
+@torch.no_grad()
+def last_logits(model, processor, images, prompt_template, layout):
+    # prefill 後最後一個位置的 logits（即第一個產生的 token 的分數）；
+    # position_ids 與 HF generate 相同由 attention_mask 推得，left padding 不會平移位置
+    prepares = [
+        processor(conversations=inference.build_conversation(image, prompt_template, layout),
+                  images=[image], force_batchify=False, system_prompt="")
+        for image in images
+    ]
+    inputs = processor.batchify(prepares).to(model.device)
+    position_ids = (inputs.attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+    outputs = model.language_model(inputs_embeds=model.prepare_inputs_embeds(**inputs),
+                                   attention_mask=inputs.attention_mask, position_ids=position_ids, use_cache=False)
+    return outputs.logits[:, -1].float().cpu()
+
+def check_equivalence(args):
+    """
+    同一批圖片分別以 batch_size=1 與 batch_size=args.batch_size 呼叫 generate_batch：
+    - 解碼後的字串必須完全相同（greedy decode，沒有容許誤差）
+    - prefill 最後一個位置 logits 的最大絕對差必須不超過 args.logit_tolerance
+    stub 模型以 free_running 載入，輸出完全由輸入決定；left padding 的 mask 或位置若有錯，字串就會不同。
+    合成文件的尺寸都相同，所以依序裁成不同高度，讓 batch 內各列的圖片 token 數（序列長度）不同。
+    float32 下兩種 batch 大小只差在矩陣運算的累加順序（約 1e-5）；bfloat16 的差異大得多，
+    argmax 接近平手時可能翻轉，以真實模型在 GPU 上檢查時請放寬 --logit_tolerance 並檢視不一致的檔案。
+    """
+    workspace = tempfile.mkdtemp(prefix="bench_equivalence_")
+    try:
+        build_workspace(workspace, args.data_type, args.images, args.width, args.height, args.seed)
+        with open(os.path.join(workspace, "prompt", f"{args.data_type}.txt"), "r", encoding="utf-8") as f:
+            prompt_template = f.read()
+        processor, model = load_benchmark_model(args, prompt_template, free_running=True)
+        load_image, _ = image_loader(resample=get_task(args.data_type).resample, fast=args.fast_decode)
+        image_dir = os.path.join(workspace, "data", args.data_type)
+        filenames = sorted(os.listdir(image_dir))
+        images = []
+        for i, name in enumerate(filenames):
+            image = load_image(os.path.join(image_dir, name))
+            height = int(image.height * (0.4 + 0.6 * (i % 5) / 4))
+            images.append(image.crop((0, 0, image.width, height)))
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    def run(batch_size):
+        results, logits = [], []
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i + batch_size]
+            results += inference.generate_batch(model, processor, batch, prompt_template,
+                                                max_new_tokens=args.max_new_tokens, layout=args.prompt_layout)
+            logits.append(last_logits(model, processor, batch, prompt_template, args.prompt_layout))
+        return results, torch.cat(logits)
+
+    single, single_logits = run(1)
+    batched, batched_logits = run(args.batch_size)
+    mismatched = [name for name, a, b in zip(filenames, single, batched) if a != b]
+    max_logit_diff = float((single_logits - batched_logits).abs().max())
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "verbose")},
+        "model": args.model_path or "stub (free_running)",
+        "images": len(images),
+        "distinct_outputs": len(set(single)),
+        "mismatched": mismatched,
+        "max_logit_diff": max_logit_diff,
+        "logit_tolerance": args.logit_tolerance,
+        "passed": not mismatched and max_logit_diff <= args.logit_tolerance,
+    }
+
+# ----------------------------
+# 比較兩次 benchmark 結果
+# ----------------------------
+def metric_value(result, path):
+    for key in path:
+        result = result[key]
+    return result
+
+def compare(base, new, tolerance=0.05):
+    """回傳 (rows, regressed)；變差超過 tolerance（相對比例）的指標視為 regression。"""
+    rows, regressed = [], False
+    for path, higher_is_better in COMPARE_METRICS:
+        old, cur = metric_value(base, path), metric_value(new, path)
+        change = (cur - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = worse > tolerance
+        regressed |= flag
+        rows.append((".".join(path), old, cur, change, flag))
+    return rows, regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_type", type=str, default="損益表", help="使用哪個任務的 prompt")
+    parser.add_argument("--images", type=int, default=32, help="合成文件圖片數量")
+    parser.add_argument("--width", type=int, default=1654, help="合成圖片寬度（預設約 A4 200dpi）")
+    parser.add_argument("--height", type=int, default=2339, help="合成圖片高度")
+    parser.add_argument("--model_path", type=str, default=None, help="真實模型路徑（預設使用 stub 模型）")
+    parser.add_argument("--device", type=str, default=None, help="推理裝置（stub 預設 cpu）")
+    parser.add_argument("--hidden_size", type=int, default=256, help="stub 模型的 hidden size")
+    parser.add_argument("--num_layers", type=int, default=2, help="stub 模型的層數")
+    parser.add_argument("--image_grid", type=int, default=16, help="stub 模型每張圖片的 token 數為 image_grid 的平方")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--max_batch_size", type=int, default=None)
+    parser.add_argument("--prefetch", type=int, default=0)
+    parser.add_argument("--prefetch_workers", type=int, default=2)
+    parser.add_argument("--prefetch_mode", type=str, default="thread", choices=["thread", "process"])
+    parser.add_argument("--image_cache", action="store_true", help="啟用預處理圖片快取")
+    parser.add_argument("--feature_cache", action="store_true", help="啟用圖片 token embedding 快取")
+    parser.add_argument("--warm_cache", action="store_true", help="先跑一次填滿圖片 / feature 快取，只量測第二次")
+    parser.add_argument("--prompt_layout", type=str, default="image_first", choices=["image_first", "prompt_first"])
+    parser.add_argument("--max_new_tokens", type=int, default=512)
+    parser.add_argument("--no_early_stop", action="store_true", help="關閉 JSON 閉合即停止")
+    parser.add_argument("--label_budget", action="store_true", help="啟用依 label 長度統計的 token 上限")
+    parser.add_argument("--decoding", type=str, default="free", choices=["free", "schema"])
+    parser.add_argument("--fast_decode", action="store_true", help="JPEG draft mode 解碼（見 benchmark_preprocess.py）")
+    parser.add_argument("--trailing_tokens", type=int, default=0, help="stub 模型在 JSON 之後多產生的 token 數（模擬不停止的輸出）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="將結果 JSON 寫入此路徑")
+    parser.add_argument("--verbose", action="store_true", help="顯示 run_inference 的逐筆輸出")
+    parser.add_argument("--compare", type=str, nargs=2, metavar=("BASE", "NEW"), default=None, help="比較兩個結果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="比較時容許的相對變差比例")
+    parser.add_argument("--check_equivalence", action="store_true", help="檢查 --batch_size 的 batch 推理與逐張推理的輸出相同")
+    parser.add_argument("--logit_tolerance", type=float, default=1e-3, help="--check_equivalence 容許的 prefill logits 最大絕對差（float32）")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], "r", encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.compare[1], "r", encoding="utf-8") as f:
+            new = json.load(f)
+        rows, regressed = compare(base, new, args.tolerance)
+        for name, old, cur, change, flag in rows:
+            print(f"{name:<24} {old:>12.3f} → {cur:>12.3f}  {change:+.1%}{'  ⚠️ regression' if flag else ''}")
+        sys.exit(1 if regressed else 0)
+
+    if args.check_equivalence:
+        if args.batch_size < 2:
+            parser.error("--check_equivalence 需要 --batch_size >= 2")
+        result = check_equivalence(args)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        print(f"{'✅' if result['passed'] else '❌'} batch_size={args.batch_size} 與逐張推理："
+              f"{result['images'] - len(result['mismatched'])}/{result['images']} 份輸出相同 | "
+              f"logits 最大差 {result['max_logit_diff']:.2e}（容許 {args.logit_tolerance:.0e}）")
+        sys.exit(0 if result["passed"] else 1)
+
+    result = run_benchmark(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+# python benchmark_inference.py --images=64 --batch_size=4 --output=bench_base.json
+# python benchmark_inference.py --images=64 --batch_size=4 --prefetch=8 --output=bench_new.json
+# python benchmark_inference.py --compare bench_base.json bench_new.json
+# python benchmark_inference.py --check_equivalence --images=8 --batch_size=4 --max_new_tokens=64 --width=827 --height=1170
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image, ImageDraw
+from preprocess import preprocess_image, RESAMPLE_FILTERS
+
+# ----------------------------
+# 圖片預處理 micro-benchmark
+# ----------------------------
+# 比較 preprocess_image 原本的路徑（完整解碼 + 縮放）與 fast 路徑（JPEG draft mode / reducing_gap）：
+# 每張圖片的耗時、加速倍數，以及兩者輸出的像素差異（平均 / p99 / 最大絕對差與 PSNR）。
+# 預設使用合成的高解析度掃描文件（JPEG 與 PNG），也可用 --image_dir 指定實際資料，例如 data/存摺封面。
+
+# ----------------------------
+# 合成資料
+# ----------------------------
+def synth_document(rng, width, height):
+    # 白底、多行黑色「文字」區塊與表格線，接近掃描文件的壓縮特性
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    line_height = max(8, height // 60)
+    y = line_height
+    while y < height - line_height:
+        x = rng.randint(width // 20, width // 8)
+        while x < width * 0.9:
+            word = rng.randint(line_height, line_height * 6)
+            draw.rectangle([x, y, min(x + word, width - 1), y + line_height // 2], fill=(20, 20, 20))
+            x += word + rng.randint(line_height // 2, line_height * 2)
+        if rng.random() < 0.1:
+            draw.line([0, y + line_height, width, y + line_height], fill=(80, 80, 80), width=2)
+        y += line_height * 2
+    return image
+
+def synth_files(root, count, width, height, seed):
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        image = synth_document(rng, width, height)
+        for ext, kwargs in ((".jpg", {"quality": 90}), (".png", {})):
+            path = os.path.join(root, f"scan_{i:03d}{ext}")
+            image.save(path, **kwargs)
+            paths.append(path)
+    return paths
+
+# ----------------------------
+# 量測
+# ----------------------------
+def time_preprocess(path, repeat, **kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image = preprocess_image(path, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, image
+
+def pixel_diff(a, b):
+    a = np.asarray(a, dtype=np.int16)
+    b = np.asarray(b, dtype=np.int16)
+    diff = np.abs(a - b)
+    mse = float((diff.astype(np.float64) ** 2).mean())
+    return {
+        "mean_abs": float(diff.mean()),
+        "p99_abs": float(np.percentile(diff, 99)),
+        "max_abs": int(diff.max()),
+        "psnr_db": float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse),
+    }
+
+def run_benchmark(paths, max_size, resample, repeat):
+    per_format = {}
+    for path in paths:
+        fmt = Image.open(path).format
+        base_s, base = time_preprocess(path, repeat, max_size=max_size, resample=resample)
+        fast_s, fast = time_preprocess(path, repeat, max_size=max_size, resample=resample, fast=True)
+        if base.size != fast.size:
+            raise AssertionError(f"{path}: 輸出尺寸不同 {base.size} vs {fast.size}")
+        stats = per_format.setdefault(fmt, {"images": 0, "base_ms": [], "fast_ms": [], "diffs": []})
+        stats["images"] += 1
+        stats["base_ms"].append(base_s * 1000)
+        stats["fast_ms"].append(fast_s * 1000)
+        stats["diffs"].append(pixel_diff(base, fast))
+
+    report = {}
+    for fmt, stats in per_format.items():
+        base_ms, fast_ms = np.mean(stats["base_ms"]), np.mean(stats["fast_ms"])
+        diffs = stats["diffs"]
+        report[fmt] = {
+            "images": stats["images"],
+            "base_ms": float(base_ms),
+            "fast_ms": float(fast_ms),
+            "speedup": float(base_ms / fast_ms) if fast_ms else 0.0,
+            # 差異取所有圖片中最差的值
+            "mean_abs_diff": max(d["mean_abs"] for d in diffs),
+            "p99_abs_diff": max(d["p99_abs"] for d in diffs),
+            "max_abs_diff": max(d["max_abs"] for d in diffs),
+            "min_psnr_db": min(d["psnr_db"] for d in diffs),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image_dir", type=str, default=None, help="使用實際圖片（預設產生合成掃描文件）")
+    parser.add_argument("--images", type=int, default=8, help="合成圖片數量（JPEG 與 PNG 各一份）")
+    parser.add_argument("--width", type=int, default=3308, help="合成圖片寬度（預設約 A4 400dpi）")
+    parser.add_argument("--height", type=int, default=4678, help="合成圖片高度")
+    parser.add_argument("--max_size", type=int, default=1440)
+    parser.add_argument("--resample", type=str, default="lanczos", choices=list(RESAMPLE_FILTERS))
+    parser.add_argument("--repeat", type=int, default=3, help="每張圖片量測次數（取最快的一次）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max_mean_diff", type=float, default=None, help="平均絕對差超過此值（0~255）時以狀態碼 1 結束")
+    parser.add_argument("--output", type=str, default=None, help="將結果 JSON 寫入此路徑")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_preprocess_") as workspace:
+        if args.image_dir:
+            paths = sorted(os.path.join(args.image_dir, name) for name in os.listdir(args.image_dir))
+        else:
+            paths = synth_files(workspace, args.images, args.width, args.height, args.seed)
+        report = run_benchmark(paths, args.max_size, args.resample, args.repeat)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.max_mean_diff is not None and any(r["mean_abs_diff"] > args.max_mean_diff for r in report.values()):
+        sys.exit(1)
+
+# python benchmark_preprocess.py --images=8 --width=4000 --height=5600
+# python benchmark_preprocess.py --image_dir=data/存摺封面 --max_mean_diff=2
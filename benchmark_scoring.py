@@ -0,0 +1,126 @@
+import re
+import time
+import random
+import argparse
+import pandas as pd
+from scoring import score_fields, to_accuracy
+import importlib
+
+# evaluator 模組名稱含中文，用 importlib 載入
+loan = importlib.import_module("evaluation_貸款申請書")
+
+# ----------------------------
+# 參考實作：與原本逐列迴圈相同的邏輯
+# ----------------------------
+def number_cell(gt, pred):
+    try:
+        return 1 if gt == re.sub(r"[^\d]", "", pred) else 0
+    except:
+        return 0
+
+REFERENCE_CELLS = {
+    "償還方式": loan.repay_cell,
+    "申請人住宅地址": loan.address_cell,
+    "貸款用途": loan.purpose_cell,
+    "申請金額": number_cell,
+    "借款期間": number_cell,
+    "申請人子女人數": number_cell,
+    "申請人年資": number_cell,
+    "申請人年收入": number_cell,
+}
+
+def reference_accuracy(df, keys, cells=None):
+    # 與原本 evaluator 相同：for idx in range(total) + df['label'][idx] 逐列取值
+    cells = cells or {}
+    acc = {key: 0 for key in keys}
+    total = len(df)
+    for idx in range(total):
+        gt = df['label'][idx]
+        pred = df['mllm_result'][idx]
+        for key in keys:
+            if not isinstance(pred, dict) or key not in pred or key not in gt:
+                continue
+            if key in cells:
+                acc[key] += cells[key](gt[key], pred[key])
+            elif gt[key] == pred[key]:
+                acc[key] += 1
+    return {key: acc[key] / (total if total > 0 else 1) for key in keys}
+
+# ----------------------------
+# 合成資料
+# ----------------------------
+LOAN_VALUES = {
+    "償還方式": ["本息攤還(按月)", "本息攤還(按季)", "本息攤還", "到期一次清償", ""],
+    "申請人住宅地址": ["同身分證戶籍地址", "台北市信義區松仁路1號", "同身分證戶籍地址(台北市)", ""],
+    "貸款用途": ["購屋", "購屋；週轉金", "週轉金(營運)；購車", "投資(股票)", ""],
+    "申請金額": ["1200000", "1,200,000", "500000元", "NT$800,000"],
+}
+
+def synth_value(rng, key, choices):
+    r = rng.random()
+    if r < 0.02:
+        return None  # 型別不規則
+    if r < 0.03:
+        return [rng.choice(choices)]
+    return rng.choice(choices)
+
+def synth_records(rng, keys, values, rows, missing_rate=0.05):
+    gts, preds = [], []
+    for _ in range(rows):
+        gt, pred = {}, {}
+        for key in keys:
+            choices = values.get(key, ["A", "B", "C", "1000", 1000])
+            gt[key] = rng.choice(choices)
+            if rng.random() >= missing_rate:
+                pred[key] = gt[key] if rng.random() < 0.6 else synth_value(rng, key, choices)
+        gts.append(gt)
+        preds.append(pred if rng.random() > 0.01 else {})
+    return gts, preds
+
+def run_case(name, keys, rules, cells, values, rows, seed, check_rows):
+    rng = random.Random(seed)
+    gts, preds = synth_records(rng, keys, values, rows)
+
+    df = pd.DataFrame({"label": gts, "mllm_result": preds})
+
+    start = time.perf_counter()
+    to_accuracy(score_fields(df["label"].tolist(), df["mllm_result"].tolist(), keys, rules), len(df))
+    engine_time = time.perf_counter() - start
+
+    # 逐列版本太慢，只跑前 check_rows 筆並依比例推估全量時間
+    n = min(rows, check_rows)
+    head = df.iloc[:n].reset_index(drop=True)
+    start = time.perf_counter()
+    ref_acc = reference_accuracy(head, keys, cells)
+    ref_time = (time.perf_counter() - start) * rows / max(1, n)
+
+    check_acc = to_accuracy(score_fields(head["label"].tolist(), head["mllm_result"].tolist(), keys, rules), n)
+    mismatched = [key for key in keys if check_acc[key] != ref_acc[key]]
+
+    print(f"[{name}] rows={rows} | 向量化 {engine_time:.2f}s | 逐列（推估） {ref_time:.2f}s | "
+          f"加速 {ref_time / max(engine_time, 1e-9):.1f}x | 結果一致: {not mismatched}")
+    if mismatched:
+        print(f"  不一致欄位：{mismatched}")
+    return not mismatched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000, help="合成資料筆數")
+    parser.add_argument("--check_rows", type=int, default=100_000, help="與逐列參考實作比對的筆數（逐列時間依此推估）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    loan_keys = list(loan.FIELD_RULES) + [
+        "申請人姓名", "申請人身分證字號", "申請人生日", "申請人婚姻狀況", "申請人公司統編",
+        "申請人行動電話", "申請人住宅電話", "申請人公司電話", "保證人姓名", "保證人身分證字號", "保證人生日"
+    ]
+    balance_keys = ["營利事業名稱", "日期"] + [f"{1100 + i}項目" for i in range(31)]
+
+    ok = run_case("貸款申請書", loan_keys, loan.FIELD_RULES, REFERENCE_CELLS, LOAN_VALUES,
+                  args.rows, args.seed, args.check_rows)
+    ok &= run_case("資產負債表", balance_keys, None, None, {}, args.rows, args.seed, args.check_rows)
+    if not ok:
+        exit(1)
+
+# python benchmark_scoring.py --rows=1000000
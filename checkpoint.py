@@ -0,0 +1,66 @@
+import os
+import json
+import pickle
+from run_store import write_run, RUN_SUFFIX
+
+# ----------------------------
+# 逐筆寫入的推理結果 journal（append-only）
+# ----------------------------
+def read_journal(path):
+    # 回傳 {filename: mllm_result}；不完整的行（中斷時寫到一半）直接略過
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record["filename"]] = record["mllm_result"]
+    return done
+
+
+class ResultJournal:
+    """
+    每完成一筆就追加一行 JSON（filename / idx / mllm_result）並 flush，
+    程式中斷後可用 load() 取回已完成的結果，搭配 --resume 跳過這些檔案。
+    最後一行若因當機只寫了一半，load() 會直接略過。
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.done = self.load() if resume else {}
+        self._f = open(path, "a" if resume else "w", encoding="utf-8")
+        # 上次中斷在半行時先補換行，避免新紀錄接在壞掉的那行後面
+        if resume and self._f.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._f.write("\n")
+
+    def load(self):
+        return read_journal(self.path)
+
+    def append(self, idx, filename, result):
+        record = {"idx": idx if isinstance(idx, str) else int(idx), "filename": filename, "mllm_result": result}
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.done[filename] = result
+
+    def close(self):
+        self._f.close()
+
+
+def write_output(df, output_path, metadata=None):
+    # .parquet 交給 run_store；舊版 .pkl 先寫暫存檔再 rename，中途當機也不會留下壞掉的檔案
+    if output_path.endswith(RUN_SUFFIX):
+        write_run(df, output_path, metadata=metadata)
+        return
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(df, f)
+    os.replace(tmp_path, output_path)
@@ -0,0 +1,109 @@
+import os
+import json
+import pickle
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from hashing import file_sha256
+
+# ----------------------------
+# 重複 / 近似重複文件的分群（perceptual hash）
+# ----------------------------
+# 同一份文件的重新掃描或重複上傳，推理結果應該相同，只需要 generate 一次。
+# 每張圖片計算 pHash（縮成 hash_size*4 見方的灰階圖做 2D DCT，取左上 hash_size x hash_size 的低頻係數，
+# 大於中位數為 1），兩張圖的 hash 之間的 Hamming 距離不超過 threshold 即視為同一份文件。
+# 分群以每群的第一張（label 順序）為代表，新的圖片只和代表比較（不會 A≈B、B≈C 就把 A、C 串成一群）；
+# 內容完全相同的檔案一定同群。
+# 注意：同一種表單（例如同一家銀行的存摺封面）只差在小字時 pHash 可能非常接近，
+# threshold 請先以 python dedup.py --data_type=... 檢查分群結果再決定。
+HASH_SIZE = 16  # 256 bits
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+def dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+
+def phash(image_path, hash_size=HASH_SIZE):
+    # 回傳 packbits 後的 uint8 陣列（hash_size * hash_size / 8 bytes）
+    size = hash_size * 4
+    image = Image.open(image_path)
+    image.draft("L", (size * 2, size * 2))  # JPEG 只解碼到足夠的解析度，其他格式不受影響
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct = dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    return np.packbits((low > np.median(low)).flatten())
+
+def hamming(a, b):
+    # a: (n_bytes,)，b: (m, n_bytes) → 每一列與 a 的 Hamming 距離
+    return _POPCOUNT[np.bitwise_xor(b, a)].sum(axis=-1)
+
+def cluster(image_paths, threshold, hash_size=HASH_SIZE, workers=None):
+    """
+    回傳 (clusters, hashes)：clusters 為 list of list（image_paths 的 index，每群第一個為代表，依第一次出現的順序），
+    hashes 為每張圖片的 pHash（hex）。
+    """
+    workers = workers or min(32, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(file_sha256, image_paths))
+        hashes = list(pool.map(lambda path: phash(path, hash_size), image_paths))
+
+    clusters, by_digest = [], {}
+    leaders = np.empty((0, len(hashes[0]) if hashes else 0), dtype=np.uint8)
+    for i, (digest, h) in enumerate(zip(digests, hashes)):
+        if digest in by_digest:
+            clusters[by_digest[digest]].append(i)
+            continue
+        if len(leaders):
+            distances = hamming(h, leaders)
+            nearest = int(distances.argmin())
+            if distances[nearest] <= threshold:
+                clusters[nearest].append(i)
+                by_digest[digest] = nearest
+                continue
+        by_digest[digest] = len(clusters)
+        clusters.append([i])
+        leaders = np.vstack([leaders, h[None, :]])
+    return clusters, [h.tobytes().hex() for h in hashes]
+
+def dedup_rows(rows, image_dir, threshold, hash_size=HASH_SIZE):
+    """
+    rows 為 [(idx, row), ...]，回傳 (代表列, members)：members[代表的 idx] 為同群其他的 (idx, row)。
+    """
+    paths = [os.path.join(image_dir, row["filename"]) for _, row in rows]
+    clusters, _ = cluster(paths, threshold, hash_size)
+    leaders, members = [], {}
+    for group in clusters:
+        leader_idx, leader_row = rows[group[0]]
+        leaders.append((leader_idx, leader_row))
+        members[leader_idx] = [rows[i] for i in group[1:]]
+    return leaders, members
+
+def cluster_report(filenames, clusters):
+    # {代表檔名: [同群的其他檔名]}，只列出有重複的群
+    return {filenames[group[0]]: [filenames[i] for i in group[1:]] for group in clusters if len(group) > 1}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_type", type=str, required=True, help="資料類型，例如 存摺封面（依 label/{data_type}.pkl 的順序）")
+    parser.add_argument("--threshold", type=int, default=0, help="Hamming 距離上限（0~hash_size²，0 表示 pHash 完全相同）")
+    parser.add_argument("--hash_size", type=int, default=HASH_SIZE)
+    parser.add_argument("--output", type=str, default=None, help="將分群結果 JSON 寫入此路徑")
+    args = parser.parse_args()
+
+    with open(os.path.join("label", f"{args.data_type}.pkl"), "rb") as f:
+        filenames = pickle.load(f)["filename"].tolist()
+    clusters, _ = cluster([os.path.join("data", args.data_type, name) for name in filenames],
+                          args.threshold, args.hash_size)
+    report = cluster_report(filenames, clusters)
+    for leader, others in report.items():
+        print(f"{leader} ← {', '.join(others)}")
+    print("------")
+    print(f"🪞 {len(filenames)} 份文件分成 {len(clusters)} 群，可省下 {len(filenames) - len(clusters)} 次 generate")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+# python dedup.py --data_type=存摺封面 --threshold=12
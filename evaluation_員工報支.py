@@ -4,67 +4,41 @@ import json
 import os
 import re
 import argparse
+from scoring import score_fields, to_accuracy
+from parsing import load_parsed_results
+from run_store import resolve_run_path
+from label_store import labels_for_run
 
-def fix_mllm_result(val):
-    if isinstance(val, list):
-        return val
-    if isinstance(val, dict):
-        return [val]
-    if isinstance(val, str):
-        try:
-            val = val.replace("\n", " ").replace("\r", " ").replace("\t", " ").strip()
-            if not val.startswith("["):
-                val = "[" + val
-            if not val.endswith("]"):
-                val += "]"
-            parsed = json.loads(val)
-            if not isinstance(parsed, list):
-                return []
-            cleaned_list = []
-            for entry in parsed:
-                if not isinstance(entry, dict):
-                    continue
-                new_entry = {}
-                for k, v in entry.items():
-                    if k in ["賣方統編", "發票號碼"]:
-                        v = v.replace("-", "")
-                    if k == "憑證日期" and isinstance(v, str) and len(v) >= 10:
-                        v = v[:10]
-                    new_entry[k] = v
-                cleaned_list.append(new_entry)
-            return cleaned_list
-        except Exception as e:
-            print(f"[fix_mllm_result] 格式轉換失敗: {e}")
-            return []
-    return []
+# 評分欄位（tasks.py 註冊表中的 schema 也使用這份清單）
+FIELDS = ["憑證類別", "賣方統編", "發票號碼", "憑證日期", "金額", "稅額", "銷售額"]
 
-def evaluate_results(path):
-    df = pd.read_pickle(path)
-    df["mllm_result"] = df["mllm_result"].apply(fix_mllm_result)
-    eval_keys = ["憑證類別", "賣方統編", "發票號碼", "憑證日期", "金額", "稅額", "銷售額"]
-    acc = {k: 0 for k in eval_keys}
-    total = 0
-    for idx, row in df.iterrows():
-        gt_list = row["label"]
-        pred_list = row["mllm_result"]
+def score_frame(df):
+    """mllm_result 已解析的 df → ({key: 每列分數}, 分母)；完整評估與串流評估共用。"""
+    eval_keys = FIELDS
+    # 只評分 label 為非空 list 的列，各取第一張發票比對
+    gts, preds = [], []
+    # label 依 filename 對應（不依賴列順序）
+    for gt_list, pred_list in zip(labels_for_run(df, "員工報支", full=True), df["mllm_result"]):
         if not isinstance(gt_list, list) or not isinstance(pred_list, list):
             continue
         if len(gt_list) == 0:
             continue
-        total += 1
-        gt = gt_list[0]
-        pred = pred_list[0] if len(pred_list) > 0 else {}
-        for k in eval_keys:
-            if k in pred and k in gt and pred[k] == gt[k]:
-                acc[k] += 1
-    for k in acc:
-        acc[k] /= total if total > 0 else 1
-    return acc
+        gts.append(gt_list[0])
+        preds.append(pred_list[0] if len(pred_list) > 0 else {})
+    total = len(gts)
+
+    # 攤平成欄位後以向量運算評分
+    return score_fields(gts, preds, eval_keys), total
+
+def evaluate_results(path):
+    # 解析結果會快取在 output 檔中，同一份回應只解析一次
+    df = load_parsed_results(path, "員工報支")
+    scores, total = score_frame(df)
+    return to_accuracy(scores, total)
 
 # 給模組化呼叫用的函數
 def evaluate_expenses(pred_name: str):
-    pred_filename = pred_name if pred_name.endswith(".pkl") else pred_name + ".pkl"
-    file_path = os.path.join("outputs", "員工報支", pred_filename)
+    file_path = resolve_run_path(os.path.join("outputs", "員工報支"), pred_name)
     return evaluate_results(file_path)
 
 # 可單獨執行用法
@@ -3,94 +3,37 @@ import numpy as np
 import json
 import re
 import argparse
-
-# 銀行對應表
-bank_mapping = {
-    "first": "第一",
-    "post": ["郵局", "郵政"],
-    "chinatrust": "中信",
-    "esun": "玉山",
-    "union": "聯邦",
-    "cooperative": "合作金庫",
-    "shanghai": "上海",
-    "taiwanbusiness": "台企",
-    "bank": "銀行",
-    "cathay": "國泰",
-    "fubon": "富邦",
-    "fareastern": "遠東",
-    "land": "土地",
-    "taishin": "台新",
-    "taiwan": "台銀",
-    "changhwa": "彰化",
-    "huanan": "華南",
-    "citi": "花旗",
-    "mega": "兆豐",
-    "yuanta": "元大",
-    "jihsun": "日盛",
-    "chartered": "渣打",
-    "taichung": "台中",
-    "sinopac": "永豐",
-    "kingstown": "京城",
-    "kauohsing": "高雄"
-}
-
-def translate_bank(bank_name):
-    for eng, zh in bank_mapping.items():
-        if isinstance(zh, list):
-            if any(item in bank_name for item in zh):
-                return eng
-        else:
-            if zh in bank_name:
-                return eng
-    return bank_name
-
-def fix_mllm_result(val):
-    try:
-        if isinstance(val, str):
-            val = json.loads(val)
-        if not isinstance(val, dict):
-            return {}
-
-        result = {}
-        for key, value in val.items():
-            if "帳號" in key and isinstance(value, str):
-                result[key] = value.replace("-", "")
-            elif "銀行別" in key and isinstance(value, str):
-                result[key] = translate_bank(value)
-            else:
-                result[key] = value
-        return result
-    except Exception as e:
-        print(f"格式轉換失敗: {e}")
-        return {}
+from scoring import score_fields, to_accuracy
+from parsing import load_parsed_results
+from run_store import resolve_run_path
+from label_store import labels_for_run
+
+# 評分欄位（tasks.py 註冊表中的 schema 也使用這份清單）
+FIELDS = [
+    "戶名",
+    "銀行帳號",
+    "銀行別"
+]
+
+def score_frame(df):
+    """mllm_result 已解析的 df → ({key: 每列分數}, 分母)；完整評估與串流評估共用。"""
+    total = len(df)
+    acc_keys = FIELDS
+
+    # 攤平成欄位後以向量運算評分
+    # label 依 filename 對應，只讀取需要的欄位
+    gts = labels_for_run(df, "存摺封面", fields=acc_keys)
+    return score_fields(gts, df["mllm_result"].tolist(), acc_keys), total
 
 def evaluate_results(path):
-    df = pd.read_pickle(path)
-    acc = {
-        "戶名": 0,
-        "銀行帳號": 0,
-        "銀行別": 0
-    }
-    total = 0
-    acc_keys = list(acc.keys())
-
-    for idx in range(len(df)):
-        gt = df["label"][idx]
-        raw_pred = df["mllm_result"][idx]
-        pred = fix_mllm_result(raw_pred)
-        total += 1
-        for key in acc_keys:
-            if key in pred and gt[key] == pred[key]:
-                acc[key] += 1
-
-    for key in acc_keys:
-        acc[key] /= total
-    return acc
+    # 解析結果會快取在 output 檔中，同一份回應只解析一次
+    df = load_parsed_results(path, "存摺封面")
+    scores, total = score_frame(df)
+    return to_accuracy(scores, total)
 
 # 給模組化呼叫用的函數
 def evaluate_covers(pred_name: str):
-    pred_filename = pred_name if pred_name.endswith(".pkl") else pred_name + ".pkl"
-    file_path = f"outputs/存摺封面/{pred_filename}"
+    file_path = resolve_run_path("outputs/存摺封面", pred_name)
     return evaluate_results(file_path)
 
 # CLI 單獨執行
@@ -4,71 +4,55 @@ import argparse
 import os
 import json
 import re
-
-# ----------------------------
-# 字串轉 dict 並清理格式
-# ----------------------------
-def ensure_dict(val):
-    if isinstance(val, dict):
-        return val
-    if isinstance(val, str):
-        try:
-            val = val.replace("\n", " ").replace("\r", " ").replace("\t", " ").strip()
-            val = re.sub(r"%(?=[,\}\]])", "", val)
-            val = re.sub(r"(\d+)\.\d+", r"\1", val)
-            val = re.sub(r'"\s*(-?\d+,?\d+)(?=[,\}\]])', lambda m: '"' + m.group(1).replace(",", ""), val)
-            return json.loads(val)
-        except Exception:
-            return {}
-    return {}
+from scoring import score_fields, to_accuracy
+from parsing import load_parsed_results, parse_income as ensure_dict
+from run_store import resolve_run_path
+from label_store import labels_for_run
 
 # ----------------------------
 # 準確率評估函數（主邏輯）
 # ----------------------------
-def evaluate_results(pred_path):
-    df = pd.read_pickle(pred_path)
-
-    acc = {
-        "01營業收入總額": 0,
-        "04營業收入淨額": 0,
-        "05營業成本": 0,
-        "08營業費用及損失總額": 0,
-        "35投資收益": 0,
-        "36依所得稅法第42條規定取得之股利或盈餘": 0,
-        "38利息收入": 0,
-        "39租賃收入": 0,
-        "40處分資產利益": 0,
-        "43兌換盈餘": 0,
-        "44其他收入": 0,
-        "46利息支出": 0,
-        "47投資損失": 0,
-        "48處分資產損失": 0,
-        "51兌換損失": 0,
-        "53全併所得額": 0,
-        "59課稅所得額": 0,
-        "60本年度應納稅額": 0
-    }
+# 評分欄位（tasks.py 註冊表中的 schema 也使用這份清單）
+FIELDS = [
+    "01營業收入總額",
+    "04營業收入淨額",
+    "05營業成本",
+    "08營業費用及損失總額",
+    "35投資收益",
+    "36依所得稅法第42條規定取得之股利或盈餘",
+    "38利息收入",
+    "39租賃收入",
+    "40處分資產利益",
+    "43兌換盈餘",
+    "44其他收入",
+    "46利息支出",
+    "47投資損失",
+    "48處分資產損失",
+    "51兌換損失",
+    "53全併所得額",
+    "59課稅所得額",
+    "60本年度應納稅額"
+]
+
+def score_frame(df):
+    """mllm_result 已解析的 df → ({key: 每列分數}, 分母)；完整評估與串流評估共用。"""
+    total = len(df)
+    acc_keys = FIELDS
+
+    # 攤平成欄位後以向量運算評分
+    # label 依 filename 對應（不依賴列順序）
+    gts = [ensure_dict(gt) for gt in labels_for_run(df, "損益表", full=True)]
+    return score_fields(gts, df['mllm_result'].tolist(), acc_keys), total
 
-    total = 0
-    acc_keys = list(acc.keys())
-
-    for idx in range(len(df)):
-        gt = ensure_dict(df['label'][idx])
-        pred = ensure_dict(df['mllm_result'][idx])
-        total += 1
-
-        for key in acc_keys:
-            if key in pred and key in gt and gt[key] == pred[key]:
-                acc[key] += 1
-
-    for key in acc_keys:
-        acc[key] /= total if total > 0 else 1
-
-    return acc
+def evaluate_results(pred_path):
+    # 解析結果會快取在 output 檔中，同一份回應只解析一次
+    df = load_parsed_results(pred_path, "損益表")
+    scores, total = score_frame(df)
+    return to_accuracy(scores, total)
 
 # 給模組化呼叫用的函數
 def evaluate_income(pred_name: str):
-    pred_path = os.path.join("outputs", "損益表", f"{pred_name}.pkl")
+    pred_path = resolve_run_path(os.path.join("outputs", "損益表"), pred_name)
     return evaluate_results(pred_path)
 
 # ----------------------------
@@ -76,10 +60,10 @@ def evaluate_income(pred_name: str):
 # ----------------------------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--pred_name", type=str, required=True, help="模型推理結果的檔案名稱（不含副檔名），會自動讀取 outputs/損益表/{pred_name}.pkl")
+    parser.add_argument("--pred_name", type=str, required=True, help="模型推理結果的檔案名稱（不含副檔名），會自動讀取 outputs/損益表/{pred_name}.parquet（舊版 .pkl 會自動轉換）")
     args = parser.parse_args()
 
-    pred_path = os.path.join("outputs", "損益表", f"{args.pred_name}.pkl")
+    pred_path = resolve_run_path(os.path.join("outputs", "損益表"), args.pred_name)
 
     if not os.path.exists(pred_path):
         print(f" 找不到檔案：{pred_path}")
@@ -5,95 +5,146 @@ import pandas as pd
 import numpy as np
 import json
 import re
+from scoring import score_fields, to_accuracy, split_by_type, apply_scalar, is_str, str_series
+from parsing import load_parsed_results, NON_DIGIT_RE
+from run_store import resolve_run_path
+from label_store import labels_for_run
 
 # ----------------------------
-# 修正 mllm_result 結構
+# 特殊欄位規則：逐格版本（型別不規則的列使用，行為與原本的逐列迴圈相同）
 # ----------------------------
-def fix_mllm_result(val):
-    expected_keys = [
-        "申請金額", "借款期間", "償還方式", "貸款用途", "申請人姓名", "申請人身分證字號",
-        "申請人生日", "申請人婚姻狀況", "申請人子女人數", "申請人住宅地址", "申請人年資",
-        "申請人公司統編", "申請人年收入", "申請人行動電話", "申請人住宅電話", "申請人公司電話",
-        "保證人姓名", "保證人身分證字號", "保證人生日"
-    ]
-    if isinstance(val, dict):
-        return val
-    if isinstance(val, str):
-        try:
-            result = json.loads(val)
-            for key in expected_keys:
-                if key not in result:
-                    result[key] = ""
-            return result
-        except Exception:
-            return {}
-    return {}
+def repay_cell(gt, pred):
+    score = 0
+    try:
+        if "本息攤還" in gt and "本息攤還" in pred:
+            score += 0.5
+            index = gt.find('(')
+            if index != -1 and gt[index:] == pred[index:]:
+                score += 0.5
+        elif gt == pred:
+            score += 1
+    except:
+        pass
+    return score
+
+def address_cell(gt, pred):
+    try:
+        if "同身分證戶籍地址" in gt and "同身分證戶籍地址" in pred:
+            return 1
+        elif gt == pred:
+            return 1
+    except:
+        pass
+    return 0
+
+def purpose_cell(gt, pred):
+    try:
+        gt_items = gt.split("；")
+        matched_count = 0
+        for item in gt_items:
+            index = item.find("(")
+            if item.strip() in pred:
+                matched_count += 1
+            elif index != -1 and item[index:] in pred:
+                matched_count += 0.5
+        if len(gt_items) > 0:
+            return matched_count / len(gt_items)
+    except:
+        pass
+    return 0
 
 # ----------------------------
-# 主準確率計算函數
+# 特殊欄位規則：向量化版本（兩邊皆為字串的列）
 # ----------------------------
-def evaluate_results(path):
-    df = pd.read_pickle(path)
-    df["mllm_result"] = df["mllm_result"].apply(fix_mllm_result)
+def score_repay(gt, pred):
+    regular, irregular = split_by_type(gt, pred)
+    scores = apply_scalar(repay_cell, gt, pred, irregular)
+    g, p = str_series(gt, regular), str_series(pred, regular)
+    both_repay = (g.str.contains("本息攤還", regex=False) & p.str.contains("本息攤還", regex=False)).to_numpy()
+    index = g.str.find("(").to_numpy()
+    suffix_equal = np.array([
+        flag and i != -1 and gv[i:] == pv[i:]
+        for flag, i, gv, pv in zip(both_repay, index, g.to_numpy(), p.to_numpy())
+    ], dtype=bool)
+    scores[regular] = np.where(both_repay, 0.5 + 0.5 * suffix_equal, (g == p).to_numpy())
+    return scores
+
+def score_address(gt, pred):
+    regular, irregular = split_by_type(gt, pred)
+    scores = apply_scalar(address_cell, gt, pred, irregular)
+    g, p = str_series(gt, regular), str_series(pred, regular)
+    same_as_id = g.str.contains("同身分證戶籍地址", regex=False) & p.str.contains("同身分證戶籍地址", regex=False)
+    scores[regular] = (same_as_id | (g == p)).to_numpy()
+    return scores
+
+def score_purpose(gt, pred):
+    regular, irregular = split_by_type(gt, pred)
+    scores = apply_scalar(purpose_cell, gt, pred, irregular)
+    if not regular.any():
+        return scores
+    # 每個用途拆成一列，再依原本的列彙總
+    items = str_series(gt, regular).str.split("；").explode()
+    p = str_series(pred, regular).to_numpy()[items.index.to_numpy()]
+    item_index = items.str.find("(").to_numpy()
+    matched = np.array([
+        1 if item.strip() in pv else (0.5 if i != -1 and item[i:] in pv else 0)
+        for item, i, pv in zip(items.to_numpy(), item_index, p)
+    ], dtype=float)
+    grouped = pd.Series(matched, index=items.index).groupby(level=0)
+    scores[regular] = (grouped.sum() / grouped.size()).to_numpy()
+    return scores
+
+def score_number(gt, pred):
+    # 去除非數字字元後比對；pred 不是字串時原本 re.sub 會失敗，不計分
+    valid = gt.present & pred.present & is_str(pred)
+    scores = np.zeros(len(gt.values), dtype=float)
+    if valid.any():
+        pred_val = str_series(pred, valid).str.replace(NON_DIGIT_RE, "", regex=True).to_numpy(dtype=object)
+        scores[valid] = np.asarray(gt.values[valid] == pred_val, dtype=bool)
+    return scores
 
-    acc = {
-        "申請金額": 0, "借款期間": 0, "償還方式": 0, "貸款用途": 0, "申請人姓名": 0,
-        "申請人身分證字號": 0, "申請人生日": 0, "申請人婚姻狀況": 0, "申請人子女人數": 0,
-        "申請人住宅地址": 0, "申請人年資": 0, "申請人公司統編": 0, "申請人年收入": 0,
-        "申請人行動電話": 0, "申請人住宅電話": 0, "申請人公司電話": 0,
-        "保證人姓名": 0, "保證人身分證字號": 0, "保證人生日": 0
-    }
+FIELD_RULES = {
+    "償還方式": score_repay,
+    "申請人住宅地址": score_address,
+    "貸款用途": score_purpose,
+    "申請金額": score_number,
+    "借款期間": score_number,
+    "申請人子女人數": score_number,
+    "申請人年資": score_number,
+    "申請人年收入": score_number,
+}
 
+# 評分欄位（tasks.py 註冊表中的 schema 也使用這份清單）
+FIELDS = [
+    "申請金額", "借款期間", "償還方式", "貸款用途", "申請人姓名",
+    "申請人身分證字號", "申請人生日", "申請人婚姻狀況", "申請人子女人數",
+    "申請人住宅地址", "申請人年資", "申請人公司統編", "申請人年收入",
+    "申請人行動電話", "申請人住宅電話", "申請人公司電話",
+    "保證人姓名", "保證人身分證字號", "保證人生日"
+]
+
+# ----------------------------
+# 主準確率計算函數
+# ----------------------------
+def score_frame(df):
+    """mllm_result 已解析的 df → ({key: 每列分數}, 分母)；完整評估與串流評估共用。"""
     total = len(df)
-    acc_keys = list(acc.keys())
-
-    for idx in range(total):
-        gt = df['label'][idx]
-        pred = df['mllm_result'][idx]
-        for key in acc_keys:
-            try:
-                if key == "償還方式":
-                    if "本息攤還" in gt[key] and "本息攤還" in pred[key]:
-                        acc[key] += 0.5
-                        index = gt[key].find('(')
-                        if index != -1 and gt[key][index:] == pred[key][index:]:
-                            acc[key] += 0.5
-                    elif gt[key] == pred[key]:
-                        acc[key] += 1
-                elif key == "申請人住宅地址":
-                    if "同身分證戶籍地址" in gt[key] and "同身分證戶籍地址" in pred[key]:
-                        acc[key] += 1
-                    elif gt[key] == pred[key]:
-                        acc[key] += 1
-                elif key == "貸款用途":
-                    gt_items = gt[key].split("；")
-                    matched_count = 0
-                    for item in gt_items:
-                        index = item.find("(")
-                        if item.strip() in pred[key]:
-                            matched_count += 1
-                        elif index != -1 and item[index:] in pred[key]:
-                            matched_count += 0.5
-                    if len(gt_items) > 0:
-                        acc[key] += matched_count / len(gt_items)
-                elif key in ["申請金額", "借款期間", "申請人子女人數", "申請人年資", "申請人年收入"]:
-                    pred_val = re.sub(r"[^\d]", "", pred[key])
-                    if gt[key] == pred_val:
-                        acc[key] += 1
-                else:
-                    if gt[key] == pred[key]:
-                        acc[key] += 1
-            except:
-                pass
-
-    for key in acc_keys:
-        acc[key] /= total if total > 0 else 1
-
-    return acc
+    acc_keys = FIELDS
+
+    # 攤平成欄位後以向量運算評分
+    # label 依 filename 對應，只讀取需要的欄位
+    gts = labels_for_run(df, "貸款申請書", fields=acc_keys)
+    return score_fields(gts, df["mllm_result"].tolist(), acc_keys, FIELD_RULES), total
+
+def evaluate_results(path):
+    # 解析結果會快取在 output 檔中，同一份回應只解析一次
+    df = load_parsed_results(path, "貸款申請書")
+    scores, total = score_frame(df)
+    return to_accuracy(scores, total)
 
 # 模組化函數（給其他腳本匯入使用）
 def evaluate_loan(pred_name: str):
-    file_path = os.path.join("outputs", "貸款申請書", f"{pred_name}.pkl")
+    file_path = resolve_run_path(os.path.join("outputs", "貸款申請書"), pred_name)
     return evaluate_results(file_path)
 
 # ----------------------------
@@ -104,7 +155,7 @@ if __name__ == "__main__":
     parser.add_argument("--pred_name", type=str, required=True, help="模型推理檔名，不含副檔名")
     args = parser.parse_args()
 
-    file_path = os.path.join("outputs", "貸款申請書", f"{args.pred_name}.pkl")
+    file_path = resolve_run_path(os.path.join("outputs", "貸款申請書"), args.pred_name)
     if not os.path.exists(file_path):
         print(f"找不到檔案: {file_path}")
         sys.exit(1)
@@ -4,93 +4,70 @@ import argparse
 import re
 import sys
 import os
+from scoring import score_fields, to_accuracy
+from parsing import load_parsed_results
+from run_store import resolve_run_path
+from label_store import labels_for_run
 
-# ----------------------------
-# 將 mllm_result 字串轉為 dict
-# ----------------------------
-def fix_mllm_result(val):
-    if isinstance(val, dict):
-        return val
-    if isinstance(val, str):
-        try:
-            val = val.replace("\\n", " ").replace("\r", " ").replace("\\t", " ").strip()
-            kv_pairs = re.findall(r'"?([^":]+)"?\s*:\s*"?([^\{\}\"\':,]+)?"?', val)
-            result = {}
-            for k, v in kv_pairs:
-                v = v.replace(",", "")
-                if v.isdigit():
-                    result[k] = int(v)
-                else:
-                    result[k] = v
-            return result
-        except Exception as e:
-            print(f"[fix_mllm_result] 格式轉換失敗：{e}")
-            return {}
-    return {}
+# 評分欄位（tasks.py 註冊表中的 schema 也使用這份清單）
+FIELDS = [
+    "營利事業名稱",
+    "日期",
+    "1100流動資產",
+    "1111現金",
+    "1112銀行存款",
+    "1113約當現金",
+    "1151透過損益按公允價值衡量之金融資產-流動(附註三)",
+    "1158透過其他綜合損益按公允價值衡量之金融資產－流動(附註三)",
+    "1161按攤銷後成本衡量之金融資產-流動(附註三)",
+    "1121應收票據",
+    "1131應收帳款",
+    "1130存貨",
+    "1192業主(股東)往來",
+    "1200非流動資產",
+    "1612透過損益按公允價值衡量之金融資產-非流動(附註三)",
+    "1615透過其他綜合損益按公允價值衡量之金融資產-非流動(附註三)",
+    "1622按攤銷後成本衡量之金融資產-非流動(附註三)",
+    "1400不動產、廠房及設備(固定資產)",
+    "2100流動負債",
+    "2111銀行透支",
+    "2112銀行借款",
+    "2113應付短期票券",
+    "2120應付票據",
+    "2121應付帳款",
+    "2192業主(股東)往來",
+    "2200非流動負債",
+    "2210應付公司債",
+    "2220長期借款",
+    "2000負債總額",
+    "3100資本或股本(實收)",
+    "3300資本公積",
+    "3400保留盈餘",
+    "3000權益總額"
+]
 
 # ----------------------------
 # 主準確率計算函數
 # ----------------------------
-def evaluate_results(path):
-    df = pd.read_pickle(path)
-    df["mllm_result"] = df["mllm_result"].apply(fix_mllm_result)
-
-    acc = {
-        "營利事業名稱": 0,
-        "日期": 0,
-        "1100流動資產": 0,
-        "1111現金": 0,
-        "1112銀行存款": 0,
-        "1113約當現金": 0,
-        "1151透過損益按公允價值衡量之金融資產-流動(附註三)": 0,
-        "1158透過其他綜合損益按公允價值衡量之金融資產－流動(附註三)": 0,
-        "1161按攤銷後成本衡量之金融資產-流動(附註三)": 0,
-        "1121應收票據": 0,
-        "1131應收帳款": 0,
-        "1130存貨": 0,
-        "1192業主(股東)往來": 0,
-        "1200非流動資產": 0,
-        "1612透過損益按公允價值衡量之金融資產-非流動(附註三)": 0,
-        "1615透過其他綜合損益按公允價值衡量之金融資產-非流動(附註三)": 0,
-        "1622按攤銷後成本衡量之金融資產-非流動(附註三)": 0,
-        "1400不動產、廠房及設備(固定資產)": 0,
-        "2100流動負債": 0,
-        "2111銀行透支": 0,
-        "2112銀行借款": 0,
-        "2113應付短期票券": 0,
-        "2120應付票據": 0,
-        "2121應付帳款": 0,
-        "2192業主(股東)往來": 0,
-        "2200非流動負債": 0,
-        "2210應付公司債": 0,
-        "2220長期借款": 0,
-        "2000負債總額": 0,
-        "3100資本或股本(實收)": 0,
-        "3300資本公積": 0,
-        "3400保留盈餘": 0,
-        "3000權益總額": 0
-    }
-
+def score_frame(df):
+    """mllm_result 已解析的 df → ({key: 每列分數}, 分母)；完整評估與串流評估共用。"""
     total = len(df)
-    acc_keys = list(acc.keys())
-
-    for idx in range(total):
-        gt = df['label'][idx]
-        pred = df['mllm_result'][idx]
-        for key in acc_keys:
-            if isinstance(pred, dict) and key in pred and key in gt:
-                if gt[key] == pred[key]:
-                    acc[key] += 1
+    acc_keys = FIELDS
 
-    for key in acc_keys:
-        acc[key] /= total if total > 0 else 1
+    # 攤平成欄位後以向量運算評分
+    # label 依 filename 對應，只讀取需要的欄位
+    gts = labels_for_run(df, "資產負債表", fields=acc_keys)
+    return score_fields(gts, df['mllm_result'].tolist(), acc_keys), total
 
-    return acc
+def evaluate_results(path):
+    # 解析結果會快取在 output 檔中，同一份回應只解析一次
+    df = load_parsed_results(path, "資產負債表")
+    scores, total = score_frame(df)
+    return to_accuracy(scores, total)
 
 # 模組化呼叫函數
 def evaluate_balance(pred_name: str):
-    pred_filename = pred_name if pred_name.endswith(".pkl") else pred_name + ".pkl"
-    file_path = os.path.join("outputs", "資產負債表", pred_filename)
+    file_path = resolve_run_path(os.path.join("outputs", "資產負債表"), pred_name)
     return evaluate_results(file_path)
 
 # ----------------------------
@@ -101,8 +78,7 @@ if __name__ == "__main__":
     parser.add_argument("--pred_name", type=str, required=True, help="output 資料夾中的檔名，不含副檔名，例如：modelA")
     args = parser.parse_args()
 
-    pred_filename = args.pred_name if args.pred_name.endswith(".pkl") else args.pred_name + ".pkl"
-    file_path = os.path.join("outputs", "資產負債表", pred_filename)
+    file_path = resolve_run_path(os.path.join("outputs", "資產負債表"), args.pred_name)
 
     if not os.path.exists(file_path):
         print(f"找不到檔案：{file_path}")
@@ -1,67 +1,132 @@
 import os
 import argparse
-from inference import run_inference
-from evaluation_員工報支 import evaluate_expenses
-from evaluation_存摺封面 import evaluate_covers
-from evaluation_損益表 import evaluate_income
-from evaluation_貸款申請書 import evaluate_loan
-from evaluation_資產負債表 import evaluate_balance
+from tasks import DATA_TYPES, get_task
 
 def get_next_output_name(output_dir, model_name):
+    from run_store import RUN_SUFFIX, LEGACY_SUFFIX  # 依賴 pandas / pyarrow，用到時才載入
     os.makedirs(output_dir, exist_ok=True)
     base = model_name.replace("/", "_")
     i = 1
     while True:
-        filename = f"{base}_test{i}.pkl"
-        path = os.path.join(output_dir, filename)
-        if not os.path.exists(path):
-            return filename.replace(".pkl", ""), path
+        name = f"{base}_test{i}"
+        path = os.path.join(output_dir, name + RUN_SUFFIX)
+        # 舊版 .pkl 的編號也要避開
+        if not os.path.exists(path) and not os.path.exists(os.path.join(output_dir, name + LEGACY_SUFFIX)):
+            return name, path
         i += 1
 
 def evaluate_by_data_type(data_type, output_name):
-    if data_type == "員工報支":
-        return evaluate_expenses(output_name)
-    elif data_type == "存摺封面":
-        return evaluate_covers(output_name)
-    elif data_type == "損益表":
-        return evaluate_income(output_name)
-    elif data_type == "貸款申請書":
-        return evaluate_loan(output_name)
-    elif data_type == "資產負債表":
-        return evaluate_balance(output_name)
+    # evaluator 由任務註冊表在第一次使用時載入
+    return get_task(data_type).evaluate(output_name)
+
+def prompts_for_data_type(data_type, prompt_names=None):
+    return get_task(data_type).prompt_names(prompt_names)
+
+def main(model_name, data_type, image_cache_dir=None, prompt_names=None, live_eval=False, abort_below=None,
+         num_workers=1, devices=None, base_url=None, concurrency=8, fast_decode=False, feature_cache_dir=None,
+         response_cache_dir=None, dedup_threshold=None):
+    data_types = DATA_TYPES if data_type == "all" else [data_type]
+
+    # base_url 指定時改送 OpenAI 相容端點（model_name 為端點上的模型名稱），不載入本地模型
+    if base_url:
+        from http_backend import run_http_inference
+    else:
+        # 真的要推理時才載入 torch / transformers / deepseek_vl2
+        from inference import run_inference, load_model
+
+    # 模型與處理器只載入一次，所有任務與 prompt 共用（num_workers > 1 時由各 worker 自行載入）
+    if base_url or num_workers > 1:
+        processor = model = None
     else:
-        raise ValueError(f"不支援的資料類型：{data_type}")
+        model_path = os.path.join("model", model_name)
+        print(f"🔧 Loading model from: {model_path}")
+        processor, model = load_model(model_path)
 
-def main(model_name, data_type):
-    prompt_name = data_type  # 固定為 prompt/資料類型.txt
-    output_dir = os.path.join("outputs", data_type)
+    summary = []
+    for task in data_types:
+        for prompt_name in prompts_for_data_type(task, prompt_names):
+            output_dir = os.path.join("outputs", task)
+            output_name, full_path = get_next_output_name(output_dir, model_name)
+            print(f"\n[{task} / {prompt_name}] 將輸出結果儲存為：{full_path}")
 
-    output_name, full_path = get_next_output_name(output_dir, model_name)
-    print(f"將輸出結果儲存為：{full_path}")
+            if base_url:
+                live = run_http_inference(
+                    model_name=model_name,
+                    data_type=task,
+                    prompt_name=prompt_name,
+                    output_name=output_name,
+                    base_url=base_url,
+                    concurrency=concurrency,
+                    image_cache_dir=image_cache_dir,
+                    fast_decode=fast_decode
+                )
+            else:
+                # 執行推理（live_eval / abort_below 時邊推理邊評分）
+                live = run_inference(
+                    model_name=model_name,
+                    data_type=task,
+                    prompt_name=prompt_name,
+                    output_name=output_name,
+                    image_cache_dir=image_cache_dir,
+                    processor=processor,
+                    model=model,
+                    live_eval=live_eval,
+                    abort_below=abort_below,
+                    num_workers=num_workers,
+                    devices=devices,
+                    fast_decode=fast_decode,
+                    feature_cache_dir=feature_cache_dir,
+                    response_cache_dir=response_cache_dir,
+                    dedup_threshold=dedup_threshold
+                )
 
-    # 執行推理
-    run_inference(
-        model_name=model_name,
-        data_type=data_type,
-        prompt_name=prompt_name,
-        output_name=output_name
-    )
+            if live is not None and live.aborted:
+                # 提前中止的 run 只有部分結果，沿用串流評估的準確率
+                print(f"\n{output_name} 已提前中止，以已完成的 {live.scored} 筆計算準確率")
+                acc = live.accuracy()
+                prompt_name = f"{prompt_name}（已中止）"
+            else:
+                # 評估結果
+                print(f"\n開始評估結果：{output_name}")
+                acc = evaluate_by_data_type(task, output_name)
 
-    # 評估結果
-    print(f"\n開始評估結果：{output_name}")
-    acc = evaluate_by_data_type(data_type, output_name)
+            for k, v in acc.items():
+                print(f"{k}: {v:.2%}")
+            print("------")
+            avg = sum(acc.values()) / len(acc) if acc else 0.0
+            print(f"平均準確率: {avg:.2%}")
+            summary.append((task, prompt_name, output_name, avg))
 
-    for k, v in acc.items():
-        print(f"{k}: {v:.2%}")
-    print("------")
-    print(f"平均準確率: {sum(acc.values()) / len(acc):.2%}")
+    if len(summary) > 1:
+        print("\n========== 總結 ==========")
+        for task, prompt_name, output_name, avg in summary:
+            print(f"{task} | {prompt_name} | {output_name} | 平均準確率: {avg:.2%}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model", type=str, required=True, help="模型名稱，例如 deepseek-vl2-tiny")
-    parser.add_argument("--data_type", type=str, required=True, choices=["員工報支", "存摺封面", "損益表", "貸款申請書", "資產負債表"])
+    parser.add_argument("--data_type", type=str, required=True, choices=DATA_TYPES + ["all"], help="資料類型，all 表示依序執行全部五種任務")
+    parser.add_argument("--prompt_names", type=str, nargs="+", default=None, help="prompt 名稱列表，例如 損益表 損益表_v3（以資料類型開頭者套用於該任務，未指定則使用 prompt/資料類型.txt）")
+    parser.add_argument("--image_cache_dir", type=str, default=None, help="預處理圖片快取資料夾，例如 .cache/images（預設不啟用）")
+    parser.add_argument("--feature_cache_dir", type=str, default=None, help="圖片 token embedding 快取資料夾，例如 .cache/features（多個 prompt 共用 vision encoder 的結果）")
+    parser.add_argument("--response_cache_dir", type=str, default=None, help="推理結果快取資料夾，例如 .cache/responses（相同模型 / prompt / 圖片 / generate 設定的文件不再重跑）")
+    parser.add_argument("--dedup_threshold", type=int, default=None, help="重複 / 近似重複圖片只推理一次（pHash Hamming 距離上限，見 dedup.py；預設不分群）")
+    parser.add_argument("--fast_decode", action="store_true", help="JPEG 以 draft mode 縮小解碼（見 preprocess.py）")
+    parser.add_argument("--live_eval", action="store_true", help="推理時即時評分並定期印出各欄位準確率")
+    parser.add_argument("--abort_below", type=float, default=None, help="平均準確率在統計上確定達不到此門檻（0~1）時提前中止該次推理")
+    parser.add_argument("--num_workers", type=int, default=1, help="資料平行的 worker process 數量，每個 worker 各自載入一份模型")
+    parser.add_argument("--devices", type=str, nargs="+", default=None, help="各 worker 使用的裝置，例如 cuda:0 cuda:1")
+    parser.add_argument("--base_url", type=str, default=None, help="改用 OpenAI 相容端點推理，例如 http://localhost:8000/v1（--model 為端點上的模型名稱）")
+    parser.add_argument("--concurrency", type=int, default=8, help="使用 --base_url 時同時送出的 request 數量上限")
     args = parser.parse_args()
 
-    main(args.model, args.data_type)
+    main(args.model, args.data_type, image_cache_dir=args.image_cache_dir, prompt_names=args.prompt_names,
+         live_eval=args.live_eval, abort_below=args.abort_below, num_workers=args.num_workers, devices=args.devices,
+         base_url=args.base_url, concurrency=args.concurrency, fast_decode=args.fast_decode,
+         feature_cache_dir=args.feature_cache_dir, response_cache_dir=args.response_cache_dir,
+         dedup_threshold=args.dedup_threshold)
 
 # python execute.py --model=deepseek-vl2-tiny --data_type=損益表
+# python execute.py --model=deepseek-vl2-tiny --data_type=all --prompt_names 損益表 損益表_v3
+# python execute.py --model=deepseek-vl2-tiny --data_type=資產負債表 --abort_below=0.3
+# python execute.py --model=deepseek-vl2-tiny --data_type=損益表 --base_url=http://localhost:8000/v1 --concurrency=16
\ No newline at end of file
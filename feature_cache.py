@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from image_cache import NpyCache
+from hashing import weights_fingerprint
+
+# ----------------------------
+# 圖片 token embedding 的磁碟快取（跨 prompt 共用）
+# ----------------------------
+# prepare_inputs_embeds 會把圖片經過 vision encoder + projector 得到的 token，填入 images_seq_mask 的位置；
+# 這些 embedding 與 prompt 文字無關，同一批圖片換 prompt 重跑時結果完全相同。
+# FeatureCache 以「模型權重 hash + processor 設定 + 預處理設定 + 預處理後圖片的像素 hash」為 key，
+# 把每張圖片的 token embedding（images_seq_mask 位置的列，shape = [圖片 token 數, hidden]）存成 .npy。
+# 命中時只查 embedding table 取得文字部分，再把快取的圖片 token 放回原位置，不必重跑 vision encoder。
+# bfloat16 以 int16 的位元存檔（numpy 不支援 bfloat16），讀取時以 mmap 載入再 view 回原 dtype。
+# language_model 的權重不影響圖片 token，只換 LLM 微調版本時快取仍可共用。
+
+def processor_settings(processor):
+    # 影響圖片切塊與正規化的 processor 設定（只取簡單型別的屬性，例如 candidate_resolutions / patch_size / image_mean）
+    settings = {}
+    for name, value in sorted(vars(processor).items()):
+        if isinstance(value, (bool, int, float, str)):
+            settings[name] = value
+        elif isinstance(value, (list, tuple)) and all(isinstance(v, (bool, int, float, str, list, tuple)) for v in value):
+            settings[name] = value
+    return {"class": type(processor).__name__, **settings}
+
+
+class FeatureCache(NpyCache):
+    def __init__(self, model, processor, cache_dir=os.path.join(".cache", "features"), max_bytes=20 * 1024 ** 3,
+                 preprocess=None):
+        super().__init__(cache_dir, max_bytes)
+        self.model = model
+        # 與圖片無關的 key 部分，每個 run 固定
+        self._prefix = json.dumps({
+            "model": weights_fingerprint(model, vision_only=True),
+            "processor": processor_settings(processor),
+            "preprocess": preprocess or {},
+        }, sort_keys=True, ensure_ascii=False, default=str)
+
+    def image_key(self, image):
+        # 預處理後的像素（含尺寸與 mode），與 run 固定的部分一起 hash
+        h = hashlib.sha256(self._prefix.encode("utf-8"))
+        h.update(f"{image.mode}|{image.size}".encode("utf-8"))
+        h.update(image.tobytes())
+        return h.hexdigest()
+
+    def _load(self, key, dtype, device):
+        array = self.get(key)
+        if array is None:
+            return None
+        features = torch.from_numpy(np.array(array))
+        if dtype == torch.bfloat16:
+            features = features.view(torch.bfloat16)
+        return features.to(device=device, dtype=dtype)
+
+    def _store(self, key, features):
+        features = features.detach().cpu().contiguous()
+        if features.dtype == torch.bfloat16:
+            features = features.view(torch.int16)
+        self.put(key, features.numpy())
+
+    def prepare_inputs_embeds(self, inputs, image_keys):
+        """
+        與 model.prepare_inputs_embeds(**inputs) 結果相同；inputs 每一列一張圖片，image_keys 依列對應。
+        只有未命中的列才經過 vision encoder（取出這些列另外呼叫 prepare_inputs_embeds），結果再寫入快取。
+        """
+        images_seq_mask = inputs["images_seq_mask"]
+        embeds = self.model.language_model.get_input_embeddings()(inputs["input_ids"])
+        missing = []
+        for row, key in enumerate(image_keys):
+            mask = images_seq_mask[row]
+            features = self._load(key, embeds.dtype, embeds.device)
+            # token 數不符（例如 processor 改版）視為未命中
+            if features is None or features.shape[0] != int(mask.sum()):
+                missing.append(row)
+                continue
+            embeds[row, mask] = features
+
+        if missing:
+            rows = torch.tensor(missing, device=images_seq_mask.device)
+            subset = {
+                name: inputs[name][rows] if torch.is_tensor(inputs[name]) else inputs[name]
+                for name in inputs.keys()
+            }
+            computed = self.model.prepare_inputs_embeds(**subset)
+            for i, row in enumerate(missing):
+                embeds[row] = computed[i]
+                self._store(image_keys[row], computed[i][images_seq_mask[row]])
+        return embeds
+
+
+def prepare_inputs_embeds(model, inputs, feature_cache=None, image_keys=None):
+    # 沒有 feature_cache 時即為 model.prepare_inputs_embeds
+    if feature_cache is None:
+        return model.prepare_inputs_embeds(**inputs)
+    return feature_cache.prepare_inputs_embeds(inputs, image_keys)
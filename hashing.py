@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import threading
+
+# ----------------------------
+# 內容 hash（快取 key 使用）
+# ----------------------------
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# 權重 fingerprint 的磁碟快取：checkpoint 資料夾路徑 + 其中各檔案的大小與 mtime 相同時直接沿用
+FINGERPRINT_CACHE_PATH = os.path.join(".cache", "weights_fingerprints.json")
+
+def checkpoint_stamp(path):
+    # checkpoint 資料夾內各檔案的名稱、大小與 mtime（權重檔被覆寫或新增時改變）
+    entries = sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                     for entry in os.scandir(path) if entry.is_file())
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+def _load_fingerprint_cache(cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _store_fingerprint(cache_path, key, fingerprint):
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    cache = _load_fingerprint_cache(cache_path)
+    cache[key] = fingerprint
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_path)
+
+def weights_fingerprint(model, vision_only=False, cache_path=FINGERPRINT_CACHE_PATH):
+    """
+    模型權重的 hash：所有 parameter 與 buffer 的名稱、dtype、shape 與內容（dtype 不同的同一份權重視為不同模型）。
+    vision_only=True 時略過 language_model 的權重，只涵蓋影響圖片 token 的 vision encoder / projector。
+    結果記在 model 上，同一個 model 物件只算一次（execute.py 多個任務 / prompt 共用模型時不重算）；
+    由 inference.load_model 載入的模型另外依 checkpoint 路徑、檔案 mtime 與 dtype 記在 cache_path，
+    之後的 run 不必再把所有權重搬到 CPU 計算。
+    """
+    import torch
+    fingerprints = model.__dict__.setdefault("_weights_fingerprints", {})
+    if vision_only in fingerprints:
+        return fingerprints[vision_only]
+    checkpoint = model.__dict__.get("_checkpoint_path")
+    disk_key = None
+    if checkpoint and cache_path and os.path.isdir(checkpoint):
+        dtype = next(model.parameters()).dtype
+        disk_key = f"{os.path.abspath(checkpoint)}|{checkpoint_stamp(checkpoint)}|{dtype}|vision_only={vision_only}"
+        cached = _load_fingerprint_cache(cache_path).get(disk_key)
+        if cached:
+            fingerprints[vision_only] = cached
+            return cached
+    skip = set()
+    if vision_only:
+        skip = {id(tensor) for tensor in model.language_model.parameters()}
+        skip |= {id(tensor) for tensor in model.language_model.buffers()}
+    h = hashlib.sha256()
+    for name, tensor in list(model.named_parameters()) + list(model.named_buffers()):
+        if id(tensor) in skip:
+            continue
+        data = tensor.detach().cpu().contiguous()
+        if data.dtype == torch.bfloat16:
+            data = data.view(torch.int16)  # numpy 不支援 bfloat16，以相同位元的 int16 計算
+        h.update(f"{name}|{tensor.dtype}|{tuple(tensor.shape)}".encode("utf-8"))
+        h.update(data.numpy().tobytes())
+    fingerprints[vision_only] = h.hexdigest()
+    if disk_key is not None:
+        _store_fingerprint(cache_path, disk_key, fingerprints[vision_only])
+    return fingerprints[vision_only]
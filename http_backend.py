@@ -0,0 +1,279 @@
+import io
+import os
+import time
+import base64
+import pickle
+import random
+import asyncio
+import aiohttp
+from image_cache import image_loader
+from checkpoint import ResultJournal, write_output
+from run_store import RUN_SUFFIX
+from tasks import get_task
+
+# ----------------------------
+# OpenAI 相容 chat completions 端點的非同步推理
+# ----------------------------
+# 與 run_inference 使用相同的 label / prompt / 圖片預處理 / journal / output 格式，
+# 所以五個 evaluator 不需修改。同時送出的 request 數由 semaphore 限制，
+# 連線由 aiohttp 的 connection pool 重複使用；逾時、連線錯誤、429 與 5xx 會以指數退避重試。
+RETRY_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+FATAL_STATUS = {401, 403}
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def encode_image(image, image_format="JPEG", quality=90):
+    # 預處理後的 PIL 圖片 → data URL
+    buffer = io.BytesIO()
+    if image_format.upper() == "JPEG":
+        image.save(buffer, format="JPEG", quality=quality)
+        mime = "image/jpeg"
+    else:
+        image.save(buffer, format="PNG")
+        mime = "image/png"
+    return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+
+def build_payload(model, prompt_template, image_url, max_new_tokens=512):
+    # 與本地推理的 image_first 版面相同：圖片在前、prompt 在後，greedy decode
+    return {
+        "model": model,
+        "messages": [{
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": image_url}},
+                {"type": "text", "text": prompt_template},
+            ],
+        }],
+        "max_tokens": max_new_tokens,
+        "temperature": 0,
+    }
+
+def message_text(response):
+    content = response["choices"][0]["message"]["content"]
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return (content or "").strip()
+
+
+class HTTPBackend:
+    """
+    async with HTTPBackend(base_url, model, concurrency=8) as backend:
+        text = await backend.complete(payload)
+    """
+
+    def __init__(self, base_url, model, api_key=None, concurrency=8, timeout=120, max_retries=5,
+                 backoff=1.0, backoff_max=30.0):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.api_key = api_key
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "latency": 0.0}
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector, headers=headers, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    def _delay(self, attempt, retry_after=None):
+        delay = min(self.backoff_max, self.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    async def complete(self, payload):
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                retry_after = None
+                try:
+                    async with self._session.post(self.url, json=payload) as response:
+                        if response.status == 200:
+                            data = await response.json()
+                            try:
+                                text = message_text(data)
+                            except (KeyError, IndexError, TypeError, ValueError) as e:
+                                # 200 但內容不是 chat completion（例如 proxy 回傳的錯誤物件），與 5xx 一樣重試
+                                error = f"回應格式不符（{type(e).__name__}: {e}）：{str(data)[:200]}"
+                            else:
+                                self.stats["requests"] += 1
+                                self.stats["latency"] += time.perf_counter() - start
+                                return text
+                        else:
+                            body = (await response.text())[:200]
+                            if response.status in FATAL_STATUS:
+                                raise PermissionError(f"HTTP {response.status}：{body}")
+                            if response.status not in RETRY_STATUS:
+                                raise RequestFailed(f"HTTP {response.status}：{body}")
+                            error = f"HTTP {response.status}"
+                            retry_after = response.headers.get("Retry-After")
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    # ValueError：200 的 body 不是合法 JSON
+                    error = f"{type(e).__name__}: {e}"
+                if attempt < self.max_retries:
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(self._delay(attempt, retry_after))
+            raise RequestFailed(f"重試 {self.max_retries} 次仍失敗（{error}）")
+
+    def summary(self):
+        n = max(1, self.stats["requests"])
+        return (
+            f"requests={self.stats['requests']} | retries={self.stats['retries']} | "
+            f"failures={self.stats['failures']} | 平均延遲 {self.stats['latency'] / n:.2f}s"
+        )
+
+
+async def _run_rows(rows, image_dir, load_image, backend, prompt_template, max_new_tokens, image_format, on_result):
+    # concurrency 個 worker 從同一個 iterator 取列：解碼（thread）→ 送出 request，記憶體中最多只有 concurrency 張圖片
+    row_iter = iter(rows)
+
+    async def worker():
+        for idx, row in row_iter:
+            try:
+                image = await asyncio.to_thread(load_image, os.path.join(image_dir, row["filename"]))
+                image_url = await asyncio.to_thread(encode_image, image, image_format)
+                result = await backend.complete(build_payload(backend.model, prompt_template, image_url, max_new_tokens))
+            except PermissionError:
+                # 401 / 403：API key 錯誤或無權限，之後的 request 也會失敗，直接中止整個 run（PermissionError 是 OSError 的子類別，需先攔下）
+                raise
+            except (RequestFailed, OSError) as e:
+                backend.stats["failures"] += 1
+                print(f"[{idx}] {row['filename']} 失敗：{e}")
+                continue
+            on_result(idx, row, result)
+
+    async with backend:
+        await asyncio.gather(*(worker() for _ in range(backend.concurrency)))
+
+
+def run_http_inference(model_name, data_type, prompt_name, output_name, base_url, api_key=None, concurrency=8,
+                       timeout=120, max_retries=5, max_new_tokens=512, resume=False, checkpoint_every=50,
+                       image_cache_dir=None, image_cache_gb=20, image_format="JPEG", fast_decode=False):
+    """
+    以 OpenAI 相容端點推理，輸出與 run_inference 相同（outputs/{data_type}/{output_name}.parquet 的 mllm_result）。
+    model_name 為送給端點的模型名稱。失敗的列不寫入 journal，以 --resume 重新執行時會再送一次。
+    """
+    label_path = os.path.join("label", f"{data_type}.pkl")
+    image_dir = os.path.join("data", data_type)
+    prompt_path = get_task(data_type).prompt_path(prompt_name)
+    output_path = os.path.join("outputs", data_type, f"{output_name}{RUN_SUFFIX}")
+    journal_path = os.path.join("outputs", data_type, f"{output_name}.journal.jsonl")
+
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        prompt_template = f.read()
+    with open(label_path, "rb") as f:
+        df = pickle.load(f)
+    if "mllm_result" not in df.columns:
+        df["mllm_result"] = ""
+
+    run_metadata = {
+        "model": model_name,
+        "data_type": data_type,
+        "prompt_name": prompt_name,
+        "prompt_layout": "image_first",
+        "backend": "http",
+        "base_url": base_url,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    journal = ResultJournal(journal_path, resume=resume)
+    rows = []
+    for idx, row in df.iterrows():
+        if row["filename"] in journal.done:
+            df.at[idx, "mllm_result"] = journal.done[row["filename"]]
+        else:
+            rows.append((idx, row))
+    if resume:
+        print(f"♻️ Resume：已完成 {len(df) - len(rows)} 筆，剩餘 {len(rows)} 筆")
+
+    load_image, _ = image_loader(image_cache_dir, image_cache_gb, resample=get_task(data_type).resample,
+                                 fast=fast_decode)
+
+    done_count = 0
+
+    def on_result(idx, row, result):
+        nonlocal done_count
+        df.at[idx, "mllm_result"] = result
+        journal.append(idx, row["filename"], result)
+        print(f"[{idx}] {row['filename']} done.")
+        done_count += 1
+        if checkpoint_every and done_count % checkpoint_every == 0:
+            write_output(df, output_path, metadata=run_metadata)
+
+    backend = HTTPBackend(base_url, model_name, api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+                          concurrency=concurrency, timeout=timeout, max_retries=max_retries)
+    start = time.perf_counter()
+    try:
+        asyncio.run(_run_rows(rows, image_dir, load_image, backend, prompt_template, max_new_tokens,
+                              image_format, on_result))
+    finally:
+        # 401 / 403 中止時已完成的列仍留在 journal，修正 API key 後以 --resume 接續
+        journal.close()
+    elapsed = time.perf_counter() - start
+
+    write_output(df, output_path, metadata=run_metadata)
+    print(f"🌐 HTTP：{backend.summary()} | {done_count / elapsed if elapsed else 0:.2f} 筆/秒")
+    if backend.stats["failures"]:
+        print(f"⚠️ {backend.stats['failures']} 筆失敗，以 --resume 重新執行可只補送這些檔案")
+    print(f"\n 推理完成！結果儲存於：{output_path}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, required=True, help="端點上的模型名稱")
+    parser.add_argument("--base_url", type=str, required=True, help="OpenAI 相容 API 的 base URL，例如 http://localhost:8000/v1")
+    parser.add_argument("--api_key", type=str, default=None, help="API key（預設讀取環境變數 OPENAI_API_KEY）")
+    parser.add_argument("--data_type", type=str, required=True, help="資料類型，例如 損益表、貸款申請書")
+    parser.add_argument("--prompt_name", type=str, required=True, help="prompt 檔名（不含副檔名，對應 prompt/{prompt_name}.txt）")
+    parser.add_argument("--output_name", type=str, required=True, help="output 的檔名（不含副檔名，將儲存至 outputs/{data_type}/{output_name}.parquet）")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時送出的 request 數量上限")
+    parser.add_argument("--timeout", type=float, default=120, help="單一 request 的逾時秒數")
+    parser.add_argument("--max_retries", type=int, default=5, help="逾時、連線錯誤、429 / 5xx 的重試次數")
+    parser.add_argument("--max_new_tokens", type=int, default=512)
+    parser.add_argument("--image_format", type=str, default="JPEG", choices=["JPEG", "PNG"], help="送出圖片的編碼格式")
+    parser.add_argument("--image_cache_dir", type=str, default=None, help="預處理圖片快取資料夾，例如 .cache/images（預設不啟用）")
+    parser.add_argument("--image_cache_gb", type=float, default=20)
+    parser.add_argument("--fast_decode", action="store_true", help="JPEG 以 draft mode 縮小解碼（見 preprocess.py）")
+    parser.add_argument("--resume", action="store_true", help="從 journal 接續，跳過已完成（含先前失敗後補送成功）的檔案")
+    parser.add_argument("--checkpoint_every", type=int, default=50, help="每幾筆將結果寫入 output 一次（0 表示只在最後寫入）")
+    args = parser.parse_args()
+
+    run_http_inference(
+        model_name=args.model,
+        data_type=args.data_type,
+        prompt_name=args.prompt_name,
+        output_name=args.output_name,
+        base_url=args.base_url,
+        api_key=args.api_key,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        max_new_tokens=args.max_new_tokens,
+        resume=args.resume,
+        checkpoint_every=args.checkpoint_every,
+        image_cache_dir=args.image_cache_dir,
+        image_cache_gb=args.image_cache_gb,
+        image_format=args.image_format,
+        fast_decode=args.fast_decode
+    )
+
+# python stub_server.py --port=8000 --latency=0.5
+# python http_backend.py --model=stub --base_url=http://localhost:8000/v1 --data_type=損益表 --prompt_name=損益表 --output_name=stub-http-test --concurrency=16
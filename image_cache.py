@@ -0,0 +1,184 @@
+import os
+import threading
+import functools
+import numpy as np
+from PIL import Image
+from preprocess import preprocess_image
+from hashing import file_sha256
+
+# ----------------------------
+# .npy 檔的磁碟快取（content-addressed，LRU 淘汰）
+# ----------------------------
+class NpyCache:
+    """
+    key → cache_dir/{key}.npy。命中時以 np.load(mmap_mode="r") 讀取；
+    總容量超過 max_bytes 時依最後使用時間（mtime）淘汰最舊的檔案（LRU）。
+    """
+
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def __getstate__(self):
+        # process pool 需要 pickle，lock 不能跨 process 傳遞（各 process 的 stats 也各自獨立）
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def read(self, key):
+        # 命中時回傳 memory-mapped 陣列，否則回傳 None（檔案損毀視為未命中）；不更新 stats
+        cache_path = self.path(key)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            array = np.load(cache_path, mmap_mode="r")
+            os.utime(cache_path)  # 更新 LRU 時間
+        except (OSError, ValueError):
+            return None
+        return array
+
+    def write(self, key, array):
+        # 寫入快取檔並回傳 (路徑, bytes)；不更新 stats、不淘汰
+        cache_path = self.path(key)
+        # 先寫入暫存檔再 rename，避免並行讀到寫一半的檔案
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, cache_path)
+        return cache_path, os.path.getsize(cache_path)
+
+    def record_hit(self):
+        with self._lock:
+            self.stats["hits"] += 1
+
+    def record_put(self, cache_path, size):
+        # 容量統計與淘汰只在持有 stats 的這個物件上進行（process pool 的 worker 只負責讀寫檔案）
+        with self._lock:
+            self.stats["misses"] += 1
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=cache_path)
+
+    def get(self, key):
+        array = self.read(key)
+        if array is not None:
+            self.record_hit()
+        return array
+
+    def put(self, key, array):
+        self.record_put(*self.write(key, array))
+
+    def _evict(self, keep=None):
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            self.stats["evictions"] += 1
+
+    def summary(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / total if total > 0 else 0
+        return (
+            f"hits={self.stats['hits']} misses={self.stats['misses']} ({hit_rate:.2%}) | "
+            f"evictions={self.stats['evictions']} | size={self._total_bytes / 1024 ** 2:.1f} MB"
+        )
+
+
+# ----------------------------
+# 預處理後圖片的磁碟快取
+# ----------------------------
+class ImageCache(NpyCache):
+    """
+    以「原圖內容 hash + max_size + resample（+ fast / pages）」為 key，將縮放後的 RGB 陣列存成 .npy，
+    命中時不再經過 PIL 解碼與縮放。
+    process pool 的 prefetch 以 fetch 在 worker 中讀寫檔案，再由主 process 以 record 更新 stats 與淘汰
+    （worker 拿到的是 pickle 後的副本，在副本上累計的 stats / 容量不會回到主 process）。
+    """
+
+    def __init__(self, cache_dir=os.path.join(".cache", "images"), max_bytes=20 * 1024 ** 3,
+                 max_size=1440, resample="lanczos", fast=False, pages="first"):
+        super().__init__(cache_dir, max_bytes)
+        self.max_size = max_size
+        self.resample = resample
+        self.fast = fast
+        self.pages = pages
+
+    def key(self, image_path):
+        # 預設設定的 key 與舊版相同，既有的快取仍可使用
+        key = f"{file_sha256(image_path)}_{self.max_size}_{self.resample}"
+        if self.fast:
+            key += "_fast"
+        if self.pages != "first":
+            key += f"_{self.pages}"
+        return key
+
+    def fetch(self, image_path):
+        """
+        回傳 (image, stored)：命中時 stored 為 None，否則為新寫入的 (路徑, bytes)。不更新 stats，可在 worker 中執行。
+        PIL 的 RGB 影像以每像素 4 bytes 儲存，fromarray 無法直接引用 memory-mapped 陣列，命中時仍會複製一次像素
+        （省下的是原圖解碼與縮放；process 模式回傳的圖片本來也要 pickle 複製）。
+        """
+        key = self.key(image_path)
+        pixels = self.read(key)
+        if pixels is not None:
+            return Image.fromarray(pixels, mode="RGB"), None
+
+        image = preprocess_image(image_path, max_size=self.max_size, resample=self.resample,
+                                 fast=self.fast, pages=self.pages)
+        return image, self.write(key, np.asarray(image, dtype=np.uint8))
+
+    def record(self, fetched):
+        # 在主 process 依 fetch 的結果更新 stats 與容量（必要時淘汰），回傳圖片
+        image, stored = fetched
+        if stored is None:
+            self.record_hit()
+        else:
+            self.record_put(*stored)
+        return image
+
+    def load(self, image_path):
+        return self.record(self.fetch(image_path))
+
+
+def image_loader(cache_dir=None, cache_gb=20, **options):
+    """
+    回傳 (load_image, image_cache)；options 為 preprocess_image 的參數（max_size / resample / fast / pages）。
+    cache_dir 有設定時經過 ImageCache，否則直接預處理（image_cache 為 None）。
+    """
+    if cache_dir:
+        image_cache = ImageCache(cache_dir, max_bytes=int(cache_gb * 1024 ** 3), **options)
+        return image_cache.load, image_cache
+    # partial 可以 pickle，process pool 的 prefetch 也能使用
+    return functools.partial(preprocess_image, **options), None
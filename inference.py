@@ -1,30 +1,247 @@
 import os
-import gc
+import json
 import pickle
+import time
+from collections import deque
 import pandas as pd
-from PIL import Image
 import torch
-from transformers import AutoModelForCausalLM
-from deepseek_vl2.models import DeepseekVLV2Processor, DeepseekVLV2ForCausalLM
+from transformers import StoppingCriteriaList
+from prefetch import ImagePrefetcher
+from preprocess import RESAMPLE_FILTERS, PAGE_MODES
+from image_cache import image_loader
+from feature_cache import FeatureCache, prepare_inputs_embeds
+from response_cache import ResponseCache
+from dedup import dedup_rows
+from checkpoint import ResultJournal, write_output
+from run_store import RUN_SUFFIX
+from memory import MemoryManager, is_oom_error
+from prefix_cache import PromptPrefixCache, memoize_text_encoding
+from telemetry import Telemetry, device_sync, generated_length
+from tasks import get_task
+from sharding import shard_prefix, shard_rows
+from stopping import StructuredStop, expected_root, token_budget
+from schema_decoding import SchemaDecoder
 
-def run_inference(model_name, data_type, prompt_name, output_name):
+# ----------------------------
+# 準備 conversation prompt
+# ----------------------------
+def build_conversation(image, prompt_template, layout="image_first"):
+    # prompt_first：固定的 prompt 文字放在圖片之前，讓前綴可以共用 KV cache
+    if layout == "prompt_first":
+        content = f"{prompt_template}\n<|image|>"
+    else:
+        content = f"<|image|>\n{prompt_template}"
+    return [
+        {"role": "<|User|>", "content": content, "images": [image]},
+        {"role": "<|Assistant|>", "content": ""},
+    ]
+
+# ----------------------------
+# 一次推理多張圖片（left padding）
+# ----------------------------
+def generate_batch(model, processor, images, prompt_template, max_new_tokens=512,
+                   layout="image_first", prefix_cache=None, telemetry=None, output_root=None, schema_decoder=None,
+                   feature_cache=None):
+    """
+    將多張圖片各自編碼後以 processor.batchify 做 left padding，
+    再一次呼叫 generate，回傳與 images 順序相同的解碼字串。
+    batch 只有一張圖時等同原本逐筆推理的流程。
+    有 prefix_cache 時改為逐張沿用共用前綴的 KV cache。
+    telemetry 有提供時記錄 encode / prepare_inputs_embeds / generate / decode 各階段的耗時與 token 數。
+    output_root 為預期輸出的最外層括號（"{" 或 "["），有設定時該結構一閉合就停止產生。
+    schema_decoder 有提供時逐張以 schema 強制輸出 key 與括號，只由模型產生 value。
+    feature_cache 有提供時，已快取的圖片不再經過 vision encoder。
+    """
+    tokenizer = processor.tokenizer
+    telemetry = telemetry or Telemetry()
+    sync = device_sync(model.device)
+
+    image_keys = None
+    if feature_cache is not None:
+        with telemetry.span("image_hash"):
+            image_keys = [feature_cache.image_key(image) for image in images]
+
+    if prefix_cache is not None or schema_decoder is not None:
+        results = []
+        for i, image in enumerate(images):
+            with telemetry.span("encode") as span:
+                inputs = processor(
+                    conversations=build_conversation(image, prompt_template, layout),
+                    images=[image],
+                    force_batchify=True,
+                    system_prompt=""
+                )
+                span["input_tokens"] = inputs.attention_mask.sum(dim=1).tolist()
+                inputs = inputs.to(model.device)
+            telemetry.count(input_tokens=sum(span["input_tokens"]))
+            inputs_embeds = None
+            if feature_cache is not None:
+                with telemetry.span("prepare_inputs_embeds", sync=sync):
+                    inputs_embeds = feature_cache.prepare_inputs_embeds(inputs, image_keys[i:i + 1])
+            if schema_decoder is not None:
+                results.append(schema_decoder.generate(inputs, max_new_tokens=max_new_tokens, telemetry=telemetry,
+                                                       prefix_cache=prefix_cache, inputs_embeds=inputs_embeds))
+            else:
+                results.append(prefix_cache.generate(inputs, max_new_tokens=max_new_tokens, telemetry=telemetry,
+                                                     output_root=output_root, inputs_embeds=inputs_embeds))
+        return results
+
+    # 逐張編碼，再合併成 left-padded 的 batch（input_ids / attention_mask / images_seq_mask）
+    with telemetry.span("encode") as span:
+        prepares = [
+            processor(
+                conversations=build_conversation(image, prompt_template, layout),
+                images=[image],
+                force_batchify=False,
+                system_prompt=""
+            )
+            for image in images
+        ]
+        inputs = processor.batchify(prepares)
+        span["input_tokens"] = inputs.attention_mask.sum(dim=1).tolist()
+        inputs = inputs.to(model.device)
+    telemetry.count(input_tokens=sum(span["input_tokens"]))
+
+    with telemetry.span("prepare_inputs_embeds", sync=sync):
+        inputs_embeds = prepare_inputs_embeds(model, inputs, feature_cache, image_keys)
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    stopper = StructuredStop(tokenizer, len(images), root=output_root) if output_root else None
+    with telemetry.span("generate", sync=sync, batch_size=len(images), max_new_tokens=max_new_tokens) as span:
+        outputs = model.language_model.generate(
+            inputs_embeds=inputs_embeds,
+            attention_mask=inputs.attention_mask,
+            pad_token_id=pad_token_id,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            max_new_tokens=max_new_tokens,
+            stopping_criteria=StoppingCriteriaList([stopper]) if stopper else None,
+            do_sample=False,
+            use_cache=True
+        )
+        if stopper:
+            span["early_stopped"] = sum(stopper.stopped)
+
+    with telemetry.span("decode") as span:
+        ids = [output.cpu().tolist() for output in outputs]
+        span["output_tokens"] = [generated_length(row, tokenizer.eos_token_id, pad_token_id) for row in ids]
+        results = [tokenizer.decode(row, skip_special_tokens=True).strip() for row in ids]
+        if stopper:
+            results = [stopper.trim(i, text) for i, text in enumerate(results)]
+    telemetry.count(output_tokens=sum(span["output_tokens"]))
+    return results
+
+def timed_loads(image_paths, load_image):
+    # 未啟用 prefetch 時在主執行緒逐張解碼，並回傳每張的耗時
+    for path in image_paths:
+        start = time.perf_counter()
+        image = load_image(path)
+        yield path, image, time.perf_counter() - start
+
+# ----------------------------
+# 載入模型與處理器
+# ----------------------------
+def load_model(model_path, device=None):
+    """
+    device 預設為 cuda（若可用），否則使用 cpu；
+    cpu 上改用 float32，方便以小型模型在本機驗證批次推理結果。
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.bfloat16 if str(device).startswith("cuda") else torch.float32
+
+    # deepseek_vl2 只有載入真正的模型時才需要（benchmark_inference.py 的 stub 模型不依賴它）
+    from deepseek_vl2.models import DeepseekVLV2Processor, DeepseekVLV2ForCausalLM
+
+    processor = DeepseekVLV2Processor.from_pretrained(model_path)
+    model = DeepseekVLV2ForCausalLM.from_pretrained(model_path, trust_remote_code=True)
+    model = model.to(dtype).to(device).eval()
+    # 權重 fingerprint（快取 key）依 checkpoint 路徑與檔案 mtime 記在磁碟上，見 hashing.weights_fingerprint
+    model.__dict__["_checkpoint_path"] = model_path
+    return processor, model
+
+def run_inference(model_name, data_type, prompt_name, output_name, batch_size=1, max_batch_size=None, device=None,
+                  prefetch=0, prefetch_workers=2, prefetch_mode="thread",
+                  image_cache_dir=None, image_cache_gb=20, resume=False, checkpoint_every=50,
+                  prompt_layout="image_first", processor=None, model=None,
+                  live_eval=False, abort_below=None, report_every=50, write_telemetry=True, metrics_path=None,
+                  num_workers=1, devices=None, shard=None, max_new_tokens=512, early_stop=True, label_budget=False,
+                  decoding="free", resample=None, fast_decode=False, pages="first",
+                  feature_cache_dir=None, feature_cache_gb=20, response_cache_dir=None,
+                  dedup_threshold=None):
     # ----------------------------
     # 自動對應路徑
     # ----------------------------
     model_path = os.path.join("model", model_name)
     label_path = os.path.join("label", f"{data_type}.pkl")
     image_dir = os.path.join("data", data_type)
-    prompt_path = os.path.join("prompt", f"{prompt_name}.txt")
-    output_path = os.path.join("outputs", data_type, f"{output_name}.pkl")
+    prompt_path = get_task(data_type).prompt_path(prompt_name)
+    resample = resample or get_task(data_type).resample
+    output_path = os.path.join("outputs", data_type, f"{output_name}{RUN_SUFFIX}")
+    journal_path = os.path.join("outputs", data_type, f"{output_name}.journal.jsonl")
+    live_path = os.path.join("outputs", data_type, f"{output_name}.live.json")
+    telemetry_path = os.path.join("outputs", data_type, f"{output_name}.telemetry.jsonl")
+    dedup_path = os.path.join("outputs", data_type, f"{output_name}.dedup.json")
+
+    # 記錄在 output 檔中的 run 資訊
+    run_metadata = {
+        "model": model_name,
+        "data_type": data_type,
+        "prompt_name": prompt_name,
+        "prompt_layout": prompt_layout,
+        "early_stop": early_stop,
+        "decoding": decoding,
+        "preprocess": {"resample": resample, "fast_decode": fast_decode, "pages": pages},
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
 
     # ----------------------------
-    # 載入模型與處理器
+    # num_workers > 1：分成多個 shard 交給各自載入模型的 worker process，最後依 label 順序合併
     # ----------------------------
-    print(f"🔧 Loading model from: {model_path}")
-    processor = DeepseekVLV2Processor.from_pretrained(model_path)
-    tokenizer = processor.tokenizer
-    model = DeepseekVLV2ForCausalLM.from_pretrained(model_path, trust_remote_code=True)
-    model = model.to(torch.bfloat16).cuda().eval()
+    if num_workers > 1 and shard is None:
+        from sharding import run_sharded
+        run_kwargs = dict(
+            model_name=model_name, data_type=data_type, prompt_name=prompt_name, output_name=output_name,
+            batch_size=batch_size, max_batch_size=max_batch_size, prefetch=prefetch,
+            prefetch_workers=prefetch_workers, prefetch_mode=prefetch_mode, image_cache_dir=image_cache_dir,
+            image_cache_gb=image_cache_gb, checkpoint_every=checkpoint_every, prompt_layout=prompt_layout,
+            live_eval=live_eval, abort_below=abort_below, report_every=report_every,
+            write_telemetry=write_telemetry, metrics_path=metrics_path,
+            max_new_tokens=max_new_tokens, early_stop=early_stop, label_budget=label_budget, decoding=decoding,
+            resample=resample, fast_decode=fast_decode, pages=pages,
+            feature_cache_dir=feature_cache_dir, feature_cache_gb=feature_cache_gb,
+            response_cache_dir=response_cache_dir, dedup_threshold=dedup_threshold,
+        )
+        return run_sharded(run_kwargs, output_path, num_workers, devices=devices or ([device] if device else None),
+                           resume=resume, run_metadata=run_metadata)
+
+    # shard worker：journal / telemetry 寫在 {output_name}.shards/ 底下，不寫 output 檔（由主 process 合併）
+    telemetry_labels = {"data_type": data_type, "run": output_name}
+    if shard is not None:
+        prefix = shard_prefix(data_type, output_name, *shard)
+        journal_path = f"{prefix}.journal.jsonl"
+        live_path = f"{prefix}.live.json"
+        telemetry_path = f"{prefix}.telemetry.jsonl"
+        dedup_path = f"{prefix}.dedup.json"
+        telemetry_labels["shard"] = shard[0]
+        if metrics_path:
+            root, ext = os.path.splitext(metrics_path)
+            metrics_path = f"{root}.shard{shard[0]}{ext}"
+
+    # 各階段耗時與 token 數（JSONL，可選 Prometheus text format 的 metrics 檔）
+    telemetry = Telemetry(
+        telemetry_path if write_telemetry else None,
+        metrics_path=metrics_path,
+        labels=telemetry_labels,
+        resume=resume,
+    )
+
+    # ----------------------------
+    # 載入模型與處理器（呼叫端已載入時直接沿用）
+    # ----------------------------
+    if processor is None or model is None:
+        print(f"🔧 Loading model from: {model_path}")
+        with telemetry.span("model_load", model=model_name):
+            processor, model = load_model(model_path, device=device)
 
     # ----------------------------
     # 載入 prompt
@@ -32,6 +249,26 @@ def run_inference(model_name, data_type, prompt_name, output_name):
     with open(prompt_path, "r", encoding="utf-8") as f:
         prompt_template = f.read()
 
+    # prompt_first 版面：prompt tokenize 結果與前綴 KV cache 整個 run 共用
+    if prompt_layout == "prompt_first":
+        memoize_text_encoding(processor)
+        prefix_cache = PromptPrefixCache(model, processor.tokenizer)
+    else:
+        prefix_cache = None
+
+    # decoding=schema：key、引號與括號由任務 schema（與 evaluator 的評分欄位相同）直接餵入，只產生 value
+    if decoding == "schema":
+        schema_decoder = SchemaDecoder(model, processor.tokenizer, get_task(data_type).schema, prompt_template)
+    else:
+        schema_decoder = None
+
+    # feature_cache_dir 有設定時，圖片 token embedding 依模型權重 / 預處理設定 / 圖片快取，換 prompt 重跑時不再經過 vision encoder
+    if feature_cache_dir:
+        feature_cache = FeatureCache(model, processor, feature_cache_dir, max_bytes=int(feature_cache_gb * 1024 ** 3),
+                                     preprocess=run_metadata["preprocess"])
+    else:
+        feature_cache = None
+
     # ----------------------------
     # 載入 label.pkl
     # ----------------------------
@@ -42,66 +279,234 @@ def run_inference(model_name, data_type, prompt_name, output_name):
         df["mllm_result"] = ""
 
     # ----------------------------
-    # 圖片預處理
+    # 提前停止：輸出的 JSON 最外層閉合即結束（閉合之後的說明文字不會出現在 mllm_result 中）；
+    # label_budget=True 時 token 上限依整份 label 的長度統計（各 shard 相同），比 label 冗長的輸出會被截斷
     # ----------------------------
-    def preprocess_image(image_path, max_size=1440):
-        image = Image.open(image_path).convert("RGB")
-        width, height = image.size
-        if max(width, height) > max_size:
-            ratio = max_size / max(width, height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            image = image.resize((new_width, new_height), Image.LANCZOS)
-        return image
+    output_root = expected_root(prompt_template) if early_stop else None
+    requested_tokens = max_new_tokens
+    if label_budget and "label" in df.columns:
+        max_new_tokens, budget_stats = token_budget(df["label"], get_task(data_type).fields, processor.tokenizer,
+                                                    prompt_template, max_new_tokens=max_new_tokens)
+        print(f"🎯 Token 上限：{max_new_tokens}（label 最長 {budget_stats['max']}、中位數 {budget_stats['p50']}、"
+              f"範本 {budget_stats['template_tokens']} tokens）")
+    run_metadata["max_new_tokens"] = max_new_tokens
+
+    if shard is not None:
+        df = shard_rows(df, *shard).copy()
 
     # ----------------------------
-    # 推理主迴圈
+    # 逐筆 journal；resume 時先填回已完成的結果，只推理剩下的檔案
     # ----------------------------
+    journal = ResultJournal(journal_path, resume=resume)
+    rows = []
     for idx, row in df.iterrows():
-        image_path = os.path.join(image_dir, row["filename"])
-        image = preprocess_image(image_path)
+        if row["filename"] in journal.done:
+            df.at[idx, "mllm_result"] = journal.done[row["filename"]]
+        else:
+            rows.append((idx, row))
+    if resume:
+        print(f"♻️ Resume：已完成 {len(df) - len(rows)} 筆，剩餘 {len(rows)} 筆")
 
-        # 準備 conversation prompt
-        conversation = [
-            {"role": "<|User|>", "content": f"<|image|>\n{prompt_template}", "images": [image]},
-            {"role": "<|Assistant|>", "content": ""},
-        ]
+    # ----------------------------
+    # response_cache_dir 有設定時，模型 / prompt / 圖片 / generate 設定都相同的文件直接沿用先前的結果
+    # ----------------------------
+    if response_cache_dir:
+        # key 使用指定的 max_new_tokens（與資料集無關），依 label 調低的實際上限記在每筆結果中
+        generation = {"max_new_tokens": requested_tokens, "output_root": output_root, "decoding": decoding,
+                      "prompt_layout": prompt_layout, "do_sample": False}
+        if decoding == "schema":
+            generation["schema"] = get_task(data_type).schema
+        response_cache = ResponseCache(model, processor, prompt_template, generation,
+                                       preprocess=run_metadata["preprocess"], cache_dir=response_cache_dir,
+                                       budget=max_new_tokens, stop_root=output_root if decoding == "free" else None)
+        remaining = []
+        for idx, row in rows:
+            result = response_cache.get(os.path.join(image_dir, row["filename"]))
+            if result is None:
+                remaining.append((idx, row))
+                continue
+            df.at[idx, "mllm_result"] = result
+            journal.append(idx, row["filename"], result)
+        print(f"♻️ Response cache：命中 {len(rows) - len(remaining)} 筆，剩餘 {len(remaining)} 筆")
+        run_metadata["response_cache_hits"] = len(rows) - len(remaining)
+        rows = remaining
+    else:
+        response_cache = None
 
-        # 編碼成模型輸入
-        inputs = processor(
-            conversations=conversation,
-            images=[image],
-            force_batchify=True,
-            system_prompt=""
-        ).to(model.device)
+    # ----------------------------
+    # dedup_threshold 有設定時，重複 / 近似重複（pHash 距離不超過門檻）的圖片每群只推理代表的那一張，
+    # 結果套用到同群的每一列（各列仍以自己的 label 評分）；分群結果寫入 {output_name}.dedup.json
+    # ----------------------------
+    duplicates = {}
+    if dedup_threshold is not None and rows:
+        total = len(rows)
+        rows, duplicates = dedup_rows(rows, image_dir, dedup_threshold)
+        saved = total - len(rows)
+        print(f"🪞 Dedup：{total} 份文件分成 {len(rows)} 群，省下 {saved} 次 generate")
+        run_metadata["dedup"] = {"threshold": dedup_threshold, "clusters": len(rows), "saved_generate_calls": saved}
+        os.makedirs(os.path.dirname(dedup_path), exist_ok=True)
+        with open(dedup_path, "w", encoding="utf-8") as f:
+            json.dump({
+                row["filename"]: [member["filename"] for _, member in duplicates[idx]]
+                for idx, row in rows if duplicates[idx]
+            }, f, ensure_ascii=False, indent=2)
 
-        # 模型推理
-        inputs_embeds = model.prepare_inputs_embeds(**inputs)
-        outputs = model.language_model.generate(
-            inputs_embeds=inputs_embeds,
-            attention_mask=inputs.attention_mask,
-            bos_token_id=tokenizer.bos_token_id,
-            eos_token_id=tokenizer.eos_token_id,
-            max_new_tokens=512,
-            do_sample=False,
-            use_cache=True
+    # ----------------------------
+    # 串流評估：每個 batch 完成就更新各欄位準確率（設定 abort_below 時自動啟用）
+    # shard worker 中 df 只有該 shard 的列，是否中止由各 shard 依自己的結果判斷
+    # ----------------------------
+    if live_eval or abort_below is not None:
+        from live_eval import StreamingEvaluator
+        live = StreamingEvaluator(data_type, total_rows=len(df), export_path=live_path,
+                                  report_every=report_every, abort_below=abort_below)
+        live.update([
+            {"filename": row["filename"], "label": row["label"], "mllm_result": row["mllm_result"]}
+            for _, row in df.iterrows() if row["filename"] in journal.done
+        ])
+    else:
+        live = None
+
+    # ----------------------------
+    # 推理主迴圈（每次取 memory.batch_size 筆一起 generate）
+    # prefetch > 0 時由背景 pool 預先解碼接下來的 prefetch 張圖片
+    # ----------------------------
+    memory = MemoryManager(batch_size=batch_size, max_batch_size=max_batch_size, device=model.device)
+    image_paths = [os.path.join(image_dir, row["filename"]) for _, row in rows]
+
+    # image_cache_dir 有設定時，重複的圖片直接從 .npy 快取讀取
+    load_image, image_cache = image_loader(image_cache_dir, image_cache_gb,
+                                           resample=resample, fast=fast_decode, pages=pages)
+
+    if prefetch > 0:
+        # 有圖片快取時 worker 只讀寫快取檔，stats 與淘汰在主 process 進行（process 模式的 worker 拿到的是副本）
+        if image_cache is not None:
+            load_image, finish = image_cache.fetch, image_cache.record
+        else:
+            finish = None
+        prefetcher = ImagePrefetcher(image_paths, load_image, queue_depth=prefetch,
+                                     num_workers=prefetch_workers, mode=prefetch_mode, finish=finish)
+        # 解碼在背景 worker 中進行，與 generate 等階段重疊；stage 只記主執行緒等待圖片的時間（image_wait），
+        # worker 的解碼耗時記在 decode_seconds 欄位，不重複算進各階段的總和
+        image_stream = ((path, image, "image_wait", prefetcher.last_wait_time,
+                         {"decode_seconds": round(prefetcher.last_decode_time, 6)})
+                        for path, image in prefetcher)
+    else:
+        prefetcher = None
+        image_stream = ((path, image, "image_decode", seconds, {})
+                        for path, image, seconds in timed_loads(image_paths, load_image))
+
+    row_iter = iter(rows)
+    pending = deque()
+    done_count = 0
+    batch_index = 0
+    while True:
+        # OOM 後重試的 batch 沿用同一個編號，batch_index 只在成功後增加
+        telemetry.context = {"batch": batch_index + 1}
+        while len(pending) < memory.batch_size:
+            entry = next(image_stream, None)
+            if entry is None:
+                break
+            path, image, stage, seconds, fields = entry
+            telemetry.record(stage, seconds, filename=os.path.basename(path),
+                             width=image.width, height=image.height, **fields)
+            pending.append((next(row_iter), image))
+        if not pending:
+            break
+        batch = [pending.popleft() for _ in range(min(memory.batch_size, len(pending)))]
+
+        batch_start = time.perf_counter()
+        try:
+            with torch.no_grad():
+                results = generate_batch(model, processor, [image for _, image in batch], prompt_template,
+                                         max_new_tokens=max_new_tokens, layout=prompt_layout,
+                                         prefix_cache=prefix_cache, telemetry=telemetry, output_root=output_root,
+                                         schema_decoder=schema_decoder, feature_cache=feature_cache)
+        except Exception as e:
+            if not is_oom_error(e):
+                raise
+            # OOM：縮小 batch，將這批放回佇列最前面重試
+            memory.on_oom(e)
+            telemetry.record("oom", time.perf_counter() - batch_start, batch_size=len(batch))
+            pending.extendleft(reversed(batch))
+            continue
+        batch_index += 1
+
+        telemetry.record(
+            "batch", time.perf_counter() - batch_start,
+            filenames=[row["filename"] for (_, row), _ in batch],
+            image_sizes=[list(image.size) for _, image in batch],
         )
+        telemetry.count(documents=len(batch))
+        telemetry.flush()
+
+        # 依原順序寫回 mllm_result（dedup 時同群的其他列沿用代表的結果）
+        finished = []
+        for ((idx, row), _), result in zip(batch, results):
+            df.at[idx, "mllm_result"] = result
+            journal.append(idx, row["filename"], result)
+            if response_cache is not None:
+                response_cache.put(os.path.join(image_dir, row["filename"]), result)
+            print(f"[{idx}] {row['filename']} done.")
+            finished.append((row, result))
+            for member_idx, member in duplicates.get(idx, ()):
+                df.at[member_idx, "mllm_result"] = result
+                journal.append(member_idx, member["filename"], result)
+                print(f"[{member_idx}] {member['filename']} done（同 {row['filename']}）.")
+                finished.append((member, result))
+
+        if live is not None:
+            live.update([
+                {"filename": row["filename"], "label": row["label"], "mllm_result": result}
+                for row, result in finished
+            ])
+            if live.should_abort():
+                low, high = live.mean_interval()
+                print(f"⛔ 平均準確率上界 {high:.2%}（最多可達 {live.best_possible():.2%}）"
+                      f"低於門檻 {abort_below:.2%}，提前中止推理")
+                break
+
+        # 每 checkpoint_every 筆將目前結果整理成 pkl（dedup 時同群的列也算在內）
+        done_count += len(finished)
+        if shard is None and checkpoint_every and \
+                done_count // checkpoint_every != (done_count - len(finished)) // checkpoint_every:
+            write_output(df, output_path, metadata=run_metadata)
 
-        result = tokenizer.decode(outputs[0].cpu().tolist(), skip_special_tokens=True).strip()
-        df.at[idx, "mllm_result"] = result
-        print(f"[{idx}] {row['filename']} done.")
+        # 只有記憶體使用率超過門檻才清理
+        memory.after_batch()
 
-        torch.cuda.empty_cache()
-        gc.collect()
+    # 提前中止時關閉背景解碼（等待進行中的圖片完成）
+    image_stream.close()
+    print(f"🧠 Memory：{memory.summary()}")
+    if prefix_cache is not None:
+        print(f"🧩 Prefix cache：{prefix_cache.summary()}")
+    if schema_decoder is not None:
+        print(f"🔑 Schema decoding：{schema_decoder.summary()}")
+    if prefetcher is not None:
+        print(f"⏱️ Prefetch：{prefetcher.summary()}")
+    if image_cache is not None:
+        print(f"🗂️ Image cache：{image_cache.summary()}")
+    if feature_cache is not None:
+        print(f"🖼️ Feature cache：{feature_cache.summary()}")
+    if response_cache is not None:
+        print(f"📦 Response cache：{response_cache.summary()}")
+    if telemetry.enabled:
+        print(f"📊 Telemetry：{telemetry.summary()}")
+    telemetry.close()
 
     # ----------------------------
     # 儲存結果
     # ----------------------------
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "wb") as f:
-        pickle.dump(df, f)
+    journal.close()
+    if live is not None:
+        run_metadata["live_eval"] = {"rows_seen": live.seen, "aborted": live.aborted}
+        live.report()
+    if shard is not None:
+        print(f"\n shard {shard[0]}/{shard[1]} 推理完成！結果記錄於：{journal_path}")
+        return live
+    write_output(df, output_path, metadata=run_metadata)
 
     print(f"\n 推理完成！結果儲存於：{output_path}")
+    return live
 
 
 if __name__ == "__main__":
@@ -111,14 +516,74 @@ if __name__ == "__main__":
     parser.add_argument("--model", type=str, required=True, help="模型名稱，例如 deepseek-vl2-tiny（對應 model/{model}）")
     parser.add_argument("--data_type", type=str, required=True, help="資料類型，例如 損益表、貸款申請書（對應 label/{data_type}.pkl 和 data/{data_type}/）")
     parser.add_argument("--prompt_name", type=str, required=True, help="prompt 檔名（不含副檔名，對應 prompt/{prompt_name}.txt）")
-    parser.add_argument("--output_name", type=str, required=True, help="output 的檔名（不含副檔名，將儲存至 outputs/{data_type}/{output_name}.pkl）")
+    parser.add_argument("--output_name", type=str, required=True, help="output 的檔名（不含副檔名，將儲存至 outputs/{data_type}/{output_name}.parquet）")
+    parser.add_argument("--batch_size", type=int, default=1, help="每次 generate 的圖片數量（預設 1，即逐筆推理）")
+    parser.add_argument("--max_batch_size", type=int, default=None, help="記憶體充足時 batch size 可自動成長到的上限（預設等於 batch_size）")
+    parser.add_argument("--device", type=str, default=None, help="推理裝置，例如 cuda、cuda:1、cpu（預設自動選擇）")
+    parser.add_argument("--prefetch", type=int, default=0, help="背景預先解碼的圖片數量（queue 深度，0 表示不啟用）")
+    parser.add_argument("--prefetch_workers", type=int, default=2, help="背景解碼的 worker 數量")
+    parser.add_argument("--prefetch_mode", type=str, default="thread", choices=["thread", "process"], help="背景解碼使用 thread 或 process pool")
+    parser.add_argument("--image_cache_dir", type=str, default=None, help="預處理圖片快取資料夾，例如 .cache/images（預設不啟用）")
+    parser.add_argument("--image_cache_gb", type=float, default=20, help="圖片快取容量上限（GB），超過時淘汰最久未使用的檔案")
+    parser.add_argument("--feature_cache_dir", type=str, default=None, help="圖片 token embedding 快取資料夾，例如 .cache/features（換 prompt 重跑時不再經過 vision encoder）")
+    parser.add_argument("--feature_cache_gb", type=float, default=20, help="embedding 快取容量上限（GB）")
+    parser.add_argument("--response_cache_dir", type=str, default=None, help="推理結果快取資料夾，例如 .cache/responses（模型、prompt、圖片與 generate 設定相同的文件直接沿用結果）")
+    parser.add_argument("--dedup_threshold", type=int, default=None, help="重複圖片分群的 pHash Hamming 距離上限（256 bits，0 表示 hash 完全相同；預設不分群），每群只推理一次")
+    parser.add_argument("--resume", action="store_true", help="從 outputs/{data_type}/{output_name}.journal.jsonl 接續，跳過已完成的檔案")
+    parser.add_argument("--checkpoint_every", type=int, default=50, help="每幾筆將結果寫入 pkl 一次（0 表示只在最後寫入）")
+    parser.add_argument("--prompt_layout", type=str, default="image_first", choices=["image_first", "prompt_first"], help="prompt_first 會把 prompt 放在圖片前，並在整個 run 共用前綴的 KV cache")
+    parser.add_argument("--live_eval", action="store_true", help="推理時即時評分，定期印出並寫入 outputs/{data_type}/{output_name}.live.json")
+    parser.add_argument("--abort_below", type=float, default=None, help="平均準確率在統計上確定達不到此門檻（0~1）時提前中止推理（會自動啟用 live_eval）")
+    parser.add_argument("--report_every", type=int, default=50, help="即時評估每幾筆輸出一次")
+    parser.add_argument("--no_telemetry", action="store_true", help="不寫出 outputs/{data_type}/{output_name}.telemetry.jsonl")
+    parser.add_argument("--num_workers", type=int, default=1, help="資料平行的 worker process 數量，每個 worker 各自載入一份模型（預設 1）")
+    parser.add_argument("--devices", type=str, nargs="+", default=None, help="各 worker 使用的裝置，例如 cuda:0 cuda:1（預設每張 GPU 一個，無 GPU 時平分 CPU thread）")
+    parser.add_argument("--metrics_path", type=str, default=None, help="以 Prometheus text format 寫出累計指標的檔案，例如 metrics/vqa.prom")
+    parser.add_argument("--max_new_tokens", type=int, default=512, help="每份文件最多產生的 token 數")
+    parser.add_argument("--no_early_stop", action="store_true", help="輸出的 JSON 閉合後仍繼續產生，直到 EOS 或 token 上限")
+    parser.add_argument("--label_budget", action="store_true", help="依 label 長度統計調低 token 上限（比 label 冗長的輸出會被截斷，分數可能改變）")
+    parser.add_argument("--resample", type=str, default=None, choices=list(RESAMPLE_FILTERS), help="圖片縮放濾波器（預設使用任務設定，見 tasks.py）")
+    parser.add_argument("--fast_decode", action="store_true", help="JPEG 以 draft mode 縮小解碼、其他格式先整數倍縮小，再做最後的縮放")
+    parser.add_argument("--pages", type=str, default="first", choices=list(PAGE_MODES), help="多頁 TIFF：first 只取第一頁，stack 將各頁上下拼接")
+    parser.add_argument("--decoding", type=str, default="free", choices=["free", "schema"], help="schema：依任務欄位直接填入 key 與括號，只由模型產生 value（逐張推理）")
     args = parser.parse_args()
 
     run_inference(
         model_name=args.model,
         data_type=args.data_type,
         prompt_name=args.prompt_name,
-        output_name=args.output_name
+        output_name=args.output_name,
+        batch_size=args.batch_size,
+        max_batch_size=args.max_batch_size,
+        device=args.device,
+        prefetch=args.prefetch,
+        prefetch_workers=args.prefetch_workers,
+        prefetch_mode=args.prefetch_mode,
+        image_cache_dir=args.image_cache_dir,
+        image_cache_gb=args.image_cache_gb,
+        feature_cache_dir=args.feature_cache_dir,
+        feature_cache_gb=args.feature_cache_gb,
+        response_cache_dir=args.response_cache_dir,
+        dedup_threshold=args.dedup_threshold,
+        resume=args.resume,
+        checkpoint_every=args.checkpoint_every,
+        prompt_layout=args.prompt_layout,
+        live_eval=args.live_eval,
+        abort_below=args.abort_below,
+        report_every=args.report_every,
+        write_telemetry=not args.no_telemetry,
+        metrics_path=args.metrics_path,
+        num_workers=args.num_workers,
+        devices=args.devices,
+        max_new_tokens=args.max_new_tokens,
+        early_stop=not args.no_early_stop,
+        label_budget=args.label_budget,
+        decoding=args.decoding,
+        resample=args.resample,
+        fast_decode=args.fast_decode,
+        pages=args.pages
     )
 
 # python inference.py --model=deepseek-vl2-tiny --data_type=損益表 --prompt_name=損益表_v3 --output_name=DeepSeek-VL2-test
+# python inference.py --model=deepseek-vl2-tiny --data_type=損益表 --prompt_name=損益表_v3 --output_name=DeepSeek-VL2-test --batch_size=4
+# python inference.py --model=deepseek-vl2-tiny --data_type=損益表 --prompt_name=損益表_v3 --output_name=DeepSeek-VL2-test --num_workers=4
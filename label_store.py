@@ -0,0 +1,175 @@
+import os
+import json
+import pickle
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ----------------------------
+# 以 filename 為索引的攤平 label 儲存
+# ----------------------------
+# label/{data_type}.pkl 會轉成 label/{data_type}.parquet：
+# - filename 一欄，讀取時建立 filename → 列位置的 hash index
+# - 每個欄位一欄：值全為字串 / 全為整數時存成 string / int64，其餘以 JSON 文字儲存
+# - 員工報支等 list 形式的 label 以第一筆攤平，完整內容另存於 label 欄（JSON）
+# - schema 版本記在 metadata，版本不同或 pkl 較新時自動重建
+LABEL_SCHEMA_VERSION = 1
+LABEL_COLUMN = "label"
+
+# JSON 欄位中「沒有這個欄位」與「值為 null」要分開
+_ABSENT = object()
+
+def _flat_label(label):
+    if isinstance(label, list):
+        return label[0] if label and isinstance(label[0], dict) else {}
+    return label if isinstance(label, dict) else {}
+
+def _field_array(values):
+    present = [v for v in values if v is not _ABSENT]
+    if present and all(isinstance(v, str) for v in present):
+        return pa.array([None if v is _ABSENT else v for v in values], type=pa.string()), "string"
+    if present and all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+        return pa.array([None if v is _ABSENT else v for v in values], type=pa.int64()), "int64"
+    # 缺欄位存成 null，值本身為 None 時存成 "null" 字串
+    return pa.array([None if v is _ABSENT else json.dumps(v, ensure_ascii=False) for v in values], type=pa.string()), "json"
+
+def build_label_store(pkl_path, path):
+    with open(pkl_path, "rb") as f:
+        df = pickle.load(f)
+    labels = df["label"].tolist()
+    flat = [_flat_label(label) for label in labels]
+
+    fields = []
+    for record in flat:
+        for key in record:
+            if key not in fields:
+                fields.append(key)
+
+    arrays = [pa.array([str(name) for name in df["filename"]], type=pa.string())]
+    names = ["filename"]
+    field_types = {}
+    for field in fields:
+        array, field_type = _field_array([record.get(field, _ABSENT) for record in flat])
+        arrays.append(array)
+        names.append(field)
+        field_types[field] = field_type
+    arrays.append(pa.array([json.dumps(label, ensure_ascii=False) for label in labels], type=pa.string()))
+    names.append(LABEL_COLUMN)
+
+    metadata = {
+        b"schema_version": str(LABEL_SCHEMA_VERSION).encode(),
+        b"fields": json.dumps(field_types, ensure_ascii=False).encode("utf-8"),
+    }
+    table = pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(metadata)
+    # 暫存檔名依 process / thread 區分：多個評估 worker 可能同時重建同一個 label 檔
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class LabelStore:
+    """
+    依 filename 取 label，不依賴列的順序，可用於部分、打亂或分片後的 output。
+    只有用到的欄位才會從 parquet 讀出（memory-mapped），並快取在記憶體中。
+    """
+
+    def __init__(self, data_type, label_dir="label"):
+        self.data_type = data_type
+        self.path = os.path.join(label_dir, f"{data_type}.parquet")
+        pkl_path = os.path.join(label_dir, f"{data_type}.pkl")
+
+        if os.path.exists(pkl_path) and os.path.getsize(pkl_path) > 0 and self._needs_rebuild(pkl_path):
+            print(f"🔁 建立 label 索引：{self.path}")
+            build_label_store(pkl_path, self.path)
+
+        metadata = pq.read_schema(self.path).metadata or {}
+        self.field_types = json.loads(metadata.get(b"fields", b"{}"))
+        self.fields = list(self.field_types)
+        self._index = None
+        self._columns = {}
+
+    def _needs_rebuild(self, pkl_path):
+        if not os.path.exists(self.path):
+            return True
+        if os.path.getmtime(pkl_path) > os.path.getmtime(self.path):
+            return True
+        metadata = pq.read_schema(self.path).metadata or {}
+        return metadata.get(b"schema_version") != str(LABEL_SCHEMA_VERSION).encode()
+
+    @staticmethod
+    def exists(data_type, label_dir="label"):
+        # repo 內的 label pkl 可能只是空的佔位檔
+        return any(
+            os.path.exists(path) and os.path.getsize(path) > 0
+            for path in (os.path.join(label_dir, f"{data_type}{suffix}") for suffix in (".parquet", ".pkl"))
+        )
+
+    @property
+    def index(self):
+        if self._index is None:
+            filenames = self._column("filename")
+            self._index = {name: i for i, name in enumerate(filenames)}
+        return self._index
+
+    def _column(self, name):
+        if name not in self._columns:
+            values = pq.read_table(self.path, columns=[name], memory_map=True).column(name).to_pylist()
+            if name == LABEL_COLUMN:
+                values = [None if v is None else json.loads(v) for v in values]
+            elif self.field_types.get(name) == "json":
+                values = [_ABSENT if v is None else json.loads(v) for v in values]
+            else:
+                values = [_ABSENT if v is None else v for v in values]
+            self._columns[name] = values
+        return self._columns[name]
+
+    def positions(self, filenames):
+        # 找不到的 filename 回傳 None
+        return [self.index.get(str(name)) for name in filenames]
+
+    def column(self, field, filenames):
+        values = self._column(field)
+        return [None if i is None or values[i] is _ABSENT else values[i] for i in self.positions(filenames)]
+
+    def records(self, filenames, fields=None):
+        """依 filenames 順序回傳攤平的 label dict（只讀取 fields 指定的欄位，缺值的欄位不放入）。"""
+        fields = [f for f in (fields or self.fields) if f in self.field_types]
+        positions = self.positions(filenames)
+        columns = {field: self._column(field) for field in fields}
+        records = []
+        for i in positions:
+            if i is None:
+                records.append(None)
+                continue
+            records.append({field: columns[field][i] for field in fields if columns[field][i] is not _ABSENT})
+        return records
+
+    def labels(self, filenames):
+        # 完整的原始 label（例如員工報支的 list of dicts）
+        values = self._column(LABEL_COLUMN)
+        return [None if i is None else values[i] for i in self.positions(filenames)]
+
+
+_stores = {}
+
+def get_label_store(data_type, label_dir="label"):
+    # 同一個 process 內重複使用已載入的欄位與 index（串流評估每個 batch 都會呼叫）
+    pkl_path = os.path.join(label_dir, f"{data_type}.pkl")
+    mtime = os.path.getmtime(pkl_path) if os.path.exists(pkl_path) else None
+    key = (label_dir, data_type)
+    cached = _stores.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = _stores[key] = (mtime, LabelStore(data_type, label_dir))
+    return cached[1]
+
+def labels_for_run(df, data_type, fields=None, full=False):
+    """
+    評估時取得與 run 各列對應的 label：有 label 檔時依 filename join，
+    否則退回 run 本身的 label 欄。full=True 時回傳完整 label（不攤平）。
+    """
+    if not LabelStore.exists(data_type) or "filename" not in df.columns:
+        return df["label"].tolist()
+    store = get_label_store(data_type)
+    if full:
+        return store.labels(df["filename"].tolist())
+    return store.records(df["filename"].tolist(), fields)
@@ -0,0 +1,140 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from hashing import file_sha256
+from parsing import PARSER_VERSION
+from scoring import SCORING_VERSION
+from run_store import list_runs, resolve_run_path
+from label_store import LABEL_SCHEMA_VERSION, LabelStore, get_label_store
+from tasks import DATA_TYPES, get_task
+EVALUATOR_VERSION = f"parser{PARSER_VERSION}-scoring{SCORING_VERSION}"
+CACHE_PATH = os.path.join("outputs", "leaderboard.json")
+
+# ----------------------------
+# 排行榜快取
+# ----------------------------
+def load_cache(path=CACHE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_cache(cache, path=CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def label_version(data_type, label_dir="label"):
+    # 評估時 label 依 filename 從 label 檔取得（見 label_store.labels_for_run），label 修正後分數也要重新計算；
+    # 以 pkl（沒有時為 parquet）的內容 hash 加上 label 索引的 schema 版本表示。沒有 label 檔時 label 就在 output 內，由 output 的 hash 涵蓋
+    for suffix in (".pkl", ".parquet"):
+        path = os.path.join(label_dir, f"{data_type}{suffix}")
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            return f"schema{LABEL_SCHEMA_VERSION}-{file_sha256(path)}"
+    return None
+
+def score_file(data_type, path):
+    # 在 worker process 中執行；評估時可能寫回解析快取，所以 hash 在評估後才計算
+    acc = get_task(data_type).evaluate_results(path)
+    st = os.stat(path)
+    return {k: float(v) for k, v in acc.items()}, file_sha256(path), st.st_size, st.st_mtime
+
+# ----------------------------
+# 增量更新：只評估新增或內容有變動的 output（舊版 .pkl 會先轉成 .parquet）
+# ----------------------------
+def refresh(data_types=DATA_TYPES, workers=None, cache_path=CACHE_PATH):
+    cache = load_cache(cache_path)
+    jobs = []
+    for data_type in data_types:
+        output_dir = os.path.join("outputs", data_type)
+        entries = cache.setdefault(data_type, {})
+        if not os.path.isdir(output_dir):
+            continue
+        names = list_runs(output_dir)
+        labels = label_version(data_type)
+
+        # 已刪除的 output 從排行榜移除
+        for name in list(entries):
+            if name not in names:
+                del entries[name]
+
+        for name in names:
+            path = resolve_run_path(output_dir, name)
+            entry = entries.get(name)
+            if entry and entry["version"] == EVALUATOR_VERSION and entry.get("labels") == labels:
+                # 大小與修改時間沒變就不必重新計算 hash
+                st = os.stat(path)
+                if (st.st_size, st.st_mtime) == (entry.get("size"), entry.get("mtime")):
+                    continue
+                if entry["hash"] == file_sha256(path):
+                    entry["size"], entry["mtime"] = st.st_size, st.st_mtime
+                    continue
+            jobs.append((data_type, name, path, labels))
+
+    print(f"🏁 需要評估 {len(jobs)} 個檔案")
+    # label 索引（parquet）在主 process 先建好，worker 只讀取，不會同時重建同一個檔案
+    for data_type in sorted({data_type for data_type, *_ in jobs}):
+        if LabelStore.exists(data_type):
+            get_label_store(data_type)
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(score_file, data_type, path): (data_type, name, labels)
+                for data_type, name, path, labels in jobs
+            }
+            for future, (data_type, name, labels) in futures.items():
+                try:
+                    acc, file_hash, size, mtime = future.result()
+                except Exception as e:
+                    print(f"[{data_type}] {name} 評估失敗：{e}")
+                    continue
+                cache[data_type][name] = {
+                    "hash": file_hash,
+                    "size": size,
+                    "mtime": mtime,
+                    "version": EVALUATOR_VERSION,
+                    "labels": labels,
+                    "acc": acc,
+                    "mean": sum(acc.values()) / len(acc) if acc else 0.0,
+                }
+                print(f"[{data_type}] {name} 平均: {cache[data_type][name]['mean']:.2%}")
+    save_cache(cache, cache_path)
+    return cache
+
+def leaderboard_table(cache, data_type):
+    rows = [
+        {"output": name, "平均": entry["mean"], **entry["acc"]}
+        for name, entry in cache.get(data_type, {}).items()
+    ]
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows).sort_values("平均", ascending=False).reset_index(drop=True)
+
+# ----------------------------
+# 主程式：CLI 執行
+# ----------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_type", type=str, default="all", choices=DATA_TYPES + ["all"], help="要更新的任務，預設全部")
+    parser.add_argument("--workers", type=int, default=None, help="評估用的 process 數量（預設為 CPU 數）")
+    parser.add_argument("--top", type=int, default=10, help="每個任務顯示前幾名")
+    args = parser.parse_args()
+
+    data_types = DATA_TYPES if args.data_type == "all" else [args.data_type]
+    cache = refresh(data_types, workers=args.workers)
+
+    for data_type in data_types:
+        table = leaderboard_table(cache, data_type)
+        if table.empty:
+            continue
+        table.to_csv(os.path.join("outputs", data_type, "leaderboard.csv"), index=False, encoding="utf-8-sig")
+        print(f"\n========== {data_type} ==========")
+        for rank, row in table.head(args.top).iterrows():
+            print(f"{rank + 1:>3}. {row['output']} | 平均: {row['平均']:.2%}")
+
+# python leaderboard.py
+# python leaderboard.py --data_type=損益表 --workers=8
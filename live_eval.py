@@ -0,0 +1,144 @@
+import os
+import json
+import math
+import pandas as pd
+from parsing import parse_column
+from tasks import get_task
+
+# ----------------------------
+# 串流評估：推理進行中逐批評分
+# ----------------------------
+# 每個 batch 完成後把結果交給任務的 score_frame，累積各欄位與每列平均分數的總和與平方和，
+# 以 t 區間估計準確率的信賴上下界；設定 abort_below 時，
+# 平均準確率的上界低於門檻（或剩下的列全對也達不到）就提前中止推理。
+# 每列的平均分數是介於 0 和 1 之間的小數（不是答對 / 答錯），所以用分數本身的變異數，而不是二項分布的 p(1-p)。
+# 中止與否只看「這個 process 評分過的列」：num_workers > 1 時每個 shard worker 各自判斷，
+# total_rows 與 best_possible 也是該 shard 的列數，某個 shard 中止時其他 shard 仍會繼續。
+CONFIDENCE_Z = 1.96  # 95% 信賴區間
+
+def t_quantile(df, z=CONFIDENCE_Z):
+    # Student t 分位數（Cornish–Fisher 展開，df ≥ 3 時與精確值的差距小於 1%）
+    return z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+
+def mean_interval(total, squares, n, z=CONFIDENCE_Z):
+    """
+    n 個介於 0~1 的分數（總和 total、平方和 squares）的平均值信賴區間。
+    另外加入一個 0 與一個 1 的虛擬觀測值（分數只有 0 / 1 時即為 Agresti–Coull 區間），
+    避免前幾十列分數都相同時變異數為 0、區間縮成一點。
+    """
+    if n <= 0:
+        return 0.0, 1.0
+    m = n + 2
+    mean = (total + 1) / m
+    variance = max(0.0, (squares + 1 - m * mean * mean) / (m - 1))
+    half = t_quantile(m - 1, z) * math.sqrt(variance / m)
+    return max(0.0, mean - half), min(1.0, mean + half)
+
+
+class StreamingEvaluator:
+    def __init__(self, data_type, total_rows, export_path=None, report_every=50,
+                 abort_below=None, min_rows=30):
+        self.data_type = data_type
+        self.task = get_task(data_type)
+        self.total_rows = total_rows
+        self.export_path = export_path
+        self.report_every = report_every
+        self.abort_below = abort_below
+        self.min_rows = min_rows
+
+        self.seen = 0        # 已交給評估的列數
+        self.scored = 0      # 計入分母的列數（員工報支只計有 label 的列）
+        self.sums = {}       # 各欄位累積分數
+        self.squares = {}    # 各欄位分數的平方和
+        self.row_means = 0.0 # 每列平均分數的總和（用於平均準確率的區間）
+        self.row_squares = 0.0
+        self.aborted = False
+        self._last_report = 0
+
+    def update(self, records):
+        """records: [{"filename", "label", "mllm_result"(原始字串)}, ...]"""
+        if not records:
+            return
+        df = pd.DataFrame(records, columns=["filename", "label", "mllm_result"], dtype=object)
+        parsed, _, _ = parse_column(df["mllm_result"].tolist(), self.data_type)
+        df["mllm_result"] = pd.Series(parsed, index=df.index, dtype=object)
+        scores, total = self.task.score_frame(df)
+
+        for key, col in scores.items():
+            self.sums[key] = self.sums.get(key, 0.0) + float(col.sum())
+            self.squares[key] = self.squares.get(key, 0.0) + float((col * col).sum())
+        if scores and total:
+            per_row = sum(col for col in scores.values()) / len(scores)
+            self.row_means += float(per_row.sum())
+            self.row_squares += float((per_row * per_row).sum())
+        self.seen += len(records)
+        self.scored += total
+
+        if self.report_every and self.seen - self._last_report >= self.report_every:
+            self.report()
+
+    # ----------------------------
+    # 統計量
+    # ----------------------------
+    def accuracy(self):
+        n = self.scored
+        return {key: s / n if n else 0.0 for key, s in self.sums.items()}
+
+    def mean_interval(self):
+        return mean_interval(self.row_means, self.row_squares, self.scored)
+
+    def best_possible(self):
+        # 剩下的列全部答對時，最終平均準確率的上限
+        remaining = max(self.total_rows - self.seen, 0)
+        n = self.scored + remaining
+        return (self.row_means + remaining) / n if n else 1.0
+
+    def should_abort(self):
+        if self.abort_below is None or self.aborted:
+            return self.aborted
+        if self.best_possible() < self.abort_below:
+            self.aborted = True
+        elif self.scored >= self.min_rows and self.mean_interval()[1] < self.abort_below:
+            self.aborted = True
+        return self.aborted
+
+    def snapshot(self):
+        n = self.scored
+        low, high = self.mean_interval()
+        return {
+            "data_type": self.data_type,
+            "rows_seen": self.seen,
+            "rows_scored": n,
+            "total_rows": self.total_rows,
+            "mean": self.row_means / n if n else 0.0,
+            "mean_ci": [low, high],
+            "best_possible": self.best_possible(),
+            "abort_below": self.abort_below,
+            "aborted": self.aborted,
+            "fields": {
+                key: {"acc": acc, "ci": list(mean_interval(self.sums[key], self.squares[key], n))}
+                for key, acc in self.accuracy().items()
+            },
+        }
+
+    # ----------------------------
+    # 輸出
+    # ----------------------------
+    def report(self):
+        self._last_report = self.seen
+        snap = self.snapshot()
+        low, high = snap["mean_ci"]
+        worst = sorted(snap["fields"].items(), key=lambda item: item[1]["acc"])[:3]
+        worst_text = "、".join(f"{key} {v['acc']:.0%}" for key, v in worst)
+        print(f"📈 即時評估 {self.seen}/{self.total_rows}：平均 {snap['mean']:.2%} "
+              f"(95% CI {low:.2%}–{high:.2%})｜最低：{worst_text}")
+        self.export(snap)
+
+    def export(self, snap=None):
+        if not self.export_path:
+            return
+        snap = snap or self.snapshot()
+        tmp_path = f"{self.export_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snap, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.export_path)
@@ -0,0 +1,94 @@
+import os
+import gc
+import torch
+
+# ----------------------------
+# 依記憶體壓力調整 batch size 與清理時機
+# ----------------------------
+def is_oom_error(error):
+    if isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+
+def _rss_usage():
+    # CPU fallback：讀 /proc/self/statm 的 RSS 與實體記憶體總量
+    try:
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        total = os.sysconf("SC_PHYS_PAGES") * page_size
+        return rss_pages * page_size / total
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class MemoryManager:
+    """
+    取代每筆都呼叫 torch.cuda.empty_cache() / gc.collect() 的做法：
+    - 使用率超過 cleanup_threshold 才清理
+    - 使用率低於 grow_threshold 時將 batch size 加倍（不超過 max_batch_size）
+    - 發生 OOM 時清理並將 batch size 減半，由呼叫端重試失敗的那批；之後連續 cooldown_batches 個 batch
+      成功才再加倍（max_batch_size 不變，圖片較小的後段仍可長回來）。同一大小再次 OOM 時冷卻期加倍，
+      在曾經 OOM 的大小成功跑完一個 batch 後恢復原本的冷卻期
+    GPU 使用 allocator 統計（memory_reserved / 總量），CPU 則使用 process RSS。
+    """
+
+    def __init__(self, batch_size=1, max_batch_size=None, device=None,
+                 grow_threshold=0.6, cleanup_threshold=0.85, cooldown_batches=8):
+        self.batch_size = max(1, int(batch_size))
+        self.max_batch_size = max(self.batch_size, int(max_batch_size or self.batch_size))
+        self.device = torch.device(device) if device is not None else torch.device("cpu")
+        self.grow_threshold = grow_threshold
+        self.cleanup_threshold = cleanup_threshold
+        self.cooldown_batches = cooldown_batches
+        self._cooldown = 0          # 還要成功幾個 batch 才能再加倍
+        self._oom_streak = 0        # 還沒在 OOM 的大小成功過之前，連續 OOM 的次數
+        self._oom_batch_size = None
+        self.stats = {"cleanups": 0, "ooms": 0, "peak_batch_size": self.batch_size}
+
+    def usage(self):
+        if self.device.type == "cuda" and torch.cuda.is_available():
+            total = torch.cuda.get_device_properties(self.device).total_memory
+            return torch.cuda.memory_reserved(self.device) / total
+        return _rss_usage()
+
+    def cleanup(self):
+        gc.collect()
+        if self.device.type == "cuda" and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.stats["cleanups"] += 1
+
+    def after_batch(self):
+        usage = self.usage()
+        if usage > self.cleanup_threshold:
+            self.cleanup()
+            usage = self.usage()
+        if self._oom_batch_size is not None and self.batch_size >= self._oom_batch_size:
+            # 曾經 OOM 的大小這次成功了（例如後面的圖片較小），之後的 OOM 重新從原本的冷卻期算起
+            self._oom_streak, self._oom_batch_size = 0, None
+        if self._cooldown > 0:
+            self._cooldown -= 1
+            return
+        if usage < self.grow_threshold and self.batch_size < self.max_batch_size:
+            self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+            self.stats["peak_batch_size"] = max(self.stats["peak_batch_size"], self.batch_size)
+
+    def on_oom(self, error):
+        # 已經是單筆仍 OOM 時無法再縮小，直接拋出原本的錯誤
+        self.stats["ooms"] += 1
+        self.cleanup()
+        if self.batch_size == 1:
+            raise error
+        self._oom_batch_size = self.batch_size
+        self.batch_size = max(1, self.batch_size // 2)
+        # 避免馬上又長回會 OOM 的大小：先冷卻一段時間，反覆 OOM 時冷卻期加倍
+        self._cooldown = self.cooldown_batches * 2 ** min(self._oom_streak, 6)
+        self._oom_streak += 1
+        print(f"⚠️ OOM，batch size 降為 {self.batch_size} 後重試（{self._cooldown} 個 batch 內不再加大）")
+
+    def summary(self):
+        return (
+            f"batch_size={self.batch_size} (peak {self.stats['peak_batch_size']}) | "
+            f"cleanups={self.stats['cleanups']} | ooms={self.stats['ooms']}"
+        )
@@ -0,0 +1,245 @@
+import re
+import json
+import hashlib
+import pandas as pd
+from checkpoint import write_output
+from run_store import load_run
+
+# ----------------------------
+# 共用的模型輸出解析器（各任務的 normalizer + 解析結果快取）
+# ----------------------------
+# 調整任何 normalizer 的行為時請遞增版本號，舊的快取會自動失效
+PARSER_VERSION = 1
+
+# 預先編譯的 pattern（原本每次呼叫都重新編譯）
+WHITESPACE_RE = re.compile(r"[\n\r\t]")
+PERCENT_RE = re.compile(r"%(?=[,\}\]])")
+DECIMAL_RE = re.compile(r"(\d+)\.\d+")
+THOUSANDS_RE = re.compile(r'"\s*(-?\d+,?\d+)(?=[,\}\]])')
+KV_PAIR_RE = re.compile(r'"?([^":]+)"?\s*:\s*"?([^\{\}\"\':,]+)?"?')
+NON_DIGIT_RE = re.compile(r"[^\d]")
+
+# 存摺封面：銀行對應表
+bank_mapping = {
+    "first": "第一",
+    "post": ["郵局", "郵政"],
+    "chinatrust": "中信",
+    "esun": "玉山",
+    "union": "聯邦",
+    "cooperative": "合作金庫",
+    "shanghai": "上海",
+    "taiwanbusiness": "台企",
+    "bank": "銀行",
+    "cathay": "國泰",
+    "fubon": "富邦",
+    "fareastern": "遠東",
+    "land": "土地",
+    "taishin": "台新",
+    "taiwan": "台銀",
+    "changhwa": "彰化",
+    "huanan": "華南",
+    "citi": "花旗",
+    "mega": "兆豐",
+    "yuanta": "元大",
+    "jihsun": "日盛",
+    "chartered": "渣打",
+    "taichung": "台中",
+    "sinopac": "永豐",
+    "kingstown": "京城",
+    "kauohsing": "高雄"
+}
+
+def translate_bank(bank_name):
+    for eng, zh in bank_mapping.items():
+        if isinstance(zh, list):
+            if any(item in bank_name for item in zh):
+                return eng
+        else:
+            if zh in bank_name:
+                return eng
+    return bank_name
+
+def strip_whitespace(val):
+    return WHITESPACE_RE.sub(" ", val).strip()
+
+# ----------------------------
+# 各任務 normalizer
+# ----------------------------
+def parse_expenses(val):
+    # 員工報支：list of dicts
+    if isinstance(val, list):
+        return val
+    if isinstance(val, dict):
+        return [val]
+    if isinstance(val, str):
+        try:
+            val = strip_whitespace(val)
+            if not val.startswith("["):
+                val = "[" + val
+            if not val.endswith("]"):
+                val += "]"
+            parsed = json.loads(val)
+            if not isinstance(parsed, list):
+                return []
+            cleaned_list = []
+            for entry in parsed:
+                if not isinstance(entry, dict):
+                    continue
+                new_entry = {}
+                for k, v in entry.items():
+                    if k in ["賣方統編", "發票號碼"]:
+                        v = v.replace("-", "")
+                    if k == "憑證日期" and isinstance(v, str) and len(v) >= 10:
+                        v = v[:10]
+                    new_entry[k] = v
+                cleaned_list.append(new_entry)
+            return cleaned_list
+        except Exception as e:
+            print(f"[fix_mllm_result] 格式轉換失敗: {e}")
+            return []
+    return []
+
+def parse_covers(val):
+    # 存摺封面：帳號去除 "-"，銀行別轉為英文代碼
+    try:
+        if isinstance(val, str):
+            val = json.loads(val)
+        if not isinstance(val, dict):
+            return {}
+
+        result = {}
+        for key, value in val.items():
+            if "帳號" in key and isinstance(value, str):
+                result[key] = value.replace("-", "")
+            elif "銀行別" in key and isinstance(value, str):
+                result[key] = translate_bank(value)
+            else:
+                result[key] = value
+        return result
+    except Exception as e:
+        print(f"格式轉換失敗: {e}")
+        return {}
+
+def parse_income(val):
+    # 損益表：去除百分比、小數與千分位後再 json.loads
+    if isinstance(val, dict):
+        return val
+    if isinstance(val, str):
+        try:
+            val = strip_whitespace(val)
+            val = PERCENT_RE.sub("", val)
+            val = DECIMAL_RE.sub(r"\1", val)
+            val = THOUSANDS_RE.sub(lambda m: '"' + m.group(1).replace(",", ""), val)
+            return json.loads(val)
+        except Exception:
+            return {}
+    return {}
+
+LOAN_KEYS = [
+    "申請金額", "借款期間", "償還方式", "貸款用途", "申請人姓名", "申請人身分證字號",
+    "申請人生日", "申請人婚姻狀況", "申請人子女人數", "申請人住宅地址", "申請人年資",
+    "申請人公司統編", "申請人年收入", "申請人行動電話", "申請人住宅電話", "申請人公司電話",
+    "保證人姓名", "保證人身分證字號", "保證人生日"
+]
+
+def parse_loan(val):
+    # 貸款申請書：缺少的欄位補上空字串
+    if isinstance(val, dict):
+        return val
+    if isinstance(val, str):
+        try:
+            result = json.loads(val)
+            for key in LOAN_KEYS:
+                if key not in result:
+                    result[key] = ""
+            return result
+        except Exception:
+            return {}
+    return {}
+
+def parse_balance(val):
+    # 資產負債表：以 key/value pattern 抽取，數字去除千分位後轉 int
+    if isinstance(val, dict):
+        return val
+    if isinstance(val, str):
+        try:
+            val = val.replace("\\n", " ").replace("\r", " ").replace("\\t", " ").strip()
+            kv_pairs = KV_PAIR_RE.findall(val)
+            result = {}
+            for k, v in kv_pairs:
+                v = v.replace(",", "")
+                if v.isdigit():
+                    result[k] = int(v)
+                else:
+                    result[k] = v
+            return result
+        except Exception as e:
+            print(f"[fix_mllm_result] 格式轉換失敗：{e}")
+            return {}
+    return {}
+
+PARSERS = {
+    "員工報支": parse_expenses,
+    "存摺封面": parse_covers,
+    "損益表": parse_income,
+    "貸款申請書": parse_loan,
+    "資產負債表": parse_balance,
+}
+
+# ----------------------------
+# 解析結果快取（存回 output 檔的 mllm_parsed 欄位）
+# ----------------------------
+def cache_key(data_type, raw):
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return f"{data_type}:{PARSER_VERSION}:{digest}"
+
+def parse_column(raw_values, data_type, cached=None):
+    """
+    回傳 (parsed_list, cache_list, changed)。
+    cached 為上次存下的 mllm_parsed 欄位（每格為 (key, parsed) 或空值）；
+    key 與目前 raw 字串的 hash 相同時直接沿用，不再重新解析。
+    同一次呼叫中相同的 raw 字串也只解析一次。
+    """
+    parser = PARSERS[data_type]
+    cached = list(cached) if cached is not None else [None] * len(raw_values)
+    memo = {}
+    parsed_list, cache_list = [], []
+    changed = False
+
+    for raw, entry in zip(raw_values, cached):
+        if not isinstance(raw, str):
+            parsed_list.append(parser(raw))
+            cache_list.append(None)
+            continue
+
+        key = cache_key(data_type, raw)
+        if isinstance(entry, tuple) and len(entry) == 2 and entry[0] == key:
+            parsed = entry[1]
+        elif key in memo:
+            parsed = memo[key]
+            changed = True
+        else:
+            parsed = parser(raw)
+            changed = True
+        memo[key] = parsed
+        parsed_list.append(parsed)
+        cache_list.append((key, parsed))
+
+    return parsed_list, cache_list, changed
+
+def load_parsed_results(path, data_type):
+    """
+    讀取 output 檔並將 mllm_result 換成解析後的結構。
+    有新解析的結果時，會把 mllm_parsed 快取欄位寫回原檔，之後評估不用再解析。
+    """
+    df = load_run(path)
+    path = df.attrs.get("run_path", path)
+    cached = df["mllm_parsed"] if "mllm_parsed" in df.columns else None
+    parsed_list, cache_list, changed = parse_column(df["mllm_result"].tolist(), data_type, cached)
+
+    if changed:
+        df["mllm_parsed"] = pd.Series(cache_list, index=df.index, dtype=object)
+        write_output(df, path)
+
+    df["mllm_result"] = pd.Series(parsed_list, index=df.index, dtype=object)
+    return df
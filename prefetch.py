@@ -0,0 +1,80 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# ----------------------------
+# 背景圖片預處理（producer / consumer）
+# ----------------------------
+def _timed_call(fn, arg):
+    # 放在模組層級，process pool 才能 pickle
+    start = time.perf_counter()
+    result = fn(arg)
+    return result, time.perf_counter() - start
+
+
+class ImagePrefetcher:
+    """
+    在背景 thread / process pool 中預先解碼、縮放接下來的 queue_depth 張圖片，
+    主執行緒迭代時依輸入順序取得 (item, image)。
+    finish 有提供時，worker 的回傳值先在主執行緒經過 finish 再 yield
+    （例如 ImageCache.record：process 模式下快取的 stats 與淘汰要在主 process 進行）。
+
+    stats 會記錄：
+    - decode: worker 實際解碼縮放花費的總秒數
+    - wait:   主執行緒等待圖片就緒的總秒數（偏高代表 decode-bound）
+    - model:  主執行緒拿到圖片後到下一次取圖之間的總秒數（偏高代表 model-bound）
+    """
+
+    def __init__(self, items, load_fn, queue_depth=4, num_workers=2, mode="thread", finish=None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"不支援的 prefetch 模式：{mode}")
+        self.items = list(items)
+        self.load_fn = load_fn
+        self.queue_depth = max(1, int(queue_depth))
+        self.num_workers = max(1, int(num_workers))
+        self.mode = mode
+        self.finish = finish
+        self.stats = {"images": 0, "decode": 0.0, "wait": 0.0, "model": 0.0}
+        self.last_decode_time = 0.0  # 最近一次 yield 的圖片解碼耗時（給 telemetry 使用）
+        self.last_wait_time = 0.0    # 最近一次 yield 前主執行緒等待的時間
+
+    def __iter__(self):
+        pool_cls = ThreadPoolExecutor if self.mode == "thread" else ProcessPoolExecutor
+        with pool_cls(max_workers=self.num_workers) as pool:
+            pending = deque()
+            next_submit = 0
+
+            def fill():
+                nonlocal next_submit
+                while next_submit < len(self.items) and len(pending) < self.queue_depth:
+                    item = self.items[next_submit]
+                    pending.append((item, pool.submit(_timed_call, self.load_fn, item)))
+                    next_submit += 1
+
+            fill()
+            while pending:
+                item, future = pending.popleft()
+                wait_start = time.perf_counter()
+                image, decode_time = future.result()
+                if self.finish is not None:
+                    image = self.finish(image)
+                self.last_wait_time = time.perf_counter() - wait_start
+                self.stats["wait"] += self.last_wait_time
+                self.stats["decode"] += decode_time
+                self.last_decode_time = decode_time
+                self.stats["images"] += 1
+                fill()
+
+                model_start = time.perf_counter()
+                yield item, image
+                self.stats["model"] += time.perf_counter() - model_start
+
+    def summary(self):
+        n = max(1, self.stats["images"])
+        bound = "decode-bound" if self.stats["wait"] > self.stats["model"] else "model-bound"
+        return (
+            f"images={self.stats['images']} | "
+            f"decode {self.stats['decode']:.2f}s ({self.stats['decode'] / n:.3f}s/張) | "
+            f"wait {self.stats['wait']:.2f}s | model {self.stats['model']:.2f}s | {bound}"
+        )
+
@@ -0,0 +1,175 @@
+import copy
+import functools
+import torch
+from transformers import StoppingCriteriaList
+from telemetry import Telemetry, device_sync, generated_length
+from stopping import StructuredStop
+
+# ----------------------------
+# 固定 prompt 前綴的 KV cache 重複使用
+# ----------------------------
+def memoize_text_encoding(processor):
+    """
+    processor 每次編碼 conversation 都會重新 tokenize 同一段 prompt 文字，
+    這裡把 processor.encode 包一層 lru_cache（回傳新的 list，避免呼叫端改到快取內容）。
+    """
+    if getattr(processor, "_encode_memoized", False):
+        return processor
+    encode = processor.encode
+
+    @functools.lru_cache(maxsize=1024)
+    def cached_encode(args, kwargs):
+        return tuple(encode(*args, **dict(kwargs)))
+
+    def memoized_encode(*args, **kwargs):
+        return list(cached_encode(args, tuple(sorted(kwargs.items()))))
+
+    processor.encode = memoized_encode
+    processor._encode_memoized = True
+    return processor
+
+
+class PromptPrefixCache:
+    """
+    prompt_first 版面（prompt 文字在圖片之前）時，圖片 token 之前的內容對每份文件都相同。
+    第一次遇到時只對這段前綴做一次 forward 並保存 KV cache，
+    之後每份文件複製這份 cache，只需 prefill 圖片與其後的 token，再做 greedy decode。
+    逐筆處理（batch 1），結果與完整 generate 的 greedy 輸出相同。
+    """
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix_ids = None
+        self.past_key_values = None
+        self.stats = {"prefix_tokens": 0, "reused": 0, "fallback": 0}
+
+    def _prefix_length(self, inputs):
+        # 第一個圖片 token 的位置即為共用前綴長度
+        positions = inputs.images_seq_mask[0].nonzero()
+        return int(positions[0]) if len(positions) > 0 else 0
+
+    def _build(self, inputs_embeds, attention_mask, prefix_len):
+        outputs = self.model.language_model(
+            inputs_embeds=inputs_embeds[:, :prefix_len],
+            attention_mask=attention_mask[:, :prefix_len],
+            use_cache=True
+        )
+        self.past_key_values = outputs.past_key_values
+        self.stats["prefix_tokens"] = prefix_len
+
+    def _reusable(self, input_ids, inputs_embeds, attention_mask, prefix_len, telemetry, sync):
+        # 第一次遇到時建立前綴的 KV cache；回傳這份文件能否沿用
+        if self.prefix_ids is None and prefix_len > 0:
+            self.prefix_ids = input_ids[:, :prefix_len].clone()
+            with telemetry.span("prefill", sync=sync, tokens=prefix_len, shared_prefix=True):
+                self._build(inputs_embeds, attention_mask, prefix_len)
+        return self.prefix_ids is not None and prefix_len == self.prefix_ids.shape[1] \
+            and torch.equal(input_ids[:, :prefix_len], self.prefix_ids)
+
+    def _prefill_suffix(self, inputs_embeds, attention_mask, prefix_len):
+        # 複製前綴的 KV cache，只 prefill 圖片與其後的 token
+        past_key_values = copy.deepcopy(self.past_key_values)
+        return self.model.language_model(
+            inputs_embeds=inputs_embeds[:, prefix_len:],
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+
+    def prefill(self, inputs, telemetry=None, inputs_embeds=None):
+        """
+        回傳 prefill 後的 language_model 輸出（logits / past_key_values），給自行 decode 的呼叫端使用
+        （例如 schema_decoding）。前綴相同時沿用 KV cache，否則對整段做一次 forward。
+        inputs_embeds 已算好（例如來自 FeatureCache）時不再呼叫 prepare_inputs_embeds。
+        """
+        telemetry = telemetry or Telemetry()
+        sync = device_sync(self.model.device)
+        prefix_len = self._prefix_length(inputs)
+        if inputs_embeds is None:
+            with telemetry.span("prepare_inputs_embeds", sync=sync):
+                inputs_embeds = self.model.prepare_inputs_embeds(**inputs)
+        attention_mask = inputs.attention_mask
+        if not self._reusable(inputs.input_ids, inputs_embeds, attention_mask, prefix_len, telemetry, sync):
+            self.stats["fallback"] += 1
+            with telemetry.span("prefill", sync=sync, tokens=inputs_embeds.shape[1], shared_prefix=False):
+                return self.model.language_model(inputs_embeds=inputs_embeds, attention_mask=attention_mask,
+                                                 use_cache=True)
+        self.stats["reused"] += 1
+        with telemetry.span("prefill", sync=sync, tokens=inputs_embeds.shape[1] - prefix_len, shared_prefix=False):
+            return self._prefill_suffix(inputs_embeds, attention_mask, prefix_len)
+
+    def generate(self, inputs, max_new_tokens=512, telemetry=None, output_root=None, inputs_embeds=None):
+        """
+        inputs 為單張圖片的 processor 輸出（force_batchify=True），回傳解碼後的字串。
+        output_root（"{" 或 "["）有設定時，輸出的最外層結構一閉合就停止。
+        inputs_embeds 已算好時直接使用。
+        """
+        telemetry = telemetry or Telemetry()
+        stopper = StructuredStop(self.tokenizer, 1, root=output_root) if output_root else None
+        sync = device_sync(self.model.device)
+        prefix_len = self._prefix_length(inputs)
+        input_ids = inputs.input_ids
+        if inputs_embeds is None:
+            with telemetry.span("prepare_inputs_embeds", sync=sync):
+                inputs_embeds = self.model.prepare_inputs_embeds(**inputs)
+        attention_mask = inputs.attention_mask
+
+        # 前綴不同（例如 prompt 不在圖片之前）時退回一般 generate
+        if not self._reusable(input_ids, inputs_embeds, attention_mask, prefix_len, telemetry, sync):
+            self.stats["fallback"] += 1
+            with telemetry.span("generate", sync=sync, shared_prefix=False):
+                outputs = self.model.language_model.generate(
+                    inputs_embeds=inputs_embeds,
+                    attention_mask=attention_mask,
+                    bos_token_id=self.tokenizer.bos_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    max_new_tokens=max_new_tokens,
+                    stopping_criteria=StoppingCriteriaList([stopper]) if stopper else None,
+                    do_sample=False,
+                    use_cache=True
+                )
+            with telemetry.span("decode") as span:
+                ids = outputs[0].cpu().tolist()
+                span["output_tokens"] = [generated_length(ids, self.tokenizer.eos_token_id)]
+                text = self.tokenizer.decode(ids, skip_special_tokens=True).strip()
+                if stopper:
+                    text = stopper.trim(0, text)
+            telemetry.count(output_tokens=span["output_tokens"][0])
+            return text
+
+        self.stats["reused"] += 1
+        with telemetry.span("prefill", sync=sync, tokens=input_ids.shape[1] - prefix_len, shared_prefix=False):
+            outputs = self._prefill_suffix(inputs_embeds, attention_mask, prefix_len)
+
+        # greedy decode
+        generated = []
+        with telemetry.span("generate", sync=sync, shared_prefix=True):
+            for _ in range(max_new_tokens):
+                next_token = outputs.logits[:, -1, :].argmax(dim=-1, keepdim=True)
+                token_id = int(next_token[0, 0])
+                if token_id == self.tokenizer.eos_token_id:
+                    break
+                generated.append(token_id)
+                if stopper and stopper.feed(0, token_id):
+                    break
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((1, 1))], dim=1)
+                outputs = self.model.language_model(
+                    input_ids=next_token,
+                    attention_mask=attention_mask,
+                    past_key_values=outputs.past_key_values,
+                    use_cache=True
+                )
+
+        with telemetry.span("decode", output_tokens=[len(generated)]):
+            text = self.tokenizer.decode(generated, skip_special_tokens=True).strip()
+            if stopper:
+                text = stopper.trim(0, text)
+        telemetry.count(output_tokens=len(generated))
+        return text
+
+    def summary(self):
+        return (
+            f"prefix_tokens={self.stats['prefix_tokens']} | reused={self.stats['reused']} | "
+            f"fallback={self.stats['fallback']}"
+        )
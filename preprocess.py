@@ -0,0 +1,57 @@
+from PIL import Image
+
+# 可選的縮放濾波器（名稱 → PIL 常數）
+RESAMPLE_FILTERS = {
+    "nearest": Image.NEAREST,
+    "bilinear": Image.BILINEAR,
+    "bicubic": Image.BICUBIC,
+    "lanczos": Image.LANCZOS,
+}
+# 多頁檔案（TIFF，例如 PDF 轉出的掃描檔）：first 只取第一頁，stack 將各頁上下拼接成一張
+PAGE_MODES = ("first", "stack")
+# fast 模式下 resize 先以整數倍 box 縮小到目標的 3 倍以內，再用指定的濾波器縮放
+REDUCING_GAP = 3.0
+
+def target_size(width, height, max_size):
+    ratio = max_size / max(width, height)
+    return int(width * ratio), int(height * ratio)
+
+def stack_pages(image):
+    # 各頁縮放成相同寬度（最寬的那頁）後上下拼接
+    pages = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        pages.append(image.convert("RGB"))
+    width = max(page.width for page in pages)
+    pages = [
+        page if page.width == width else page.resize((width, round(page.height * width / page.width)), Image.BICUBIC)
+        for page in pages
+    ]
+    stacked = Image.new("RGB", (width, sum(page.height for page in pages)), "white")
+    y = 0
+    for page in pages:
+        stacked.paste(page, (0, y))
+        y += page.height
+    return stacked
+
+# ----------------------------
+# 圖片預處理
+# ----------------------------
+def preprocess_image(image_path, max_size=1440, resample="lanczos", fast=False, pages="first"):
+    """
+    長邊超過 max_size 時等比例縮小。
+    fast=True：JPEG 以 draft mode 在 DCT 解碼時直接縮小（1/2、1/4、1/8 中不小於目標尺寸的最小者），
+    不再解碼完整解析度；其他格式以 reducing_gap 先做整數倍縮小。輸出尺寸不變，像素差異見 benchmark_preprocess.py。
+    """
+    image = Image.open(image_path)
+    if pages == "stack" and getattr(image, "n_frames", 1) > 1:
+        image = stack_pages(image)
+    width, height = image.size
+    if max(width, height) <= max_size:
+        return image.convert("RGB")
+
+    size = target_size(width, height, max_size)
+    if fast and image.format == "JPEG":
+        image.draft("RGB", size)
+    image = image.convert("RGB")
+    return image.resize(size, RESAMPLE_FILTERS[resample], reducing_gap=REDUCING_GAP if fast else None)
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from hashing import file_sha256, weights_fingerprint
+from feature_cache import processor_settings
+from stopping import StructureTracker
+
+# ----------------------------
+# 推理結果的快取（content-addressed）
+# ----------------------------
+# greedy decode 的輸出只由「模型權重、processor、prompt 文字、圖片、預處理與 generate 設定」決定。
+# ResponseCache 以這些內容的 hash 為 key，把解碼後的 mllm_result 存成 {cache_dir}/{key[:2]}/{key}.json；
+# 新的 run（execute.py 每次都會建立新的 output 檔）遇到相同的 key 直接沿用，只推理快取中沒有的文件。
+# generate 設定中的 token 上限是使用者指定的 max_new_tokens，不是依 label 統計後的實際上限（後者隨資料集改變）；
+# 實際上限記在每筆快取中，只有上限相同，或結構已閉合（提前停止，沒有被上限截斷）且當時上限不超過目前上限的結果才沿用。
+# batch 組成不在 key 中：left padding 的位置被 attention mask 遮住，float32 下 batch 推理的 greedy 輸出與逐張推理相同
+# （python benchmark_inference.py --check_equivalence 比對解碼字串，並檢查 logits 差異不超過 --logit_tolerance）。
+# bfloat16 下不同 batch 大小的累加順序不同，argmax 接近平手的 token 可能改變，因此快取的結果不一定與
+# 目前的 batch_size 逐字相同；需要逐字重現時請以相同的 batch_size 重建快取。
+
+class ResponseCache:
+    def __init__(self, model, processor, prompt_template, generation, preprocess=None,
+                 cache_dir=os.path.join(".cache", "responses"), budget=None, stop_root=None):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.stop_root = stop_root
+        self.stats = {"hits": 0, "misses": 0, "stored": 0}
+        self._lock = threading.Lock()
+        self._keys = {}
+        # 與圖片無關的 key 部分，每個 run 固定
+        self._prefix = json.dumps({
+            "model": weights_fingerprint(model),
+            "processor": processor_settings(processor),
+            "prompt": hashlib.sha256(prompt_template.encode("utf-8")).hexdigest(),
+            "generation": generation,
+            "preprocess": preprocess or {},
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, image_path):
+        # 原圖內容 hash（同一個 run 內只讀一次檔案）
+        if image_path not in self._keys:
+            h = hashlib.sha256(self._prefix.encode("utf-8"))
+            h.update(file_sha256(image_path).encode("ascii"))
+            self._keys[image_path] = h.hexdigest()
+        return self._keys[image_path]
+
+    def path(self, image_path):
+        key = self.key(image_path)
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, image_path):
+        # 命中時回傳 mllm_result，否則回傳 None（檔案損毀視為未命中）
+        try:
+            with open(self.path(image_path), "r", encoding="utf-8") as f:
+                record = json.load(f)
+            result = record["mllm_result"]
+        except (OSError, ValueError, KeyError):
+            record = result = None
+        if record is None or not self.reusable(record):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return result
+
+    def reusable(self, record):
+        # 實際 token 上限相同；或輸出在上限之前就因結構閉合而停止，較大的上限也會得到相同結果
+        stored = record.get("max_new_tokens")
+        if self.budget is None or stored == self.budget:
+            return True
+        if self.stop_root is None or stored is None or stored > self.budget:
+            return False
+        return StructureTracker(self.stop_root).feed(record["mllm_result"])
+
+    def put(self, image_path, result):
+        cache_path = self.path(image_path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        record = {
+            "mllm_result": result,
+            "filename": os.path.basename(image_path),
+            "max_new_tokens": self.budget,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        # 先寫入暫存檔再 rename，shard worker 並行寫入同一個 key 也不會讀到寫一半的檔案
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+        with self._lock:
+            self.stats["stored"] += 1
+
+    def summary(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / total if total > 0 else 0
+        return f"hits={self.stats['hits']} misses={self.stats['misses']} ({hit_rate:.2%}) | stored={self.stats['stored']}"
@@ -0,0 +1,139 @@
+import os
+import json
+import pickle
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ----------------------------
+# Parquet 格式的推理結果（run）儲存
+# ----------------------------
+# 每個 run 存成 outputs/{data_type}/{output_name}.parquet：
+# - filename、mllm_result 各自為一欄，可只讀需要的欄位（memory-mapped）
+# - label 整筆保留在 label 欄（JSON 文字），另外攤平成 label.{欄位} 方便單獨讀取
+# - 巢狀或非字串的欄位以 JSON 文字儲存，欄位清單記在 schema metadata 的 json_columns
+# - run 的其他資訊（模型、prompt 等）記在 schema metadata 的 run_metadata
+RUN_SUFFIX = ".parquet"
+LEGACY_SUFFIX = ".pkl"
+LABEL_PREFIX = "label."
+
+def _to_json(value):
+    return json.dumps(value, ensure_ascii=False)
+
+def _from_json(text):
+    return None if text is None else json.loads(text)
+
+def _label_fields(labels):
+    # 只有 dict 形式的 label 才攤平（員工報支的 list of dicts 保留在 label 欄）
+    keys = []
+    for label in labels:
+        if isinstance(label, dict):
+            for key in label:
+                if key not in keys:
+                    keys.append(key)
+    return keys
+
+def dataframe_to_table(df, metadata=None):
+    arrays, names, json_columns = [], [], []
+    for column in df.columns:
+        if column.startswith(LABEL_PREFIX):
+            continue  # 由 label 欄重新攤平
+        values = df[column].tolist()
+        if all(isinstance(v, str) for v in values):
+            arrays.append(pa.array(values, type=pa.string()))
+        else:
+            # mllm_parsed 的 (key, parsed) tuple 會存成 list，讀回時再轉回 tuple
+            arrays.append(pa.array([_to_json(v) for v in values], type=pa.string()))
+            json_columns.append(column)
+        names.append(column)
+
+    if "label" in df.columns:
+        labels = df["label"].tolist()
+        for key in _label_fields(labels):
+            arrays.append(pa.array(
+                [_to_json(label[key]) if isinstance(label, dict) and key in label else None for label in labels],
+                type=pa.string()
+            ))
+            names.append(f"{LABEL_PREFIX}{key}")
+            json_columns.append(f"{LABEL_PREFIX}{key}")
+
+    schema_metadata = {
+        b"json_columns": _to_json(json_columns).encode("utf-8"),
+        b"run_metadata": _to_json(metadata or {}).encode("utf-8"),
+    }
+    return pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(schema_metadata)
+
+def write_run(df, path, metadata=None):
+    # 保留既有的 run metadata，先寫暫存檔再 rename
+    if metadata is None and os.path.exists(path):
+        metadata = read_metadata(path)
+    table = dataframe_to_table(df, metadata)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+def read_metadata(path):
+    schema = pq.read_schema(path)
+    return json.loads((schema.metadata or {}).get(b"run_metadata", b"{}"))
+
+def read_run(path, columns=None):
+    """
+    讀取 run；columns 有指定時只讀取這些欄位（例如 ["label", "mllm_result"]）。
+    檔案以 memory map 方式開啟，不需要的欄位不會被載入。
+    """
+    table = pq.read_table(path, columns=columns, memory_map=True)
+    json_columns = set(json.loads((table.schema.metadata or {}).get(b"json_columns", b"[]")))
+    data = {}
+    for column in table.column_names:
+        values = table.column(column).to_pylist()
+        if column in json_columns:
+            values = [_from_json(v) for v in values]
+            if column == "mllm_parsed":
+                values = [tuple(v) if isinstance(v, list) else v for v in values]
+        data[column] = pd.Series(values, dtype=object)
+    return pd.DataFrame(data)
+
+# ----------------------------
+# 舊版 pkl 自動轉換
+# ----------------------------
+def convert_legacy(pkl_path):
+    with open(pkl_path, "rb") as f:
+        df = pickle.load(f)
+    path = pkl_path[:-len(LEGACY_SUFFIX)] + RUN_SUFFIX
+    write_run(df, path, metadata={"converted_from": os.path.basename(pkl_path)})
+    print(f"🔁 已將 {pkl_path} 轉換為 {path}")
+    return path
+
+def resolve_run_path(output_dir, name):
+    """
+    依 output 名稱找到 run 檔：優先使用 .parquet；只有舊版 .pkl（或 .pkl 較新）時自動轉換（保留原 pkl）。
+    """
+    for suffix in (RUN_SUFFIX, LEGACY_SUFFIX):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    path = os.path.join(output_dir, name + RUN_SUFFIX)
+    legacy_path = os.path.join(output_dir, name + LEGACY_SUFFIX)
+    # 沒有 .parquet，或 .pkl 比較新（例如被舊版工具覆寫）時重新轉換
+    if os.path.exists(legacy_path) and (
+        not os.path.exists(path) or os.path.getmtime(legacy_path) > os.path.getmtime(path)
+    ):
+        return convert_legacy(legacy_path)
+    return path
+
+def list_runs(output_dir):
+    # 回傳資料夾內所有 run 名稱（.parquet 與尚未轉換的 .pkl）
+    names = set()
+    for filename in os.listdir(output_dir):
+        for suffix in (RUN_SUFFIX, LEGACY_SUFFIX):
+            if filename.endswith(suffix):
+                names.add(filename[:-len(suffix)])
+    return sorted(names)
+
+def load_run(path, columns=None):
+    # 支援直接傳入 .pkl 路徑（舊版呼叫方式）
+    if path.endswith(LEGACY_SUFFIX):
+        path = resolve_run_path(os.path.dirname(path), os.path.basename(path))
+    df = read_run(path, columns=columns)
+    df.attrs["run_path"] = path
+    return df
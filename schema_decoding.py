@@ -0,0 +1,252 @@
+import re
+import json
+import torch
+from tasks import output_template
+from telemetry import Telemetry, device_sync
+
+# ----------------------------
+# 依 schema 強制輸出固定結構（key-forced decoding）
+# ----------------------------
+# 輸出中的括號、key 名稱、引號、冒號與逗號都是已知的（欄位與評分用的 FIELDS 相同），
+# 不需要模型一個 token 一個 token 產生。SchemaDecoder 把這些固定文字（scaffold）一次 forward 餵進 KV cache，
+# 只有 value 由模型 greedy 產生：
+#   {\n"01營業收入總額": <value>,\n"04營業收入淨額": <value>, ...\n}
+# value 的型別由模型的第一個 token 決定（"..." 字串或數字等裸值），與自由產生時相同；
+# 字串在右引號結束，裸值遇到 , } ] 或換行結束。list 型（員工報支）在第一筆之前比較「第一筆」與空 list "[]"，
+# 每筆 dict 結束後比較「再一筆」與「結束」兩種接續第一個 token 的 logit，決定是否再輸出一筆。
+# 縮排與換行沿用 prompt 輸出範本的格式；輸出一定是欄位齊全、順序固定的 JSON。
+VALUE_END = ",}]\n"
+
+def value_end(text):
+    """value 在 text 中結束的位置（字串含右引號、裸值不含之後的分隔符號）；尚未結束時回傳 None。"""
+    start = len(text) - len(text.lstrip())
+    if start == len(text):
+        return None
+    if text[start] == '"':
+        escape = False
+        for i in range(start + 1, len(text)):
+            if escape:
+                escape = False
+            elif text[i] == "\\":
+                escape = True
+            elif text[i] == '"':
+                return i + 1
+        return None
+    for i in range(start, len(text)):
+        if text[i] in VALUE_END:
+            return i
+    return None
+
+def template_indent(prompt_template, root="{"):
+    # 從 prompt 的輸出範本取得 key 與（list 時）每筆 dict 的縮排；兩者都是從行首算起的完整縮排
+    template = output_template(prompt_template)
+    key = re.search(r'\n([ \t]*)"', template)
+    item = re.search(r'\[[ \t]*\n([ \t]*)\{', template)
+    return (key.group(1) if key else "  "), (item.group(1) if item and root == "[" else "")
+
+
+class _Cursor:
+    # 單一文件的 decode 狀態：最新的 language_model 輸出、attention_mask、剩餘 token 數，
+    # 以及已選出但尚未餵入的 token（和下一段 scaffold 一起 forward）；
+    # pending_text 為其中實際輸出的文字（value 的結尾，或補上的引號），token 不能整個餵入時改餵這段文字
+    def __init__(self, outputs, attention_mask, budget):
+        self.outputs = outputs
+        self.attention_mask = attention_mask
+        self.budget = budget
+        self.pending = []
+        self.pending_text = ""
+
+    def next_token(self):
+        return int(self.outputs.logits[0, -1].argmax())
+
+
+class SchemaDecoder:
+    def __init__(self, model, tokenizer, schema, prompt_template="", max_value_tokens=64, max_items=20):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.schema = schema
+        self.max_value_tokens = max_value_tokens
+        self.max_items = max_items
+        self.key_indent, self.item_indent = template_indent(prompt_template, schema.root)
+        self.stats = {"documents": 0, "forced_tokens": 0, "generated_tokens": 0, "forward_passes": 0}
+        self._ids = {}
+        self._pieces = {}
+
+    def _encode(self, text):
+        if text not in self._ids:
+            self._ids[text] = self.tokenizer.encode(text, add_special_tokens=False)
+        return self._ids[text]
+
+    def _piece(self, token_id):
+        if token_id not in self._pieces:
+            self._pieces[token_id] = self.tokenizer.decode([token_id], skip_special_tokens=True)
+        return self._pieces[token_id]
+
+    def _forward(self, cursor, token_ids):
+        input_ids = torch.tensor([token_ids], dtype=torch.long, device=cursor.attention_mask.device)
+        cursor.attention_mask = torch.cat(
+            [cursor.attention_mask, cursor.attention_mask.new_ones((1, len(token_ids)))], dim=1
+        )
+        cursor.outputs = self.model.language_model(
+            input_ids=input_ids,
+            attention_mask=cursor.attention_mask,
+            past_key_values=cursor.outputs.past_key_values,
+            use_cache=True
+        )
+        cursor.budget -= len(token_ids)
+        self.stats["forward_passes"] += 1
+
+    def _force(self, cursor, text, overflow=""):
+        # 產生 value 的最後一個 token 可能已帶著分隔符號（例如 `",`）：
+        # - 正好是 scaffold 的開頭時整個 token 都是輸出的一部分，與 scaffold 其餘部分一起餵入
+        # - 否則（例如 `"}`、`1\n`）多出的文字不會出現在輸出中，不能進 KV cache，改為只餵入輸出的部分
+        if cursor.pending and text.startswith(overflow):
+            forced = self._encode(text[len(overflow):]) if len(text) > len(overflow) else []
+            ids = cursor.pending + list(forced)
+        else:
+            forced = self.tokenizer.encode(cursor.pending_text, add_special_tokens=False) if cursor.pending_text else []
+            forced = list(forced) + list(self._encode(text) if text else [])
+            ids = forced
+        cursor.pending, cursor.pending_text = [], ""
+        if cursor.budget <= 0 or not ids:
+            return
+        self.stats["forced_tokens"] += len(forced)
+        self._forward(cursor, ids)
+
+    def _value(self, cursor):
+        """greedy 產生一個 value，回傳 (value 文字, value 之後同一個 token 內多出的文字)。"""
+        ids, scanned = [], ""
+        while cursor.budget > 0 and len(ids) < self.max_value_tokens:
+            token_id = cursor.next_token()
+            if token_id == self.tokenizer.eos_token_id:
+                break
+            ids.append(token_id)
+            self.stats["generated_tokens"] += 1
+            scanned += self._piece(token_id)
+            if value_end(scanned) is not None:
+                # 結束 value 的 token 留到下一段 scaffold 一起餵入，省一次 forward
+                cursor.pending = [token_id]
+                break
+            self._forward(cursor, [token_id])
+
+        text = self.tokenizer.decode(ids, skip_special_tokens=True)
+        end = value_end(text)
+        if end is None:
+            # EOS 或長度上限：未結束的字串補上右引號（補上的文字之後與 scaffold 一起餵入）
+            value = text.rstrip().rstrip("\\")
+            if value.lstrip().startswith('"'):
+                cursor.pending_text = '"'
+            elif not value.strip():
+                cursor.pending_text = '""'
+            return value + cursor.pending_text, ""
+        # value 與已餵入的文字保持一致（不去掉模型產生的空白）；overflow 一定在結束 value 的 token 內
+        value, overflow = text[:end], text[end:]
+        piece = self._piece(ids[-1])
+        cursor.pending_text = piece[:len(piece) - len(overflow)] if overflow else piece
+        if not value.strip():
+            # 沒有 value 就遇到分隔符號：補上空字串，token 不能整個餵入
+            value += '""'
+            cursor.pending, cursor.pending_text = [], cursor.pending_text + '""'
+        return value, overflow
+
+    def _more_items(self, cursor):
+        # list 型：比較「再一筆」與「結束」接續的第一個 token
+        more = self._encode(",\n")[:1]
+        end = self._encode("\n]")[:1]
+        if cursor.budget <= 0 or not more or more == end:
+            return False
+        logits = cursor.outputs.logits[0, -1]
+        return bool(logits[more[0]] > logits[end[0]])
+
+    def _starts_list(self, cursor, scaffold):
+        """
+        list 型：第一筆之前比較第一筆的 scaffold 與空 list "[]"。兩者共同的 token 前綴（例如 "["）先餵入，
+        在第一個不同的 token 比較 logit；回傳 (是否有第一筆, 已餵入的文字)。
+        """
+        item_ids, empty_ids = self._encode(scaffold), self._encode("[]")
+        shared = 0
+        while shared < min(len(item_ids), len(empty_ids)) and item_ids[shared] == empty_ids[shared]:
+            shared += 1
+        fed = ""
+        if shared and cursor.budget > 0:
+            self.stats["forced_tokens"] += shared
+            self._forward(cursor, item_ids[:shared])
+            fed = self.tokenizer.decode(item_ids[:shared], skip_special_tokens=True)
+        if cursor.budget <= 0 or shared >= len(empty_ids):
+            return True, fed
+        logits = cursor.outputs.logits[0, -1]
+        return bool(logits[item_ids[shared]] >= logits[empty_ids[shared]]), fed
+
+    def decode(self, outputs, attention_mask, max_new_tokens=512):
+        """outputs 為 prefill 後的 language_model 輸出，回傳產生的 JSON 文字。"""
+        cursor = _Cursor(outputs, attention_mask, max_new_tokens)
+        fields, is_list = self.schema.fields, self.schema.root == "["
+        parts, overflow = [], ""
+        for item in range(self.max_items if is_list else 1):
+            for i, key in enumerate(fields):
+                if i > 0:
+                    scaffold = ",\n" + self.key_indent
+                elif is_list:
+                    scaffold = ("[\n" if item == 0 else ",\n") + self.item_indent + "{\n" + self.key_indent
+                else:
+                    scaffold = "{\n" + self.key_indent
+                scaffold += json.dumps(key, ensure_ascii=False) + ": "
+                fed = ""
+                if is_list and item == 0 and i == 0:
+                    has_items, fed = self._starts_list(cursor, scaffold)
+                    if not has_items:
+                        self.stats["documents"] += 1
+                        return "[]"
+                self._force(cursor, scaffold[len(fed):], overflow)
+                parts.append(scaffold)
+                value, overflow = self._value(cursor)
+                parts.append(value)
+            if not is_list:
+                break
+            closing = "\n" + self.item_indent + "}"
+            parts.append(closing)
+            self._force(cursor, closing, overflow)
+            overflow = ""
+            if not self._more_items(cursor):
+                break
+        parts.append("\n]" if is_list else "\n}")
+        self.stats["documents"] += 1
+        return "".join(parts)
+
+    def generate(self, inputs, max_new_tokens=512, telemetry=None, prefix_cache=None, inputs_embeds=None):
+        """
+        inputs 為單張圖片的 processor 輸出（force_batchify=True）；有 prefix_cache 時沿用共用前綴的 KV cache。
+        inputs_embeds 已算好時直接使用。
+        """
+        telemetry = telemetry or Telemetry()
+        sync = device_sync(self.model.device)
+        if prefix_cache is not None:
+            outputs = prefix_cache.prefill(inputs, telemetry=telemetry, inputs_embeds=inputs_embeds)
+        else:
+            if inputs_embeds is None:
+                with telemetry.span("prepare_inputs_embeds", sync=sync):
+                    inputs_embeds = self.model.prepare_inputs_embeds(**inputs)
+            with telemetry.span("prefill", sync=sync, tokens=inputs_embeds.shape[1]):
+                outputs = self.model.language_model(
+                    inputs_embeds=inputs_embeds,
+                    attention_mask=inputs.attention_mask,
+                    use_cache=True
+                )
+
+        before = dict(self.stats)
+        with telemetry.span("generate", sync=sync, decoding="schema") as span:
+            text = self.decode(outputs, inputs.attention_mask, max_new_tokens=max_new_tokens)
+            for key in ("forced_tokens", "generated_tokens", "forward_passes"):
+                span[key] = self.stats[key] - before[key]
+        telemetry.count(output_tokens=span["forced_tokens"] + span["generated_tokens"])
+        return text
+
+    def summary(self):
+        n = max(1, self.stats["documents"])
+        total = self.stats["forced_tokens"] + self.stats["generated_tokens"]
+        return (
+            f"documents={self.stats['documents']} | forced={self.stats['forced_tokens']} | "
+            f"generated={self.stats['generated_tokens']} | "
+            f"forward passes {self.stats['forward_passes'] / n:.1f}/doc "
+            f"（逐 token 約需 {total / n:.1f}/doc）"
+        )
@@ -0,0 +1,94 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# ----------------------------
+# 欄位式（column-wise）評分引擎
+# ----------------------------
+# 評分規則有變動時請遞增版本號（排行榜快取依此判斷是否需要重算）
+SCORING_VERSION = 1
+
+# values：該欄位每列的值（object ndarray，缺少的欄位為 MISSING）
+# present：該列是否有這個 key
+FieldColumn = namedtuple("FieldColumn", ["values", "present"])
+
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def flatten_fields(records, keys):
+    """將 list of dict 一次攤平成 {key: FieldColumn}；非 dict 的列視為所有欄位皆缺少。"""
+    records = [r if isinstance(r, dict) else {} for r in records]
+    # dtype=object 保留原本的 Python 值（不會把 int 轉成 float）；缺少的 key 會是 NaN
+    frame = pd.DataFrame(records, columns=keys, dtype=object) if records else None
+    columns = {}
+    for key in keys:
+        if frame is None:
+            columns[key] = FieldColumn(np.empty(0, dtype=object), np.zeros(0, dtype=bool))
+            continue
+        values = frame[key].to_numpy(dtype=object, copy=True)
+        present = ~pd.isna(values)
+        # NaN / None 也可能是真的值，只有這些列需要回頭確認 key 是否存在
+        for i in np.flatnonzero(~present):
+            if key in records[i]:
+                present[i] = True
+            else:
+                values[i] = MISSING
+        columns[key] = FieldColumn(values, present)
+    return columns
+
+
+_isinstance = np.frompyfunc(isinstance, 2, 1)
+
+
+def is_str(column):
+    return _isinstance(column.values, str).astype(bool)
+
+
+def split_by_type(gt, pred):
+    # regular：兩邊都有值且都是字串，走向量化路徑；irregular：兩邊都有值但型別不規則，走逐格規則
+    both = gt.present & pred.present
+    both_str = both & is_str(gt) & is_str(pred)
+    return both_str, both & ~both_str
+
+
+def exact_match(gt, pred):
+    # 兩邊都有這個 key 且值相等（Python == 語意）才得分
+    both = gt.present & pred.present
+    scores = np.zeros(len(gt.values), dtype=float)
+    if both.any():
+        scores[both] = np.asarray(gt.values[both] == pred.values[both], dtype=bool)
+    return scores
+
+
+def apply_scalar(rule, gt, pred, mask):
+    # 少數型別不規則的列（非字串等）逐格套用原本的純量規則，確保結果與舊版一致
+    scores = np.zeros(len(gt.values), dtype=float)
+    for i in np.flatnonzero(mask):
+        scores[i] = rule(gt.values[i], pred.values[i])
+    return scores
+
+
+def score_fields(gt_records, pred_records, keys, rules=None):
+    """
+    回傳 {key: 每列分數的 ndarray}。
+    rules 可針對特定欄位指定 rule(gt_column, pred_column) -> ndarray，其餘欄位使用 exact_match。
+    """
+    rules = rules or {}
+    gt_columns = flatten_fields(gt_records, keys)
+    pred_columns = flatten_fields(pred_records, keys)
+    return {key: rules.get(key, exact_match)(gt_columns[key], pred_columns[key]) for key in keys}
+
+
+def to_accuracy(scores, total):
+    # 依列順序逐一相加（與原本 acc[key] += ... 的浮點誤差一致）
+    return {key: sum(col.tolist(), 0) / (total if total > 0 else 1) for key, col in scores.items()}
+
+
+def str_series(column, mask):
+    return pd.Series(column.values[mask], dtype=object)
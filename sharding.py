@@ -0,0 +1,127 @@
+import os
+import queue
+import pickle
+import multiprocessing as mp
+from checkpoint import read_journal, write_output
+
+# ----------------------------
+# 多 process 資料平行推理
+# ----------------------------
+# label 依列位置輪流分配給 num_workers 個 shard（第 i 個 shard 取第 i, i+n, i+2n, ... 列），
+# 每個 worker process 各自載入一份模型（各自的 GPU，或 CPU 上分到的 thread 數），
+# 結果只寫入自己的 journal：outputs/{data_type}/{output_name}.shards/shard{i}of{n}.journal.jsonl。
+# 全部結束後依 label 檔的順序合併成一個 output；某個 shard 失敗時，
+# 以 --resume 重新執行只會重跑未完成的 shard（已完成的列也不會重算）。
+def shard_prefix(data_type, output_name, index, count):
+    return os.path.join("outputs", data_type, f"{output_name}.shards", f"shard{index}of{count}")
+
+def shard_rows(df, index, count):
+    return df.iloc[index::count]
+
+def default_devices(num_workers):
+    import torch
+    if torch.cuda.is_available():
+        return [f"cuda:{i % torch.cuda.device_count()}" for i in range(num_workers)]
+    return ["cpu"] * num_workers
+
+def _run_shard(run_kwargs, index, count, device, threads, results):
+    # 在 worker process 中執行（spawn），模型在這裡才載入
+    import torch
+    from inference import run_inference
+    if threads:
+        torch.set_num_threads(threads)
+    live = run_inference(**run_kwargs, device=device, shard=(index, count))
+    results.put((index, {"aborted": bool(live is not None and live.aborted)}))
+
+
+def run_sharded(run_kwargs, output_path, num_workers, devices=None, resume=False, run_metadata=None):
+    """
+    run_kwargs 為傳給各 worker 的 run_inference 參數（不含 device / shard / resume）。
+    回傳合併後的串流評估結果（有啟用 live_eval 時），否則為 None。
+    """
+    data_type = run_kwargs["data_type"]
+    output_name = run_kwargs["output_name"]
+    with open(os.path.join("label", f"{data_type}.pkl"), "rb") as f:
+        df = pickle.load(f)
+    if "mllm_result" not in df.columns:
+        df["mllm_result"] = ""
+
+    devices = (devices or default_devices(num_workers))[:num_workers]
+    if len(devices) < num_workers:
+        devices = [devices[i % len(devices)] for i in range(num_workers)]
+    cpu_workers = sum(1 for d in devices if str(d).startswith("cpu"))
+    threads = max(1, (os.cpu_count() or 1) // cpu_workers) if cpu_workers else None
+
+    # resume 時只啟動還沒完成的 shard
+    pending = []
+    for index in range(num_workers):
+        journal_path = shard_prefix(data_type, output_name, index, num_workers) + ".journal.jsonl"
+        shard = shard_rows(df, index, num_workers)
+        if resume and os.path.exists(journal_path):
+            done = read_journal(journal_path)
+            if all(name in done for name in shard["filename"]):
+                print(f"✅ shard {index}/{num_workers} 已完成，略過")
+                continue
+        pending.append(index)
+
+    print(f"🧵 {num_workers} 個 shard，啟動 {len(pending)} 個 worker：" +
+          ", ".join(f"shard {i} → {devices[i]}" for i in pending))
+
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    processes = {}
+    for index in pending:
+        process = ctx.Process(
+            target=_run_shard,
+            args=(dict(run_kwargs, resume=resume), index, num_workers, devices[index],
+                  threads if str(devices[index]).startswith("cpu") else None, results),
+            name=f"shard{index}",
+        )
+        process.start()
+        processes[index] = process
+
+    # 等待所有 worker；結果先從 queue 取出，避免 worker 因 queue 未讀而卡住
+    shard_results = {}
+    while len(shard_results) < len(processes) and any(p.is_alive() for p in processes.values()):
+        try:
+            index, info = results.get(timeout=1.0)
+            shard_results[index] = info
+        except queue.Empty:
+            continue
+    for process in processes.values():
+        process.join()
+    while not results.empty():
+        index, info = results.get()
+        shard_results[index] = info
+    failed = [index for index, p in processes.items() if p.exitcode != 0 or index not in shard_results]
+
+    # ----------------------------
+    # 依 label 檔順序合併所有 shard 的 journal
+    # ----------------------------
+    merged = {}
+    for index in range(num_workers):
+        merged.update(read_journal(shard_prefix(data_type, output_name, index, num_workers) + ".journal.jsonl"))
+    done_mask = df["filename"].isin(merged)
+    df.loc[done_mask, "mllm_result"] = df.loc[done_mask, "filename"].map(merged)
+
+    metadata = dict(run_metadata or {}, num_workers=num_workers, devices=[str(d) for d in devices])
+    live = None
+    if run_kwargs.get("live_eval") or run_kwargs.get("abort_below") is not None:
+        # 以合併後的結果重新計算串流評估（各 shard 各自判斷是否中止）
+        from live_eval import StreamingEvaluator
+        live = StreamingEvaluator(data_type, total_rows=len(df), report_every=0,
+                                  abort_below=run_kwargs.get("abort_below"),
+                                  export_path=os.path.join("outputs", data_type, f"{output_name}.live.json"))
+        live.update(df.loc[done_mask, ["filename", "label", "mllm_result"]].to_dict("records"))
+        live.aborted = any(info["aborted"] for info in shard_results.values())
+        metadata["live_eval"] = {"rows_seen": live.seen, "aborted": live.aborted}
+        live.report()
+    write_output(df, output_path, metadata=metadata)
+    print(f"\n 合併 {int(done_mask.sum())}/{len(df)} 筆，結果儲存於：{output_path}")
+
+    if failed:
+        raise RuntimeError(
+            f"shard {', '.join(map(str, failed))} 執行失敗；以相同的 --num_workers 加上 --resume 重新執行，"
+            f"只會重跑未完成的 shard"
+        )
+    return live
@@ -0,0 +1,150 @@
+import json
+import math
+import torch
+import transformers
+from transformers import StoppingCriteria
+from tasks import output_template
+
+# ----------------------------
+# 依輸出結構提前結束 generate
+# ----------------------------
+# 每個任務的 prompt 都要求輸出一個 JSON dict（員工報支為 list of dicts），
+# 模型常在 JSON 結束後繼續產生說明文字直到 max_new_tokens。
+# StructuredStop 逐 token 追蹤括號深度（略過字串內的括號與跳脫字元），
+# 最外層的 dict / list 一閉合就讓該列停止；閉合之前的文字與原本完全相同。
+# transformers < 4.39 的 stopping criteria 只能整個 batch 一起停止，
+# 先閉合的列之後產生的文字由 StructuredStop.trim 截掉（否則結果會隨 batch 組成改變）。
+# 注意 mllm_result 因此不再包含 JSON 之後的說明文字：原本因尾端文字而 json.loads 失敗的輸出
+# 現在可以解析，這類文件的分數會與關閉提前停止（--no_early_stop）時不同。
+ROOT_CLOSE = {"{": "}", "[": "]"}
+PER_ROW_STOPPING = tuple(int(x) for x in transformers.__version__.split(".")[:2] if x.isdigit()) >= (4, 39)
+
+def expected_root(prompt_template):
+    # prompt 的輸出範本以哪一種括號開頭（找不到範本時視為 dict）
+    template = output_template(prompt_template)
+    return template[0] if template[:1] in ROOT_CLOSE else "{"
+
+
+class StructureTracker:
+    """逐段餵入文字，回傳預期的最外層結構是否已閉合；closed_at 為閉合括號之後的字元位置。"""
+
+    def __init__(self, root="{"):
+        self.root = root
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.length = 0
+        self.closed_at = None
+
+    def feed(self, text):
+        if self.closed_at is not None:
+            return True
+        for i, char in enumerate(text):
+            if self.in_string:
+                # 只有在結構內才追蹤字串，結構外的引號（例如說明文字）不影響
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.stack:
+                self.in_string = True
+            elif char in ROOT_CLOSE:
+                self.stack.append(char)
+            elif char in ("}", "]") and self.stack:
+                opener = self.stack.pop()
+                # 只有預期的最外層括號閉合才算結束（例如員工報支要求 list，單獨的 dict 不算）
+                if not self.stack and opener == self.root and char == ROOT_CLOSE[opener]:
+                    self.closed_at = self.length + i + 1
+                    break
+        self.length += len(text)
+        return self.closed_at is not None
+
+
+def structured_prefix(text, root="{"):
+    # 截到最外層結構閉合為止；沒有閉合時原樣回傳
+    tracker = StructureTracker(root)
+    return text[:tracker.closed_at] if tracker.feed(text) else text
+
+
+class StructuredStop(StoppingCriteria):
+    """
+    generate(..., stopping_criteria=StoppingCriteriaList([StructuredStop(...)])) 使用；
+    以 inputs_embeds 呼叫 generate 時 input_ids 只包含新產生的 token（start=0）。
+    """
+
+    def __init__(self, tokenizer, batch_size, root="{", start=0):
+        self.tokenizer = tokenizer
+        self.root = root
+        self.trackers = [StructureTracker(root) for _ in range(batch_size)]
+        self.position = start
+        self._pieces = {}
+
+    def piece(self, token_id):
+        # 單一 token 解碼後的文字（結構字元都是 ASCII，不受多位元組字元切開影響）
+        if token_id not in self._pieces:
+            self._pieces[token_id] = self.tokenizer.decode([token_id], skip_special_tokens=True)
+        return self._pieces[token_id]
+
+    def feed(self, row, token_id):
+        return self.trackers[row].feed(self.piece(token_id))
+
+    @property
+    def stopped(self):
+        return [tracker.closed_at is not None for tracker in self.trackers]
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        new_tokens = input_ids[:, self.position:].tolist()
+        self.position = input_ids.shape[1]
+        for row, token_ids in enumerate(new_tokens):
+            for token_id in token_ids:
+                if self.feed(row, token_id):
+                    break
+        done = torch.tensor(self.stopped, dtype=torch.bool, device=input_ids.device)
+        return done if PER_ROW_STOPPING else bool(done.all())
+
+    def trim(self, row, text):
+        # 閉合括號所在的 token 可能還帶著後面的字元（例如 "}\n"），一併截掉
+        return structured_prefix(text, self.root) if self.stopped[row] else text
+
+
+# ----------------------------
+# 依 label 長度統計的每任務 token 上限
+# ----------------------------
+def render_label(label, fields):
+    # 以 prompt 範本的格式（固定欄位順序、indent=2）重現 label 對應的理想輸出
+    if isinstance(label, str):
+        try:
+            label = json.loads(label)
+        except json.JSONDecodeError:
+            return label
+    if isinstance(label, list):
+        record = [{key: entry.get(key, "") for key in fields} for entry in label if isinstance(entry, dict)]
+    elif isinstance(label, dict):
+        record = {key: label.get(key, "") for key in fields}
+    else:
+        record = {key: "" for key in fields}
+    return json.dumps(record, ensure_ascii=False, indent=2)
+
+def token_budget(labels, fields, tokenizer, prompt_template, max_new_tokens=512, margin=1.25, slack=32):
+    """
+    回傳 (budget, stats)。budget = max(最長的 label 輸出, prompt 範本) 的 token 數 × margin + slack，
+    不超過 max_new_tokens。正確答案所需的長度都在上限之內，但比 label 冗長的輸出（多餘空白、額外欄位、
+    重複內容）會被截斷而無法解析，分數可能改變，因此只在 --label_budget 時使用。
+    """
+    def count(text):
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    lengths = sorted(count(render_label(label, fields)) for label in labels)
+    template_tokens = count(output_template(prompt_template))
+    longest = max(lengths[-1] if lengths else 0, template_tokens)
+    budget = min(max_new_tokens, int(math.ceil(longest * margin)) + slack)
+    stats = {
+        "labels": len(lengths),
+        "template_tokens": template_tokens,
+        "p50": lengths[len(lengths) // 2] if lengths else 0,
+        "max": lengths[-1] if lengths else 0,
+        "budget": budget,
+    }
+    return budget, stats
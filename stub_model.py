@@ -0,0 +1,250 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from tasks import output_template
+
+# ----------------------------
+# 與 DeepSeek-VL2 介面相同的 deterministic stub（給 benchmark 使用）
+# ----------------------------
+# - StubProcessor：processor(conversations, images, force_batchify, system_prompt)、batchify（left padding）、
+#   encode（可被 memoize_text_encoding 包裝）、tokenizer.decode
+# - StubVLModel：prepare_inputs_embeds(**inputs)、language_model(...) / language_model.generate(...)
+# language_model 是隨機初始化的小型 attention 模型（有 KV cache），prefill / decode 的計算量與序列長度相關；
+# 輸出固定為 response 文字（例如 prompt 中的 JSON 範本），方便後續解析與評分。
+# response=None（free_running）時不強制輸出，greedy decode 的結果完全由輸入（圖片與 prompt）決定，
+# 用於檢查 batch 大小 / left padding 不會改變輸出（benchmark_inference.py --check_equivalence）。
+# 隨機權重下長 prompt 的文字 token 會主導 attention，每份文件都產生相同的文字；free_running 時因此
+# 把圖片 patch 標準化放大、attention 變尖銳，並只以 attention 取得的部分計算 logits，讓不同文件的輸出不同。
+# dynamic_tokens=True 時圖片 token 數隨長寬比改變（類似 DeepSeek-VL2 的動態切塊），batch 內各列長度不同才會有 left padding。
+# 每個 token 加上絕對位置 embedding；未傳入 position_ids 時與 DeepSeek-V2 的 prepare_inputs_for_generation 相同，
+# 由 attention_mask.cumsum(-1) - 1 推得，left padding 的列從第一個非 padding token 起算，位置錯誤會改變輸出。
+PAD_ID, BOS_ID, EOS_ID, IMAGE_ID = 0, 1, 2, 3
+IMAGE_TAG = "<|image|>"
+
+
+class StubTokenizer:
+    def __init__(self, vocab_size=8192):
+        self.vocab_size = vocab_size
+        self.pad_token_id = PAD_ID
+        self.bos_token_id = BOS_ID
+        self.eos_token_id = EOS_ID
+        self._ids = {}
+        self._chars = {}
+
+    def token_id(self, char):
+        # 逐字元編碼，依出現順序配發 id（超過 vocab 時取餘數）
+        if char not in self._ids:
+            token_id = 4 + len(self._ids) % (self.vocab_size - 4)
+            self._ids[char] = token_id
+            self._chars.setdefault(token_id, char)
+        return self._ids[char]
+
+    def encode(self, text, add_special_tokens=False):
+        return [self.token_id(c) for c in text]
+
+    def decode(self, ids, skip_special_tokens=True):
+        # 沒有對應字元的 id（free_running 時模型自由產生）以 <id> 表示，不同 token 序列不會解碼成相同字串
+        return "".join(self._chars.get(i, f"<{i}>") for i in ids if not (skip_special_tokens and i < 4))
+
+
+class StubInputs(dict):
+    """processor 的輸出：可用屬性存取、可 **展開、可 .to(device)。"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to(self, device):
+        return StubInputs({k: v.to(device) if torch.is_tensor(v) else v for k, v in self.items()})
+
+
+class StubProcessor:
+    def __init__(self, tokenizer=None, image_size=384, image_grid=16, dynamic_tokens=False):
+        self.tokenizer = tokenizer or StubTokenizer()
+        self.image_size = image_size
+        self.image_grid = image_grid
+        self.dynamic_tokens = dynamic_tokens
+
+    def image_tokens(self, image):
+        # 固定為 grid x grid；dynamic_tokens 時取 grid x (grid * 短邊 / 長邊) 個（prepare_inputs_embeds 取前面這麼多個 patch）
+        if not self.dynamic_tokens:
+            return self.image_grid * self.image_grid
+        rows = round(self.image_grid * min(image.size) / max(image.size))
+        return self.image_grid * max(1, min(self.image_grid, rows))
+
+    def encode(self, text):
+        return self.tokenizer.encode(text)
+
+    def _image_tensor(self, image):
+        image = image.convert("RGB").resize((self.image_size, self.image_size))
+        data = torch.frombuffer(bytearray(image.tobytes()), dtype=torch.uint8)
+        return data.view(self.image_size, self.image_size, 3).permute(2, 0, 1).float() / 255.0
+
+    def __call__(self, conversations, images, force_batchify=True, system_prompt=""):
+        text = system_prompt + "".join(f"{m['role']}{m['content']}" for m in conversations)
+        parts = text.split(IMAGE_TAG)
+        ids = [BOS_ID]
+        for i, part in enumerate(parts):
+            if i > 0:
+                ids += [IMAGE_ID] * self.image_tokens(images[i - 1])
+            ids += self.encode(part)
+        input_ids = torch.tensor(ids, dtype=torch.long)
+        prepare = StubInputs(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            images_seq_mask=input_ids == IMAGE_ID,
+            images=torch.stack([self._image_tensor(image) for image in images]),
+        )
+        return self.batchify([prepare]) if force_batchify else prepare
+
+    def batchify(self, prepares):
+        # left padding，與 DeepseekVLV2Processor.batchify 相同
+        length = max(len(p.input_ids) for p in prepares)
+
+        def pad(tensor, value):
+            return F.pad(tensor, (length - len(tensor), 0), value=value)
+
+        return StubInputs(
+            input_ids=torch.stack([pad(p.input_ids, PAD_ID) for p in prepares]),
+            attention_mask=torch.stack([pad(p.attention_mask, 0) for p in prepares]),
+            images_seq_mask=torch.stack([pad(p.images_seq_mask, False) for p in prepares]),
+            images=torch.cat([p.images for p in prepares]),
+        )
+
+
+class StubOutput:
+    def __init__(self, logits, past_key_values):
+        self.logits = logits
+        self.past_key_values = past_key_values
+
+
+class StubLanguageModel(nn.Module):
+    def __init__(self, vocab_size, hidden_size=256, num_layers=2, response_ids=(), max_positions=8192):
+        super().__init__()
+        self.embed = nn.Embedding(vocab_size, hidden_size)
+        self.qkv = nn.ModuleList(nn.Linear(hidden_size, 3 * hidden_size) for _ in range(num_layers))
+        self.mlp = nn.ModuleList(nn.Linear(hidden_size, hidden_size) for _ in range(num_layers))
+        self.lm_head = nn.Linear(hidden_size, vocab_size)
+        self.position = nn.Embedding(max_positions, hidden_size)
+        self.max_positions = max_positions
+        self.response_ids = None if response_ids is None else list(response_ids)
+        self.free_running = response_ids is None
+        self._prompt_len = 0
+
+    def get_input_embeddings(self):
+        return self.embed
+
+    @staticmethod
+    def position_ids(attention_mask, past_len, new_len, device=None):
+        # 與 HF generate 相同：有 attention_mask 時以累計的非 padding token 數為位置（padding 位置取 0）
+        if attention_mask is None:
+            return torch.arange(past_len, past_len + new_len, device=device)[None]
+        return (attention_mask.long().cumsum(-1) - 1).clamp(min=0)[:, -new_len:]
+
+    def forward(self, input_ids=None, inputs_embeds=None, attention_mask=None, past_key_values=None,
+                use_cache=True, position_ids=None, **kwargs):
+        x = inputs_embeds if inputs_embeds is not None else self.embed(input_ids)
+        embeds = x
+        new_len = x.shape[1]
+        if position_ids is None:
+            past_len = past_key_values[0][0].shape[1] if past_key_values is not None else 0
+            position_ids = self.position_ids(attention_mask, past_len, new_len, device=x.device)
+        x = x + self.position(position_ids.clamp(max=self.max_positions - 1)).to(x.dtype)
+        if inputs_embeds is not None:
+            # prefill（含共用前綴之後的部分）：記下 prompt 長度，之後依已產生的 token 數決定輸出
+            self._prompt_len = attention_mask.shape[1] if attention_mask is not None else new_len
+
+        presents = []
+        for i, (qkv, mlp) in enumerate(zip(self.qkv, self.mlp)):
+            q, k, v = qkv(x).chunk(3, dim=-1)
+            if self.free_running:
+                q = q * 8
+            if past_key_values is not None:
+                k = torch.cat([past_key_values[i][0], k], dim=1)
+                v = torch.cat([past_key_values[i][1], v], dim=1)
+            presents.append((k, v))
+            total_len = k.shape[1]
+            causal = torch.ones(new_len, total_len, dtype=torch.bool, device=x.device).tril(total_len - new_len)
+            mask = causal.unsqueeze(0)
+            if attention_mask is not None:
+                mask = mask & attention_mask[:, None, -total_len:].bool()
+                # left padding 的位置至少看得到自己，避免整列被遮住而產生 NaN
+                mask[:, :, total_len - new_len:] |= torch.eye(new_len, dtype=torch.bool, device=x.device)
+            x = x + mlp(F.scaled_dot_product_attention(q, k, v, attn_mask=mask))
+
+        logits = self.lm_head(x - embeds if self.free_running else x)
+        if not self.free_running:
+            # 固定輸出 response_ids，結束後輸出 EOS
+            step = (attention_mask.shape[1] if attention_mask is not None else total_len) - self._prompt_len
+            target = self.response_ids[step] if step < len(self.response_ids) else EOS_ID
+            logits[:, -1, target] += 1e4
+        return StubOutput(logits, tuple(presents) if use_cache else None)
+
+    @torch.no_grad()
+    def generate(self, inputs_embeds=None, attention_mask=None, max_new_tokens=512, eos_token_id=EOS_ID,
+                 pad_token_id=PAD_ID, stopping_criteria=None, **kwargs):
+        # greedy decode，回傳新產生的 token（與 HF 以 inputs_embeds 呼叫時相同）；
+        # stopping_criteria 每步以目前產生的 token 呼叫，回傳每列是否停止
+        outputs = self(inputs_embeds=inputs_embeds, attention_mask=attention_mask, use_cache=True)
+        batch = inputs_embeds.shape[0]
+        finished = torch.zeros(batch, dtype=torch.bool)
+        generated = []
+        for _ in range(max_new_tokens):
+            next_token = outputs.logits[:, -1, :].argmax(dim=-1)
+            next_token = torch.where(finished, torch.full_like(next_token, pad_token_id), next_token)
+            generated.append(next_token)
+            finished |= next_token == eos_token_id
+            for criteria in stopping_criteria or []:
+                finished |= torch.as_tensor(criteria(torch.stack(generated, dim=1), None), dtype=torch.bool)
+            if finished.all():
+                break
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((batch, 1))], dim=1)
+            outputs = self(input_ids=next_token[:, None], attention_mask=attention_mask,
+                           past_key_values=outputs.past_key_values, use_cache=True)
+        return torch.stack(generated, dim=1)
+
+
+class StubVLModel(nn.Module):
+    def __init__(self, processor, response="", hidden_size=256, num_layers=2, seed=0):
+        super().__init__()
+        torch.manual_seed(seed)
+        tokenizer = processor.tokenizer
+        self.language_model = StubLanguageModel(
+            tokenizer.vocab_size, hidden_size, num_layers,
+            response_ids=None if response is None else tokenizer.encode(response)
+        )
+        patch = processor.image_size // processor.image_grid
+        self.image_grid = processor.image_grid
+        self.vision = nn.Linear(3 * patch * patch, hidden_size)
+
+    @property
+    def device(self):
+        return next(self.parameters()).device
+
+    def prepare_inputs_embeds(self, input_ids, images_seq_mask, images, **kwargs):
+        # 圖片切成 grid x grid 個 patch 投影成 token，取代 images_seq_mask 的位置
+        embeds = self.language_model.embed(input_ids)
+        b, c, h, w = images.shape
+        g = self.image_grid
+        patches = images.view(b, c, g, h // g, g, w // g).permute(0, 2, 4, 1, 3, 5).reshape(b, g * g, -1)
+        if self.language_model.free_running:
+            patches = (patches - patches.mean(dim=-1, keepdim=True)) / (patches.std(dim=-1, keepdim=True) + 1e-3) * 4
+        features = self.vision(patches)
+        # 每張圖片取前 n 個 patch（n 為該列的圖片 token 數，固定 token 數時即為全部）
+        counts = images_seq_mask.sum(dim=1).tolist()
+        features = torch.cat([features[i, :n] for i, n in enumerate(counts)])
+        embeds[images_seq_mask] = features.to(embeds.dtype)
+        return embeds
+
+
+def load_stub_model(prompt_template, hidden_size=256, num_layers=2, image_grid=16, seed=0, trailing_tokens=0,
+                    free_running=False, dynamic_tokens=False):
+    # trailing_tokens > 0 時在 JSON 之後多產生這麼多字的說明文字（模擬模型在 JSON 結束後不停止）
+    trailing = ("\n以上為辨識結果，若有欄位無法辨認則填入空字串。" * (trailing_tokens // 20 + 1))[:trailing_tokens]
+    processor = StubProcessor(image_grid=image_grid, dynamic_tokens=dynamic_tokens)
+    response = None if free_running else output_template(prompt_template) + trailing
+    model = StubVLModel(processor, response=response,
+                        hidden_size=hidden_size, num_layers=num_layers, seed=seed).eval()
+    return processor, model
@@ -0,0 +1,73 @@
+import time
+import random
+import asyncio
+from aiohttp import web
+from tasks import output_template
+
+# ----------------------------
+# 本地 OpenAI 相容 stub server（給 http_backend 測試 / benchmark 使用）
+# ----------------------------
+# POST /v1/chat/completions：等待 latency ± jitter 秒後，回傳 prompt 中的 JSON 範本，
+# 可用 fail_rate 模擬 503 以測試重試；每個 request 各自 sleep，所以吞吐量會隨 client 的 concurrency 線性增加。
+# GET /stats：回傳累計 request 數、失敗數與同時處理中的最大 request 數。
+def make_app(latency=0.5, jitter=0.1, fail_rate=0.0, seed=0):
+    rng = random.Random(seed)
+    stats = {"requests": 0, "failures": 0, "in_flight": 0, "max_in_flight": 0}
+
+    async def chat_completions(request):
+        payload = await request.json()
+        content = payload["messages"][-1]["content"]
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        prompt = "".join(p.get("text", "") for p in parts if p.get("type") == "text")
+        images = [p for p in parts if p.get("type") == "image_url"]
+        if not images or not images[0]["image_url"]["url"].startswith("data:image/"):
+            return web.json_response({"error": {"message": "缺少 image_url"}}, status=400)
+
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(max(0.0, latency + rng.uniform(-jitter, jitter)))
+        finally:
+            stats["in_flight"] -= 1
+        if rng.random() < fail_rate:
+            stats["failures"] += 1
+            return web.json_response({"error": {"message": "simulated overload"}}, status=503,
+                                     headers={"Retry-After": "0"})
+
+        # 以 prompt 中的 JSON 範本作為固定輸出，讓解析與評分也走正常流程
+        text = output_template(prompt)
+        return web.json_response({
+            "id": f"chatcmpl-stub-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(text),
+                      "total_tokens": len(prompt) + len(text)},
+        })
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application(client_max_size=64 * 1024 ** 2)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5, help="每個 request 的模擬延遲秒數")
+    parser.add_argument("--jitter", type=float, default=0.1, help="延遲的隨機浮動範圍（秒）")
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="回傳 503 的機率（測試重試用）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    web.run_app(make_app(args.latency, args.jitter, args.fail_rate, args.seed), host=args.host, port=args.port)
+
+# python stub_server.py --port=8000 --latency=0.5 --fail_rate=0.05
@@ -0,0 +1,343 @@
+import os
+import gc
+import sys
+import json
+import time
+import queue
+import argparse
+import contextlib
+import traceback
+import multiprocessing as mp
+from tasks import DATA_TYPES, get_task
+
+# ----------------------------
+# model × prompt × task 的實驗 sweep
+# ----------------------------
+# grid（JSON spec 或命令列參數）展開成多個 run，每個 run 即一次 run_inference：
+#   {"name": "v3", "models": ["deepseek-vl2-tiny", "deepseek-vl2-small"], "data_types": ["損益表", "存摺封面"],
+#    "prompt_names": ["損益表", "損益表_v3"], "devices": ["cuda:0", "cuda:1"], "options": {"batch_size": 4}}
+# - data_types 可為 "all"；prompt_names 的對應方式與 execute.py 相同（以資料類型開頭者歸屬該任務，未指定則用預設 prompt）
+# - 每個 device 一個 worker process，模型載入後一直沿用：worker 優先接同一個模型、同一個任務的下一個 run，
+#   其次是其他 worker 沒有載入的模型，盡量減少重新載入；同一任務的 prompt 連續執行，圖片 / feature 快取可以重複使用
+# - options 傳給 run_inference（預設啟用圖片、feature 與推理結果快取，見 DEFAULT_OPTIONS）
+# - 每個 run 的狀態記錄在 outputs/sweeps/{name}.json，output 名稱固定為 {model}_{name}_{prompt_name}；
+#   中斷後以相同的 name 再執行一次，已完成的 run 會略過，未完成的 run 從 journal 接續（--resume）
+# - 全部結束後以各任務的 evaluator 評分，印出各任務 prompt × model 的平均準確率並寫入 outputs/sweeps/{name}.csv
+SWEEP_DIR = os.path.join("outputs", "sweeps")
+DEFAULT_OPTIONS = {
+    "image_cache_dir": os.path.join(".cache", "images"),
+    "feature_cache_dir": os.path.join(".cache", "features"),
+    "response_cache_dir": os.path.join(".cache", "responses"),
+}
+# sweep 自己管理模型與平行度，這些 run_inference 參數不能由 options 指定
+RESERVED_OPTIONS = {"model_name", "data_type", "prompt_name", "output_name", "processor", "model", "device",
+                    "resume", "num_workers", "devices", "shard"}
+
+def status_path(name):
+    return os.path.join(SWEEP_DIR, f"{name}.json")
+
+def log_path(name, run_id):
+    return os.path.join(SWEEP_DIR, name, f"{run_id}.log")
+
+def load_status(name):
+    path = status_path(name)
+    if not os.path.exists(path):
+        return {"name": name, "runs": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_status(status):
+    # 先寫入暫存檔再 rename，中途當機也不會留下壞掉的狀態檔
+    path = status_path(status["name"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+# ----------------------------
+# 展開 grid
+# ----------------------------
+def plan_runs(name, models, data_types, prompt_names=None, options=None):
+    # 依 model → 任務 → prompt 的順序展開（即預設的執行順序）
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    reserved = RESERVED_OPTIONS & set(options)
+    if reserved:
+        raise ValueError(f"options 不能指定 {', '.join(sorted(reserved))}（由 sweep 決定）")
+    data_types = DATA_TYPES if data_types in ("all", ["all"]) else data_types
+    runs = []
+    for model in models:
+        for data_type in data_types:
+            for prompt_name in get_task(data_type).prompt_names(prompt_names):
+                output_name = f"{model.replace('/', '_')}_{name}_{prompt_name}"
+                runs.append({
+                    "id": f"{data_type}/{output_name}",
+                    "model": model,
+                    "data_type": data_type,
+                    "prompt_name": prompt_name,
+                    "output_name": output_name,
+                    "options": options,
+                })
+    return runs
+
+def merge_plan(status, runs):
+    # 新的 run 加入狀態檔；已存在的 run 保留原本的狀態與分數
+    for run in runs:
+        entry = status["runs"].setdefault(run["id"], {**run, "status": "pending"})
+        entry["options"] = run["options"]
+    return [status["runs"][run["id"]] for run in runs]
+
+def next_run(pending, model=None, data_type=None, loaded=()):
+    """
+    worker 目前載入 model、剛跑完 data_type 時要接的下一個 run：
+    同模型同任務 > 同模型 > 其他 worker 沒有載入的模型 > 依序的第一個。
+    """
+    for match in (
+        lambda run: run["model"] == model and run["data_type"] == data_type,
+        lambda run: run["model"] == model,
+        lambda run: run["model"] not in loaded,
+        lambda run: True,
+    ):
+        for run in pending:
+            if match(run):
+                return run
+    return None
+
+# ----------------------------
+# 執行 run（同一個 process 內沿用已載入的模型）
+# ----------------------------
+class RunExecutor:
+    def __init__(self, sweep_name, device=None):
+        self.sweep_name = sweep_name
+        self.device = device
+        self.model_name = None
+        self.processor = None
+        self.model = None
+
+    def _load(self, model_name):
+        # 真的要推理時才載入 torch / transformers / deepseek_vl2
+        import torch
+        from inference import load_model
+        if self.model is not None:
+            self.model_name = self.processor = self.model = None
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        self.processor, self.model = load_model(os.path.join("model", model_name), device=self.device)
+        self.model_name = model_name
+
+    def run(self, run):
+        """回傳 (狀態, 準確率)；提前中止的 run 沿用串流評估的準確率，其餘在 sweep 結束時評分。"""
+        from inference import run_inference
+        path = log_path(self.sweep_name, run["id"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            print(f"\n===== {time.strftime('%Y-%m-%d %H:%M:%S')} {run['id']} ({self.device or 'auto'}) =====")
+            if run["model"] != self.model_name:
+                print(f"🔧 Loading model: {run['model']}")
+                self._load(run["model"])
+            live = run_inference(
+                model_name=run["model"],
+                data_type=run["data_type"],
+                prompt_name=run["prompt_name"],
+                output_name=run["output_name"],
+                processor=self.processor,
+                model=self.model,
+                resume=True,
+                **run["options"]
+            )
+        if live is not None and live.aborted:
+            return "aborted", live.accuracy()
+        return "done", None
+
+
+def _worker(index, sweep_name, device, tasks, results):
+    # 在 worker process 中執行（spawn），依序執行主 process 分派的 run，直到收到 None
+    executor = RunExecutor(sweep_name, device)
+    while True:
+        run = tasks.get()
+        if run is None:
+            break
+        try:
+            state, accuracy = executor.run(run)
+            results.put((index, run["id"], state, accuracy, None))
+        except Exception:
+            results.put((index, run["id"], "failed", None, traceback.format_exc(limit=5)))
+
+# ----------------------------
+# 排程
+# ----------------------------
+def _start(status, run, device):
+    run.update(status="running", device=str(device), started_at=time.strftime("%Y-%m-%d %H:%M:%S"), error=None)
+    save_status(status)
+    print(f"▶️ {run['id']} → {device or 'auto'}（log：{log_path(status['name'], run['id'])}）")
+
+def _finish(status, run, state, accuracy=None, error=None):
+    run.update(status=state, finished_at=time.strftime("%Y-%m-%d %H:%M:%S"), error=error)
+    if accuracy is not None:
+        run["accuracy"] = {k: float(v) for k, v in accuracy.items()}
+    save_status(status)
+    mark = {"done": "✅", "aborted": "⛔", "failed": "❌"}[state]
+    print(f"{mark} {run['id']}：{state}" + (f"\n{error}" if error else ""))
+
+def run_sequential(status, pending, device=None):
+    executor = RunExecutor(status["name"], device)
+    data_type = None
+    while pending:
+        run = next_run(pending, executor.model_name, data_type)
+        pending.remove(run)
+        data_type = run["data_type"]
+        _start(status, run, device)
+        try:
+            state, accuracy = executor.run(run)
+            _finish(status, run, state, accuracy)
+        except Exception:
+            _finish(status, run, "failed", error=traceback.format_exc(limit=5))
+
+def run_parallel(status, pending, devices):
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    workers = []
+    for index, device in enumerate(devices):
+        tasks = ctx.Queue()
+        process = ctx.Process(target=_worker, args=(index, status["name"], device, tasks, results),
+                              name=f"sweep{index}")
+        process.start()
+        workers.append({"process": process, "tasks": tasks, "device": device, "model": None, "data_type": None,
+                        "run": None, "closed": False})
+
+    def dispatch(worker):
+        loaded = {w["model"] for w in workers if w is not worker}
+        run = next_run(pending, worker["model"], worker["data_type"], loaded)
+        if run is None:
+            worker["tasks"].put(None)
+            worker["closed"] = True
+            return
+        pending.remove(run)
+        worker.update(run=run, model=run["model"], data_type=run["data_type"])
+        _start(status, run, worker["device"])
+        worker["tasks"].put(run)
+
+    for worker in workers:
+        dispatch(worker)
+    while any(worker["run"] is not None for worker in workers):
+        try:
+            index, run_id, state, accuracy, error = results.get(timeout=1.0)
+        except queue.Empty:
+            # worker 異常結束（例如被 OOM killer 終止）時，進行中的 run 記為失敗，不再分派給它
+            for worker in workers:
+                if worker["run"] is not None and not worker["process"].is_alive():
+                    _finish(status, worker["run"], "failed",
+                            error=f"worker 異常結束（exit code {worker['process'].exitcode}）")
+                    worker["run"] = None
+            continue
+        worker = workers[index]
+        _finish(status, worker["run"], state, accuracy, error)
+        worker["run"] = None
+        dispatch(worker)
+    for worker in workers:
+        if not worker["closed"] and worker["process"].is_alive():
+            worker["tasks"].put(None)
+        worker["process"].join()
+    # 所有 worker 都異常結束時，還沒分派的 run 記為失敗（否則會停在 pending，看不出 sweep 沒有跑完）
+    for run in list(pending):
+        pending.remove(run)
+        _finish(status, run, "failed", error="沒有存活的 worker 可以執行（所有 worker 都已異常結束）")
+
+# ----------------------------
+# 評分與總表
+# ----------------------------
+def score_runs(status, rescore=False):
+    for run in status["runs"].values():
+        if run["status"] != "done" or ("accuracy" in run and not rescore):
+            continue
+        try:
+            acc = get_task(run["data_type"]).evaluate(run["output_name"])
+        except Exception as e:
+            print(f"❌ {run['id']} 評分失敗：{e}")
+            continue
+        run["accuracy"] = {k: float(v) for k, v in acc.items()}
+        save_status(status)
+
+def summary_table(status):
+    import pandas as pd  # 只在輸出總表時才需要
+    records = [
+        {"data_type": run["data_type"], "prompt_name": run["prompt_name"], "model": run["model"],
+         "mean_accuracy": sum(run["accuracy"].values()) / len(run["accuracy"]) if run["accuracy"] else 0.0}
+        for run in status["runs"].values() if run.get("accuracy") is not None
+    ]
+    if not records:
+        return None
+    return pd.DataFrame(records).pivot_table(index=["data_type", "prompt_name"], columns="model",
+                                             values="mean_accuracy")
+
+def run_sweep(name, models, data_types, prompt_names=None, options=None, devices=None, rescore=False):
+    status = load_status(name)
+    runs = merge_plan(status, plan_runs(name, models, data_types, prompt_names, options))
+    save_status(status)
+
+    # 已完成（或提前中止）的 run 略過；失敗或中斷的 run 重新執行並從 journal 接續
+    pending = [run for run in runs if run["status"] not in ("done", "aborted")]
+    print(f"🧪 Sweep {name}：{len(runs)} 個 run，已完成 {len(runs) - len(pending)} 個，"
+          f"待執行 {len(pending)} 個（{len(set(run['model'] for run in pending))} 個模型）")
+    if pending:
+        devices = devices or [None]
+        if len(devices) > 1:
+            run_parallel(status, pending, devices)
+        else:
+            run_sequential(status, pending, devices[0])
+
+    print("\n開始評分")
+    score_runs(status, rescore=rescore)
+    table = summary_table(status)
+    if table is not None:
+        table.to_csv(os.path.join(SWEEP_DIR, f"{name}.csv"), encoding="utf-8-sig")
+        print("\n========== 平均準確率 ==========")
+        print(table.to_string(float_format=lambda v: f"{v:.2%}"))
+    failed = [run["id"] for run in runs if run["status"] == "failed"]
+    if failed:
+        print(f"\n❌ {len(failed)} 個 run 失敗（以相同的 --name 再執行一次即可接續）：" + ", ".join(failed))
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spec", type=str, default=None, help="grid spec 的 JSON 檔（命令列參數會覆蓋其中的設定）")
+    parser.add_argument("--name", type=str, default=None, help="sweep 名稱（狀態記錄於 outputs/sweeps/{name}.json，用於接續）")
+    parser.add_argument("--models", type=str, nargs="+", default=None, help="模型名稱列表，例如 deepseek-vl2-tiny deepseek-vl2-small")
+    parser.add_argument("--data_types", type=str, nargs="+", default=None, help="資料類型列表，或 all")
+    parser.add_argument("--prompt_names", type=str, nargs="+", default=None, help="prompt 名稱列表（以資料類型開頭者套用於該任務）")
+    parser.add_argument("--devices", type=str, nargs="+", default=None, help="每個裝置一個 worker 平行執行，例如 cuda:0 cuda:1（預設單一 process）")
+    parser.add_argument("--option", type=str, nargs="+", default=[], metavar="KEY=VALUE", help="傳給 run_inference 的參數（VALUE 以 JSON 解析），例如 batch_size=4")
+    parser.add_argument("--rescore", action="store_true", help="重新評分所有已完成的 run")
+    args = parser.parse_args()
+
+    spec = {}
+    if args.spec:
+        with open(args.spec, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+    options = dict(spec.get("options", {}))
+    for item in args.option:
+        key, _, value = item.partition("=")
+        try:
+            options[key] = json.loads(value)
+        except json.JSONDecodeError:
+            options[key] = value
+
+    name = args.name or spec.get("name")
+    models = args.models or spec.get("models")
+    data_types = args.data_types or spec.get("data_types")
+    if not (name and models and data_types):
+        parser.error("需要 name、models 與 data_types（以 --spec 或命令列指定）")
+    for data_type in ([] if data_types in ("all", ["all"]) else data_types):
+        get_task(data_type)
+
+    status = run_sweep(name, models, data_types, prompt_names=args.prompt_names or spec.get("prompt_names"),
+                       options=options, devices=args.devices or spec.get("devices"), rescore=args.rescore)
+    # 有失敗的 run 時以非零狀態結束，方便排程 / CI 偵測
+    if any(run["status"] == "failed" for run in status["runs"].values()):
+        sys.exit(1)
+
+# python sweep.py --name=v3 --models deepseek-vl2-tiny deepseek-vl2-small --data_types 損益表 存摺封面 --prompt_names 損益表 損益表_v3
+# python sweep.py --spec=sweeps/v3.json --devices cuda:0 cuda:1
+# python sweep.py --name=v3 --models deepseek-vl2-tiny --data_types all --option batch_size=4 live_eval=true
@@ -0,0 +1,78 @@
+import os
+import re
+import importlib
+from collections import namedtuple
+
+# ----------------------------
+# 任務註冊表：data_type → evaluator / prompt / schema
+# ----------------------------
+# 只記錄模組與函數名稱，第一次用到時才 import evaluator（evaluator 只依賴 pandas / pyarrow，
+# 不會載入 torch），所以只做評估或 --help 時不需要模型相關套件。
+
+# 模型輸出的 schema：欄位順序與評分欄位相同，root 為最外層結構（"{" dict 或 "[" list of dicts）
+Schema = namedtuple("Schema", ["fields", "root"])
+
+
+class Task:
+    def __init__(self, data_type, evaluator, evaluate_fn, root="{", resample="lanczos"):
+        self.data_type = data_type
+        self.evaluator = evaluator        # evaluator 模組名稱
+        self.evaluate_fn = evaluate_fn    # 以 output 名稱評估的函數名稱
+        self.root = root                  # 輸出的最外層結構
+        self.resample = resample          # 圖片縮放濾波器（preprocess.RESAMPLE_FILTERS）
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.evaluator)
+        return self._module
+
+    @property
+    def fields(self):
+        # 評分欄位（schema），定義在各 evaluator 的 FIELDS
+        return list(self.module.FIELDS)
+
+    @property
+    def schema(self):
+        return Schema(self.fields, self.root)
+
+    def prompt_path(self, prompt_name=None):
+        return os.path.join("prompt", f"{prompt_name or self.data_type}.txt")
+
+    def prompt_names(self, prompt_names=None):
+        # prompt 名稱以資料類型開頭者（例如 損益表_v3）歸屬該任務；未指定時固定為 prompt/資料類型.txt
+        matched = [name for name in (prompt_names or []) if name.startswith(self.data_type)]
+        return matched or [self.data_type]
+
+    def evaluate(self, output_name):
+        return getattr(self.module, self.evaluate_fn)(output_name)
+
+    def evaluate_results(self, path):
+        return self.module.evaluate_results(path)
+
+    def score_frame(self, df):
+        return self.module.score_frame(df)
+
+
+TASKS = {
+    task.data_type: task
+    for task in [
+        Task("員工報支", "evaluation_員工報支", "evaluate_expenses", root="["),
+        Task("存摺封面", "evaluation_存摺封面", "evaluate_covers"),
+        Task("損益表", "evaluation_損益表", "evaluate_income"),
+        Task("貸款申請書", "evaluation_貸款申請書", "evaluate_loan"),
+        Task("資產負債表", "evaluation_資產負債表", "evaluate_balance"),
+    ]
+}
+DATA_TYPES = list(TASKS)
+
+def output_template(prompt_template):
+    # prompt 中的 JSON 輸出範本（第一個 { 或 [ 到最後一個 } 或 ]）；找不到時回傳 "{}"
+    match = re.search(r"[\[\{].*[\]\}]", prompt_template, flags=re.S)
+    return match.group(0) if match else "{}"
+
+def get_task(data_type):
+    if data_type not in TASKS:
+        raise ValueError(f"不支援的資料類型：{data_type}")
+    return TASKS[data_type]
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+
+# ----------------------------
+# 推理各階段的計時與 token 統計
+# ----------------------------
+# 每個 span 寫成一行 JSON（outputs/{data_type}/{output_name}.telemetry.jsonl）：
+#   {"ts": 開始時間, "stage": "generate", "seconds": 1.23, "batch": 7, "input_tokens": [...], ...}
+# stage 包含 model_load、image_decode（prefetch 時改為主執行緒等待圖片的 image_wait，背景解碼耗時記在 decode_seconds 欄位）、encode（processor，含 input token 數）、image_hash（feature cache）、prepare_inputs_embeds、
+# prefill、generate、decode（含 output token 數），以及每個 batch 一筆 batch 紀錄（檔名、圖片尺寸、總耗時），
+# 同一個 batch 的紀錄有相同的 batch 編號。每個 stage 只記主執行緒實際花費的時間，各 stage 加總不會重複計算。
+# resume 時接在既有的檔案之後，否則重新寫入。
+# 有設定 metrics_path 時，另外以 Prometheus text format 寫出累計值（可給 node_exporter textfile collector 讀取）。
+
+def device_sync(device):
+    # GPU 上的 kernel 是非同步執行的，計時前後需要 synchronize 才會算進正確的階段
+    if getattr(device, "type", None) != "cuda":
+        return None
+    import torch
+    return lambda: torch.cuda.synchronize(device)
+
+def generated_length(ids, eos_token_id, pad_token_id=None):
+    # 產生的 token 數（算到第一個 EOS 為止，不含後面的 padding；提前停止的列之後以 pad_token_id 補齊）
+    if eos_token_id in ids:
+        return ids.index(eos_token_id) + 1
+    length = len(ids)
+    while pad_token_id is not None and length and ids[length - 1] == pad_token_id:
+        length -= 1
+    return length
+
+
+class Telemetry:
+    def __init__(self, path=None, metrics_path=None, labels=None, metrics_interval=5.0, resume=False):
+        self.path = path
+        self.metrics_path = metrics_path
+        self.labels = labels or {}
+        self.metrics_interval = metrics_interval
+        self.context = {}  # 會併入每筆紀錄（例如目前的 batch 編號）
+        self.totals = {}   # stage → [次數, 秒數]
+        self.counters = {"documents": 0, "input_tokens": 0, "output_tokens": 0}
+        self._lock = threading.Lock()
+        self._last_metrics = 0.0
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    @property
+    def enabled(self):
+        return self._file is not None or self.metrics_path is not None
+
+    def record(self, stage, seconds, **fields):
+        with self._lock:
+            count_seconds = self.totals.setdefault(stage, [0, 0.0])
+            count_seconds[0] += 1
+            count_seconds[1] += seconds
+            if self._file is not None:
+                entry = {"ts": time.time() - seconds, "stage": stage, "seconds": round(seconds, 6),
+                         **self.context, **fields}
+                self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    @contextmanager
+    def span(self, stage, sync=None, **fields):
+        """
+        with telemetry.span("generate") as fields:
+            ...
+            fields["output_tokens"] = [...]
+        sync 為計時前後要呼叫的函數（例如 torch.cuda.synchronize），讓 GPU 的非同步工作算進正確的階段。
+        """
+        if not self.enabled:
+            yield fields
+            return
+        if sync is not None:
+            sync()
+        start = time.perf_counter()
+        yield fields
+        if sync is not None:
+            sync()
+        self.record(stage, time.perf_counter() - start, **fields)
+
+    def count(self, documents=0, input_tokens=0, output_tokens=0):
+        with self._lock:
+            self.counters["documents"] += documents
+            self.counters["input_tokens"] += input_tokens
+            self.counters["output_tokens"] += output_tokens
+
+    def flush(self, force=False):
+        # 每個 batch 結束時呼叫；metrics 檔最多每 metrics_interval 秒改寫一次
+        if self._file is not None:
+            self._file.flush()
+        if self.metrics_path and (force or time.time() - self._last_metrics >= self.metrics_interval):
+            self.write_metrics()
+
+    # ----------------------------
+    # Prometheus text format
+    # ----------------------------
+    def _label_text(self, **extra):
+        labels = {**self.labels, **extra}
+        if not labels:
+            return ""
+        parts = []
+        for key, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            parts.append(f'{key}="{value}"')
+        return "{" + ",".join(parts) + "}"
+
+    def metrics_text(self):
+        lines = [
+            "# HELP vqa_stage_seconds_total Seconds spent in each inference stage.",
+            "# TYPE vqa_stage_seconds_total counter",
+        ]
+        with self._lock:
+            totals = {stage: list(v) for stage, v in self.totals.items()}
+            counters = dict(self.counters)
+        for stage, (_, seconds) in totals.items():
+            lines.append(f"vqa_stage_seconds_total{self._label_text(stage=stage)} {seconds:.6f}")
+        lines += [
+            "# HELP vqa_stage_calls_total Number of spans recorded for each inference stage.",
+            "# TYPE vqa_stage_calls_total counter",
+        ]
+        for stage, (count, _) in totals.items():
+            lines.append(f"vqa_stage_calls_total{self._label_text(stage=stage)} {count}")
+        lines += [
+            "# HELP vqa_documents_total Documents processed.",
+            "# TYPE vqa_documents_total counter",
+            f"vqa_documents_total{self._label_text()} {counters['documents']}",
+            "# HELP vqa_tokens_total Prompt (input) and generated (output) tokens.",
+            "# TYPE vqa_tokens_total counter",
+            f"vqa_tokens_total{self._label_text(kind='input')} {counters['input_tokens']}",
+            f"vqa_tokens_total{self._label_text(kind='output')} {counters['output_tokens']}",
+            "# HELP vqa_last_update_seconds Unix time of the last metrics update.",
+            "# TYPE vqa_last_update_seconds gauge",
+            f"vqa_last_update_seconds{self._label_text()} {time.time():.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        self._last_metrics = time.time()
+        os.makedirs(os.path.dirname(self.metrics_path) or ".", exist_ok=True)
+        tmp_path = f"{self.metrics_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.metrics_text())
+        os.replace(tmp_path, self.metrics_path)
+
+    def summary(self):
+        total = sum(seconds for stage, (_, seconds) in self.totals.items() if stage != "batch") or 1.0
+        parts = [
+            f"{stage} {seconds:.1f}s ({seconds / total:.0%})"
+            for stage, (_, seconds) in sorted(self.totals.items(), key=lambda item: -item[1][1])
+            if stage != "batch"
+        ]
+        return " | ".join(parts)
+
+    def close(self):
+        self.flush(force=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# ----------------------------
+# 分析 telemetry.jsonl：各階段耗時占比與 token 吞吐量
+# ----------------------------
+def summarize(path):
+    stages = {}
+    documents = input_tokens = output_tokens = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中斷時可能留下不完整的最後一行
+            stats = stages.setdefault(entry["stage"], {"calls": 0, "seconds": 0.0})
+            stats["calls"] += 1
+            stats["seconds"] += entry["seconds"]
+            if entry["stage"] == "batch":
+                documents += len(entry.get("filenames", []))
+            elif entry["stage"] == "encode":
+                input_tokens += sum(entry.get("input_tokens", []))
+            elif entry["stage"] == "decode":
+                output_tokens += sum(entry.get("output_tokens", []))
+    return stages, {"documents": documents, "input_tokens": input_tokens, "output_tokens": output_tokens}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", type=str, help="telemetry.jsonl 路徑，例如 outputs/損益表/DeepSeek-VL2-test.telemetry.jsonl")
+    args = parser.parse_args()
+
+    stages, counters = summarize(args.path)
+    batch_seconds = stages.get("batch", {}).get("seconds", 0.0)
+    stage_total = sum(v["seconds"] for k, v in stages.items() if k != "batch") or 1.0
+    for stage, stats in sorted(stages.items(), key=lambda item: -item[1]["seconds"]):
+        if stage == "batch":
+            continue
+        print(f"{stage:<24} {stats['seconds']:>10.1f}s  {stats['seconds'] / stage_total:>6.1%}  "
+              f"({stats['calls']} 次，平均 {stats['seconds'] / stats['calls']:.3f}s)")
+    print("------")
+    print(f"文件 {counters['documents']} 份 | input tokens {counters['input_tokens']} | "
+          f"output tokens {counters['output_tokens']}")
+    if batch_seconds:
+        print(f"batch 總耗時 {batch_seconds:.1f}s | {counters['documents'] / batch_seconds:.2f} 份/秒 | "
+              f"output {counters['output_tokens'] / batch_seconds:.1f} tokens/秒")
+
+# python telemetry.py outputs/損益表/DeepSeek-VL2-test.telemetry.jsonl
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模組都放在 repo 根目錄，測試直接 import（python -m pytest tests）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
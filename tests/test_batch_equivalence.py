@@ -0,0 +1,39 @@
+import argparse
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import benchmark_inference
+import stub_model
+
+# ----------------------------
+# batch 推理（left padding）與逐張推理的輸出相同（benchmark_inference.py --check_equivalence）
+# ----------------------------
+def equivalence_args(**overrides):
+    args = dict(
+        data_type="損益表", images=8, width=400, height=560, seed=0, model_path=None, device="cpu",
+        hidden_size=64, num_layers=2, image_grid=8, trailing_tokens=0, fast_decode=False,
+        batch_size=4, max_new_tokens=8, prompt_layout="image_first", logit_tolerance=1e-3,
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize("prompt_layout", ["image_first", "prompt_first"])
+def test_batched_outputs_match_single(prompt_layout):
+    result = benchmark_inference.check_equivalence(equivalence_args(prompt_layout=prompt_layout))
+    assert result["distinct_outputs"] > 1  # 輸出隨圖片改變，否則比對沒有意義
+    assert result["mismatched"] == []
+    assert result["passed"]
+
+
+def test_position_bug_is_detected(monkeypatch):
+    # 位置若從 padding 起算（忽略 attention_mask），left padding 的列輸出會改變
+    def padded_positions(attention_mask, past_len, new_len, device=None):
+        return torch.arange(past_len, past_len + new_len, device=device)[None]
+
+    monkeypatch.setattr(stub_model.StubLanguageModel, "position_ids", staticmethod(padded_positions))
+    result = benchmark_inference.check_equivalence(equivalence_args())
+    assert result["mismatched"]
+    assert not result["passed"]
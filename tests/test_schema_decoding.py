@@ -0,0 +1,137 @@
+import os
+import json
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from schema_decoding import SchemaDecoder, template_indent
+from tasks import get_task
+
+# ----------------------------
+# SchemaDecoder：以「照著目標文字輸出」的 oracle 模型檢查 key-forced decoding
+# ----------------------------
+# oracle 的 KV cache 就是已餵入的文字；餵入的文字一定要是目標文字的前綴（scaffold 或多出的文字若與模型的輸出
+# 不一致，這裡就會失敗），並以目標文字接下來的第一個 token 作為 greedy 的輸出。
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EOS_ID = 1
+VOCAB_SIZE = 512
+
+
+class MergingTokenizer:
+    """依 merges 合併常見的多字元 token（例如 `",`、`0,`），讓 value 的結束 token 帶著分隔符號。"""
+
+    def __init__(self, merges=()):
+        self.merges = sorted(merges, key=len, reverse=True)
+        self.eos_token_id = EOS_ID
+        self._ids = {}
+        self._pieces = {}
+
+    def _id(self, piece):
+        if piece not in self._ids:
+            self._ids[piece] = 2 + len(self._ids)
+            self._pieces[self._ids[piece]] = piece
+        return self._ids[piece]
+
+    def encode(self, text, add_special_tokens=False):
+        ids, i = [], 0
+        while i < len(text):
+            piece = next((m for m in self.merges if text.startswith(m, i)), text[i])
+            ids.append(self._id(piece))
+            i += len(piece)
+        return ids
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(self._pieces.get(int(i), "") for i in ids)
+
+
+class OracleOutput:
+    def __init__(self, logits, past_key_values):
+        self.logits = logits
+        self.past_key_values = past_key_values
+
+
+class OracleLanguageModel:
+    def __init__(self, tokenizer, target):
+        self.tokenizer = tokenizer
+        self.target = target
+
+    def __call__(self, input_ids=None, attention_mask=None, past_key_values=None, use_cache=True, **kwargs):
+        context = (past_key_values or "") + self.tokenizer.decode(input_ids[0].tolist())
+        assert self.target.startswith(context), f"餵入的文字與模型輸出不一致：{context!r}"
+        rest = self.target[len(context):]
+        logits = torch.zeros(1, 1, VOCAB_SIZE)
+        logits[0, -1, self.tokenizer.encode(rest)[0] if rest else EOS_ID] = 1.0
+        return OracleOutput(logits, context)
+
+
+class OracleModel:
+    def __init__(self, tokenizer, target):
+        self.language_model = OracleLanguageModel(tokenizer, target)
+
+
+def free_decode(model, tokenizer, max_new_tokens=4096):
+    # 不受 schema 限制的 greedy decode（對照組）
+    outputs = model.language_model(input_ids=torch.zeros(1, 0, dtype=torch.long))
+    ids = []
+    for _ in range(max_new_tokens):
+        token_id = int(outputs.logits[0, -1].argmax())
+        if token_id == EOS_ID:
+            break
+        ids.append(token_id)
+        outputs = model.language_model(input_ids=torch.tensor([[token_id]]),
+                                       past_key_values=outputs.past_key_values)
+    return tokenizer.decode(ids)
+
+
+def schema_decode(data_type, record, merges=()):
+    tokenizer = MergingTokenizer(merges)
+    with open(os.path.join(REPO_DIR, get_task(data_type).prompt_path()), "r", encoding="utf-8") as f:
+        prompt_template = f.read()
+    # 目標文字與 prompt 輸出範本的縮排相同，即模型完全照 schema 輸出
+    key_indent, item_indent = template_indent(prompt_template, get_task(data_type).root)
+    indent = len(item_indent) if isinstance(record, list) else len(key_indent)
+    target = json.dumps(record, ensure_ascii=False, indent=indent)
+    model = OracleModel(tokenizer, target)
+    decoder = SchemaDecoder(model, tokenizer, get_task(data_type).schema, prompt_template)
+    outputs = model.language_model(input_ids=torch.zeros(1, 0, dtype=torch.long))
+    text = decoder.decode(outputs, torch.ones(1, 1, dtype=torch.long), max_new_tokens=4096)
+    return text, free_decode(model, tokenizer), decoder.stats
+
+
+MERGES = ['",', '"\n', '0,', '0\n', '\\"', "[]", "[\n", "},", "\n}"]
+
+
+@pytest.mark.parametrize("merges", [(), MERGES], ids=["chars", "merged"])
+def test_dict_root_matches_free_decoding(merges):
+    fields = get_task("損益表").fields
+    record = {key: (i * 1000 if i % 2 else f"值{i}") for i, key in enumerate(fields)}
+    text, free_text, stats = schema_decode("損益表", record, merges)
+    assert json.loads(text) == record
+    assert text == free_text
+    assert stats["forced_tokens"] > stats["generated_tokens"]
+
+
+@pytest.mark.parametrize("merges", [(), MERGES], ids=["chars", "merged"])
+def test_list_root_matches_free_decoding(merges):
+    fields = get_task("員工報支").fields
+    record = [{key: f"v{j}{i}" for i, key in enumerate(fields)} for j in range(3)]
+    text, free_text, _ = schema_decode("員工報支", record, merges)
+    assert json.loads(text) == record
+    assert text == free_text
+
+
+@pytest.mark.parametrize("merges", [(), MERGES], ids=["chars", "merged"])
+def test_empty_list(merges):
+    text, free_text, _ = schema_decode("員工報支", [], merges)
+    assert json.loads(text) == []
+    assert text == free_text
+
+
+@pytest.mark.parametrize("merges", [(), MERGES], ids=["chars", "merged"])
+def test_values_with_quotes_and_newlines(merges):
+    fields = get_task("貸款申請書").fields
+    values = ['台北市"信義"區', "第一行\n第二行", '結尾引號"', "", "\\", '"\n"']
+    record = {key: values[i % len(values)] for i, key in enumerate(fields)}
+    text, free_text, _ = schema_decode("貸款申請書", record, merges)
+    assert json.loads(text) == record
+    assert text == free_text